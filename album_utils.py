@@ -0,0 +1,142 @@
+"""
+Album Utilities for the Photo Sharing App
+Albums carry a denormalized photo_count and cover_photo_id (the newest photo)
+so pages can show them without loading the album's photos. A session hook
+keeps both in step with every Photo insert, move and delete made through the
+ORM; repair_album_stats recomputes them from scratch.
+"""
+
+import logging
+from collections import Counter
+from sqlalchemy import event, inspect, select, func
+from app import db
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+def _album_id_change(photo):
+    """Get (old_album_id, new_album_id) for a photo in the current flush"""
+    history = inspect(photo).attrs.album_id.history
+    old = history.deleted[0] if history.deleted else (history.unchanged[0] if history.unchanged else None)
+    new = history.added[0] if history.added else old
+    return old, new
+
+def _cover_query(album_table, photo_table):
+    """Correlated subquery selecting an album's newest photo"""
+    return select(photo_table.c.id).where(
+        photo_table.c.album_id == album_table.c.id
+    ).order_by(
+        photo_table.c.uploaded_at.desc(),
+        photo_table.c.id.desc()
+    ).limit(1).scalar_subquery()
+
+def update_album_stats(connection, count_deltas, album_ids):
+    """Apply photo count deltas and recompute covers for the given albums"""
+    from models import Album, Photo
+
+    album_table = Album.__table__
+    photo_table = Photo.__table__
+
+    for album_id, delta in count_deltas.items():
+        if delta:
+            connection.execute(
+                album_table.update()
+                .where(album_table.c.id == album_id)
+                .values(photo_count=album_table.c.photo_count + delta)
+            )
+
+    if album_ids:
+        connection.execute(
+            album_table.update()
+            .where(album_table.c.id.in_(album_ids))
+            .values(cover_photo_id=_cover_query(album_table, photo_table))
+        )
+
+def repair_album_stats(room_id=None, only_drifted=False):
+    """
+    Recompute photo_count and cover_photo_id from the photo table
+    With only_drifted, albums whose stats are already right are left alone.
+    Returns the number of albums updated
+    """
+    from models import Album, Photo
+
+    album_table = Album.__table__
+    photo_table = Photo.__table__
+
+    photo_count = select(func.count(photo_table.c.id)).where(
+        photo_table.c.album_id == album_table.c.id
+    ).scalar_subquery()
+
+    cover_photo_id = _cover_query(album_table, photo_table)
+    statement = album_table.update().values(
+        photo_count=photo_count,
+        cover_photo_id=cover_photo_id
+    )
+    if only_drifted:
+        statement = statement.where(
+            (album_table.c.photo_count.is_distinct_from(photo_count)) |
+            (album_table.c.cover_photo_id.is_distinct_from(cover_photo_id))
+        )
+    if room_id is not None:
+        statement = statement.where(album_table.c.room_id == room_id)
+
+    with db.engine.begin() as connection:
+        result = connection.execute(statement)
+
+    logger.info(f"Recomputed stats for {result.rowcount} albums")
+    return result.rowcount
+
+@event.listens_for(db.session, 'after_flush')
+def _track_album_changes(session, flush_context):
+    """Update the stats of every album a photo entered or left in this flush"""
+    from models import Photo
+
+    count_deltas = Counter()
+    album_ids = set()
+
+    for photo in session.new:
+        if isinstance(photo, Photo) and photo.album_id:
+            count_deltas[photo.album_id] += 1
+            album_ids.add(photo.album_id)
+
+    for photo in session.deleted:
+        if isinstance(photo, Photo):
+            old, _ = _album_id_change(photo)
+            if old:
+                count_deltas[old] -= 1
+                album_ids.add(old)
+
+    for photo in session.dirty:
+        if not isinstance(photo, Photo) or photo in session.deleted:
+            continue
+        old, new = _album_id_change(photo)
+        if old != new:
+            if old:
+                count_deltas[old] -= 1
+                album_ids.add(old)
+            if new:
+                count_deltas[new] += 1
+                album_ids.add(new)
+        elif new and inspect(photo).attrs.uploaded_at.history.has_changes():
+            # A new upload time can change which photo is the cover
+            album_ids.add(new)
+
+    if not album_ids:
+        return
+
+    update_album_stats(session.connection(), count_deltas, album_ids)
+    session.info.setdefault('stale_album_ids', set()).update(album_ids)
+
+@event.listens_for(db.session, 'after_flush_postexec')
+def _expire_album_stats(session, flush_context):
+    """Make loaded Album objects reread the stats the flush just changed"""
+    from models import Album
+
+    album_ids = session.info.pop('stale_album_ids', None)
+    if not album_ids:
+        return
+
+    for album_id in album_ids:
+        album = session.identity_map.get(session.identity_key(Album, album_id))
+        if album is not None:
+            session.expire(album, ['photo_count', 'cover_photo_id'])
@@ -0,0 +1,187 @@
+"""
+Analytics Buffer for the Photo Sharing App
+This module collects analytics events in memory and writes them to the
+database in bulk from a background thread, so page views no longer pay for
+an INSERT and COMMIT of their own. Each batch also updates the daily rollup.
+
+Every app has a buffer of its own in app.extensions, so events are always
+written to the database of the app that recorded them; `analytics_buffer`
+is the buffer of the current app.
+"""
+
+import os
+import atexit
+import logging
+import threading
+import time
+import weakref
+from flask import current_app
+from werkzeug.local import LocalProxy
+from app import db
+from analytics_rollup import count_rollup_increments, apply_rollup_increments
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Buffers of every app in this process, stopped together at exit
+_buffers = weakref.WeakSet()
+
+class AnalyticsBuffer:
+    """
+    In-process buffer of Analytics rows
+    Rows are flushed with one executemany INSERT whenever flush_size events are
+    waiting or flush_interval_ms has passed, whichever comes first. When more than
+    max_size events are waiting new events are dropped rather than blocking requests.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = True
+        self.flush_size = 100
+        self.flush_interval = 1.0
+        self.max_size = 10000
+        self.shutdown_timeout = 5.0
+
+        self.flushed_count = 0
+        self.dropped_count = 0
+        self.flush_count = 0
+
+        self._events = []
+        self._condition = threading.Condition()
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('ANALYTICS_BUFFER_ENABLED', True)
+        self.flush_size = app.config.get('ANALYTICS_FLUSH_SIZE', 100)
+        self.flush_interval = app.config.get('ANALYTICS_FLUSH_INTERVAL_MS', 1000) / 1000.0
+        self.max_size = app.config.get('ANALYTICS_BUFFER_MAX_SIZE', 10000)
+        self.shutdown_timeout = app.config.get('ANALYTICS_SHUTDOWN_TIMEOUT', 5.0)
+        app.extensions['analytics_buffer'] = self
+        _buffers.add(self)
+
+    def _ensure_started(self):
+        """Start the flusher thread lazily so each forked worker gets its own"""
+        if self._thread is not None and self._pid == os.getpid():
+            return
+
+        with self._condition:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+
+            # Events copied from a parent process belong to the parent
+            self._events = []
+            self._stopping = False
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='analytics-flusher', daemon=True)
+            self._thread.start()
+
+    def add(self, row):
+        """Queue one Analytics row (a dict of column values); returns False if it was dropped"""
+        if not self.enabled:
+            self._write([row])
+            return True
+
+        self._ensure_started()
+
+        with self._condition:
+            if self._stopping or len(self._events) >= self.max_size:
+                self.dropped_count += 1
+                return False
+
+            self._events.append(row)
+            if len(self._events) >= self.flush_size:
+                self._condition.notify()
+        return True
+
+    def _take_batch(self):
+        with self._condition:
+            batch = self._events
+            self._events = []
+        return batch
+
+    def _run(self):
+        while True:
+            with self._condition:
+                deadline = time.monotonic() + self.flush_interval
+                while not self._stopping and len(self._events) < self.flush_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                stopping = self._stopping
+
+            self.flush()
+
+            if stopping:
+                return
+
+    def _write(self, batch):
+        from models import Analytics
+
+        try:
+            with self.app.app_context():
+                with db.engine.begin() as connection:
+                    connection.execute(Analytics.__table__.insert(), batch)
+                    # Keep the daily rollup in step with the raw rows
+                    apply_rollup_increments(connection, count_rollup_increments(batch))
+            with self._condition:
+                self.flushed_count += len(batch)
+                self.flush_count += 1
+        except Exception as e:
+            with self._condition:
+                self.dropped_count += len(batch)
+            logger.error(f"Error writing {len(batch)} analytics events: {str(e)}")
+
+    def flush(self):
+        """Write everything buffered so far"""
+        batch = self._take_batch()
+        if batch:
+            self._write(batch)
+
+    def shutdown(self, timeout=None):
+        """Stop the flusher, giving it at most `timeout` seconds to write what is buffered"""
+        timeout = self.shutdown_timeout if timeout is None else timeout
+
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                with self._condition:
+                    pending = len(self._events)
+                logger.warning(f"Analytics flusher did not finish within {timeout}s, {pending} events not written")
+                return
+
+        if self._pid == os.getpid():
+            self.flush()
+
+        logger.info(f"Analytics buffer stopped: {self.flushed_count} events flushed, {self.dropped_count} dropped")
+
+    def stats(self):
+        with self._condition:
+            pending = len(self._events)
+        return {
+            'pending': pending,
+            'flushed': self.flushed_count,
+            'dropped': self.dropped_count,
+            'flushes': self.flush_count
+        }
+
+def get_analytics_buffer(app=None):
+    """Get the analytics buffer of an app, by default the current one"""
+    return (app or current_app).extensions['analytics_buffer']
+
+analytics_buffer = LocalProxy(get_analytics_buffer)
+
+@atexit.register
+def _shutdown_buffers():
+    for buffer in list(_buffers):
+        buffer.shutdown()
@@ -0,0 +1,164 @@
+"""
+Analytics Rollup for the Photo Sharing App
+This module maintains per-(room, event type, day) counts of analytics events
+so dashboards read a handful of pre-aggregated rows instead of counting the
+raw Analytics table.
+"""
+
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy import func, cast, select
+from app import db
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+def count_rollup_increments(rows):
+    """Aggregate Analytics row dicts into {(room_id, event_type, day): count}"""
+    counts = Counter()
+    for row in rows:
+        counts[(row['room_id'], row['event_type'], row['timestamp'].date())] += 1
+    return counts
+
+def apply_rollup_increments(connection, counts):
+    """Add counts to the rollup table with one upsert statement"""
+    from models import AnalyticsDailyRollup
+
+    if not counts:
+        return
+
+    table = AnalyticsDailyRollup.__table__
+    params = [
+        {'room_id': room_id, 'event_type': event_type, 'day': day, 'count': count}
+        for (room_id, event_type, day), count in counts.items()
+    ]
+
+    dialect = connection.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+
+        statement = insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.room_id, table.c.event_type, table.c.day],
+            set_={'count': table.c.count + statement.excluded['count']}
+        )
+        connection.execute(statement, params)
+        return
+
+    # Other databases: update existing rows, insert the rest
+    for param in params:
+        result = connection.execute(
+            table.update()
+            .where(
+                table.c.room_id == param['room_id'],
+                table.c.event_type == param['event_type'],
+                table.c.day == param['day']
+            )
+            .values(count=table.c.count + param['count'])
+        )
+        if result.rowcount == 0:
+            connection.execute(table.insert(), param)
+
+def rebuild_rollup(room_id=None):
+    """
+    Recompute rollup rows from the raw Analytics table
+    Days before the oldest raw event (of the room, if one is given) keep their
+    rollup rows, since retention pruning deleted their events in whole days
+    (see maintenance).
+    Returns the number of rollup rows written
+    """
+    from models import Analytics, AnalyticsDailyRollup
+
+    table = AnalyticsDailyRollup.__table__
+
+    if db.engine.dialect.name == 'sqlite':
+        day = func.date(Analytics.timestamp)
+    else:
+        day = cast(Analytics.timestamp, db.Date)
+
+    query = select(
+        Analytics.room_id,
+        Analytics.event_type,
+        day.label('day'),
+        func.count(Analytics.id).label('count')
+    ).group_by(Analytics.room_id, Analytics.event_type, day)
+
+    oldest_query = select(func.min(Analytics.timestamp))
+    delete = table.delete()
+    if room_id is not None:
+        query = query.where(Analytics.room_id == room_id)
+        oldest_query = oldest_query.where(Analytics.room_id == room_id)
+        delete = delete.where(table.c.room_id == room_id)
+
+    with db.engine.begin() as connection:
+        oldest = connection.execute(oldest_query).scalar()
+        if oldest is None:
+            return 0
+        connection.execute(delete.where(table.c.day >= oldest.date()))
+        result = connection.execute(
+            table.insert().from_select(['room_id', 'event_type', 'day', 'count'], query)
+        )
+
+    logger.info(f"Rebuilt analytics rollup with {result.rowcount} rows")
+    return result.rowcount
+
+def get_event_totals(room_ids, event_types):
+    """Get all-time event counts as {(room_id, event_type): count} in one query"""
+    from models import AnalyticsDailyRollup
+
+    if not room_ids:
+        return {}
+
+    rows = db.session.query(
+        AnalyticsDailyRollup.room_id,
+        AnalyticsDailyRollup.event_type,
+        func.sum(AnalyticsDailyRollup.count)
+    ).filter(
+        AnalyticsDailyRollup.room_id.in_(room_ids),
+        AnalyticsDailyRollup.event_type.in_(event_types)
+    ).group_by(
+        AnalyticsDailyRollup.room_id,
+        AnalyticsDailyRollup.event_type
+    ).all()
+
+    return {(room_id, event_type): int(total or 0) for room_id, event_type, total in rows}
+
+def get_daily_series(room_ids, event_types, days):
+    """
+    Get per-day counts for the last `days` days (plus today) in one query
+    Returns (date_labels, {event_type: [count per day]})
+    """
+    from models import AnalyticsDailyRollup
+
+    end_day = datetime.utcnow().date()
+    start_day = end_day - timedelta(days=days)
+    all_days = [start_day + timedelta(days=i) for i in range(days + 1)]
+
+    date_labels = [day.strftime('%m/%d') for day in all_days]
+    series = {event_type: [0] * len(all_days) for event_type in event_types}
+
+    if not room_ids:
+        return date_labels, series
+
+    rows = db.session.query(
+        AnalyticsDailyRollup.day,
+        AnalyticsDailyRollup.event_type,
+        func.sum(AnalyticsDailyRollup.count)
+    ).filter(
+        AnalyticsDailyRollup.room_id.in_(room_ids),
+        AnalyticsDailyRollup.event_type.in_(event_types),
+        AnalyticsDailyRollup.day >= start_day,
+        AnalyticsDailyRollup.day <= end_day
+    ).group_by(
+        AnalyticsDailyRollup.day,
+        AnalyticsDailyRollup.event_type
+    ).all()
+
+    for day, event_type, total in rows:
+        series[event_type][(day - start_day).days] = int(total or 0)
+
+    return date_labels, series
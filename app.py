@@ -1,19 +1,14 @@
 import os
 import logging
 import secrets
-from datetime import datetime, timedelta
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, abort, send_file
+import weakref
+from flask import Flask, request, redirect, url_for, flash, session, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
-from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
 from werkzeug.middleware.proxy_fix import ProxyFix
-import hashlib
-import uuid
 from functools import wraps
 
 # Setup logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 # Initialize the database
@@ -22,36 +17,9 @@ class Base(DeclarativeBase):
 
 db = SQLAlchemy(model_class=Base)
 
-# Create the app
-app = Flask(__name__)
-app.secret_key = os.environ.get("SESSION_SECRET", secrets.token_hex(16))
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
-
-# Configure the database
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///instance/photo_sharing.db")
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
-
-# Configure uploads
-UPLOAD_FOLDER = 'static/uploads'
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload
-
-# Initialize the database with the app
-db.init_app(app)
-
-# Import models and initialize the database
-with app.app_context():
-    from models import User, Photo, Room, RoomMember, PhotoTag, ShareableLink, Analytics, FaceRecognitionSettings, Album
-    db.create_all()
-    
-    # Create default face recognition settings if not exists
-    from face_recognition_utils import init_face_recognition_settings
-    init_face_recognition_settings()
+def configure_logging(level=None):
+    """Configure root logging for an entry point; importing the app leaves logging alone"""
+    logging.basicConfig(level=level or os.environ.get("LOG_LEVEL", "INFO"))
 
 # Custom CSRF protection
 def generate_csrf_token():
@@ -59,15 +27,16 @@ def generate_csrf_token():
         session['csrf_token'] = secrets.token_hex(16)
     return session['csrf_token']
 
-app.jinja_env.globals['csrf_token'] = generate_csrf_token
-
+# Scripts send the token in the X-CSRF-TOKEN header, forms in a csrf_token field
 def csrf_protected(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if request.method == 'POST':
+        if request.method in ('POST', 'PUT', 'PATCH', 'DELETE'):
             token = session.get('csrf_token')
-            form_token = request.form.get('csrf_token')
-            if not token or token != form_token:
+            request_token = request.headers.get('X-CSRF-TOKEN') or request.form.get('csrf_token')
+            if not token or token != request_token:
+                if request.path.startswith('/api/'):
+                    return jsonify({'error': 'CSRF token validation failed'}), 400
                 flash('CSRF token validation failed. Please try again.', 'danger')
                 return redirect(url_for('index'))
         return f(*args, **kwargs)
@@ -83,9 +52,116 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-# Import routes
-from routes import *
+def load_config(app):
+    """Read the app configuration from the environment"""
+    app.secret_key = os.environ.get("SESSION_SECRET", secrets.token_hex(16))
+
+    # Configure the database
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///instance/photo_sharing.db")
+    # Connection pool for Postgres; SQLite gets its pragmas instead, see database_utils
+    app.config['DB_POOL_SIZE'] = int(os.environ.get("DB_POOL_SIZE", 10))
+    app.config['DB_MAX_OVERFLOW'] = int(os.environ.get("DB_MAX_OVERFLOW", 20))
+    app.config['DB_VALIDATE_IDLE'] = int(os.environ.get("DB_VALIDATE_IDLE", 30))
+
+    # Configure uploads
+    app.config['UPLOAD_FOLDER'] = 'static/uploads'
+    app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload
+
+    # Let the reverse proxy send photo files: 'x-sendfile' (Apache, lighttpd) or 'x-accel' (nginx), see serving_utils
+    app.config['SENDFILE_MODE'] = os.environ.get("SENDFILE_MODE")
+    app.config['X_ACCEL_PREFIX'] = os.environ.get("X_ACCEL_PREFIX", "/protected-uploads/")
+
+    # Keep sessions server-side and only a signed id in the cookie: 'database' or 'cookie', see session_utils
+    app.config['SESSION_BACKEND'] = os.environ.get("SESSION_BACKEND", "database")
+    app.config['SESSION_DATABASE_URI'] = os.environ.get("SESSION_DATABASE_URI")
+
+    # Face detection backend: 'face_recognition' (requires the face_recognition package) or 'deterministic'
+    app.config['FACE_EMBEDDING_BACKEND'] = os.environ.get("FACE_EMBEDDING_BACKEND", "deterministic")
+
+# Apps created in this process; fork hooks can't be removed, so one hook serves them all
+_apps = weakref.WeakSet()
+
+def _dispose_engines(app):
+    """Drop pooled connections inherited from the parent process"""
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    store = getattr(app.session_interface, 'store', None)
+    if store is not None:
+        store.dispose()
+
+def _dispose_all_engines():
+    for app in list(_apps):
+        _dispose_engines(app)
+
+os.register_at_fork(after_in_child=_dispose_all_engines)
+
+def create_app(config=None):
+    """
+    Create the app without touching the database
+    Nothing here opens a connection, so a preloading server can create the app
+    once and fork its workers. Run init_db (or 'flask upgrade-db') to create
+    tables, apply migrations and seed default settings.
+    """
+    app = Flask(__name__)
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+
+    load_config(app)
+    if config:
+        app.config.update(config)
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+    # Initialize the database with the app, tuned for its dialect
+    from database_utils import get_engine_options, configure_engine
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', get_engine_options(app.config))
+    db.init_app(app)
+    with app.app_context():
+        configure_engine(db.engine, app.config)
+
+    # Buffer analytics events and write them in batches
+    from analytics_buffer import AnalyticsBuffer
+    AnalyticsBuffer(app)
+
+    # Buffer download and link access counts and add them up in batches
+    from counter_buffer import CounterBuffer
+    counter_buffer = CounterBuffer(app)
+
+    # Store sessions as configured by SESSION_BACKEND
+    from session_utils import init_session_store
+    init_session_store(app)
+
+    # Import models and the session hooks that keep derived data in step:
+    # album covers and photo counts, blob references, cached room permissions
+    import models  # noqa: F401
+    import album_utils  # noqa: F401
+    import storage_utils  # noqa: F401
+    import permission_utils  # noqa: F401
+
+    app.jinja_env.globals['csrf_token'] = generate_csrf_token
+    app.jinja_env.globals['counter_value'] = counter_buffer.value
+
+    # Register routes and CLI commands
+    from routes import views
+    views.init_app(app)
+    from commands import cli
+    for command in cli.commands.values():
+        app.cli.add_command(command)
+
+    # Forked workers open their own connections
+    _apps.add(app)
+
+    return app
+
+def init_db(app):
+    """Create missing tables, apply pending migrations and seed default settings"""
+    from migrations import run_migrations
+    from face_recognition_utils import init_face_recognition_settings
+
+    with app.app_context():
+        db.create_all()
+        run_migrations()
+        init_face_recognition_settings()
 
-# Run the app
-if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+        store = getattr(app.session_interface, 'store', None)
+        if store is not None:
+            store.create_table()
@@ -0,0 +1,301 @@
+"""
+Batch Processing for the Photo Sharing App
+This module runs room-wide face recognition work as resumable batch runs:
+reprocessing every photo (detection fans out over a process pool) and
+retraining tag confidence from manual tags. Each chunk's changes are committed
+together with the run's progress cursor, so an interrupted run picks up where
+it stopped.
+"""
+
+import os
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from flask import current_app
+from app import db
+from job_queue import job_handler, enqueue_job, extend_lease, LeaseLost
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 50
+DEFAULT_RETRAIN_CHUNK_SIZE = 1000
+
+BATCH_JOB_TYPE = 'batch_face_recognition'
+
+# Kinds of batch run
+FACE_RECOGNITION = 'face_recognition'
+RETRAIN = 'retrain'
+
+def start_batch_run(room_id, user_id=None, kind=FACE_RECOGNITION):
+    """
+    Queue a batch run of the given kind for a room
+    Returns (run, started). An active run is returned as is; a failed run is resumed.
+    """
+    from models import BatchRun, Photo
+
+    latest = get_latest_batch_run(room_id, kind)
+    if latest and latest.is_active():
+        return latest, False
+
+    if latest and latest.status == 'failed':
+        run = latest
+        run.status = 'pending'
+        run.last_error = None
+    else:
+        run = BatchRun(
+            room_id=room_id,
+            kind=kind,
+            created_by=user_id,
+            status='pending',
+            total=Photo.query.filter_by(room_id=room_id).count()
+        )
+        db.session.add(run)
+        db.session.flush()
+
+    run.updated_at = datetime.utcnow()
+    enqueue_job(BATCH_JOB_TYPE, room_id=room_id, payload={'batch_run_id': run.id}, max_attempts=10)
+    db.session.commit()
+    return run, True
+
+def get_latest_batch_run(room_id, kind=FACE_RECOGNITION):
+    """Get the most recent batch run of a kind for a room"""
+    from models import BatchRun
+
+    return BatchRun.query.filter_by(room_id=room_id, kind=kind).order_by(BatchRun.id.desc()).first()
+
+def batch_progress(run):
+    """Summarize a batch run's progress for JSON responses"""
+    processed = (run.done_count or 0) + (run.failed_count or 0)
+    total = max(run.total or 0, processed)
+    remaining = total - processed
+
+    rate = None
+    eta_seconds = None
+    if run.started_at and processed:
+        end = run.finished_at or run.updated_at or datetime.utcnow()
+        elapsed = (end - run.started_at).total_seconds()
+        if elapsed > 0:
+            rate = processed / elapsed
+            eta_seconds = remaining / rate if run.is_active() else 0
+
+    return {
+        'id': run.id,
+        'room_id': run.room_id,
+        'kind': run.kind,
+        'status': run.status,
+        'done': run.done_count or 0,
+        'failed': run.failed_count or 0,
+        'total': total,
+        'percent': round(100.0 * processed / total, 1) if total else 100.0,
+        'rate': round(rate, 2) if rate is not None else None,
+        'eta_seconds': round(eta_seconds) if eta_seconds is not None else None,
+        'last_error': run.last_error,
+        'started_at': run.started_at.isoformat() if run.started_at else None,
+        'finished_at': run.finished_at.isoformat() if run.finished_at else None
+    }
+
+def _detect_photo(task):
+    """Run detection for one photo inside a pool process"""
+    from face_recognition_utils import detect_faces
+
+    photo_id, file_path, detect_options = task
+    if not os.path.exists(file_path):
+        return photo_id, None, 'Photo file not found'
+    try:
+        return photo_id, detect_faces(file_path, **detect_options), None
+    except Exception as e:
+        return photo_id, None, str(e)
+
+class BatchRunner:
+    """
+    Runs a BatchRun chunk by chunk in photo id order
+    Subclasses implement process_chunk and may set up shared state in prepare.
+    """
+
+    chunk_size_config = 'BATCH_CHUNK_SIZE'
+    default_chunk_size = DEFAULT_CHUNK_SIZE
+
+    def __init__(self, run, job=None, chunk_size=None):
+        self.run = run
+        self.job = job
+        self.chunk_size = chunk_size or current_app.config.get(self.chunk_size_config, self.default_chunk_size)
+
+    def _next_chunk(self):
+        from models import Photo
+
+        return Photo.query.filter(
+            Photo.room_id == self.run.room_id,
+            Photo.id > self.run.cursor
+        ).order_by(Photo.id).limit(self.chunk_size).all()
+
+    def _start(self):
+        from models import Photo
+
+        run = self.run
+        now = datetime.utcnow()
+        remaining = Photo.query.filter(
+            Photo.room_id == run.room_id,
+            Photo.id > (run.cursor or 0)
+        ).count()
+
+        run.cursor = run.cursor or 0
+        run.done_count = run.done_count or 0
+        run.failed_count = run.failed_count or 0
+        run.total = run.done_count + run.failed_count + remaining
+        run.status = 'running'
+        run.started_at = run.started_at or now
+        run.updated_at = now
+        db.session.commit()
+
+        if run.cursor:
+            logger.info(f"Resuming batch run {run.id} for room {run.room_id} after photo {run.cursor}")
+
+    def prepare(self):
+        """Set up anything shared by every chunk"""
+
+    def cleanup(self):
+        """Release what prepare set up"""
+
+    def process_chunk(self, photos):
+        """Process one chunk of photos without committing; returns (done, failed)"""
+        raise NotImplementedError
+
+    def execute(self):
+        """Process all remaining photos, committing after every chunk"""
+        run = self.run
+        self._start()
+        self.prepare()
+
+        try:
+            while True:
+                photos = self._next_chunk()
+                if not photos:
+                    break
+
+                done, failed = self.process_chunk(photos)
+                run.done_count += done
+                run.failed_count += failed
+
+                # Changes and progress for the chunk land in one transaction
+                run.cursor = photos[-1].id
+                run.updated_at = datetime.utcnow()
+                db.session.commit()
+
+                # Another worker resumes from the saved cursor
+                if self.job is not None and not extend_lease(self.job):
+                    raise LeaseLost(f"Lost the lease on batch run {run.id}")
+        finally:
+            self.cleanup()
+
+        run.status = 'done'
+        run.finished_at = datetime.utcnow()
+        run.updated_at = run.finished_at
+        db.session.commit()
+
+        logger.info(f"Batch run {run.id} ({run.kind}) finished: {run.done_count} processed, {run.failed_count} failed")
+        return run
+
+class FaceRecognitionBatch(BatchRunner):
+    """Re-detects faces in every photo of a room over a process pool"""
+
+    def __init__(self, run, job=None, chunk_size=None, processes=None, settings=None):
+        super().__init__(run, job, chunk_size)
+        self.processes = processes or current_app.config.get('BATCH_PROCESSES') or os.cpu_count()
+        # One settings snapshot is used for the whole run
+        self.settings = settings
+        self.pool = None
+
+    def prepare(self):
+        from face_recognition_utils import get_face_settings, get_embedding_backend
+
+        if self.settings is None:
+            self.settings = get_face_settings()
+        self.detect_options = {
+            'min_confidence': self.settings.min_confidence,
+            'backend': get_embedding_backend(),
+            'detection_model': self.settings.detection_algorithm,
+            'encoding_model': self.settings.face_encoding_model
+        }
+        self.album_cache = {}
+        self.pool = ProcessPoolExecutor(max_workers=self.processes)
+
+    def cleanup(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def process_chunk(self, photos):
+        from face_recognition_utils import apply_face_detections
+        from storage_utils import get_photo_path
+
+        tasks = [
+            (photo.id, get_photo_path(photo), self.detect_options)
+            for photo in photos
+        ]
+        results = {photo_id: (faces, error) for photo_id, faces, error in self.pool.map(_detect_photo, tasks)}
+
+        done = failed = 0
+        for photo in photos:
+            faces, error = results[photo.id]
+            if error:
+                logger.warning(f"Batch run {self.run.id} skipped photo {photo.id}: {error}")
+                failed += 1
+                continue
+
+            apply_face_detections(photo, faces, self.settings, self.album_cache)
+            done += 1
+        return done, failed
+
+class RetrainBatch(BatchRunner):
+    """Recomputes automatic tag confidence from manual tags, a chunk of photos per statement"""
+
+    chunk_size_config = 'RETRAIN_CHUNK_SIZE'
+    default_chunk_size = DEFAULT_RETRAIN_CHUNK_SIZE
+
+    def prepare(self):
+        from face_recognition_utils import get_confirmed_names
+
+        self.confirmed_names = get_confirmed_names(self.run.room_id)
+        logger.info(f"Retraining room {self.run.room_id} with {len(self.confirmed_names)} confirmed names")
+
+    def process_chunk(self, photos):
+        from face_recognition_utils import retrain_face_recognition_model
+
+        retrain_face_recognition_model(
+            self.run.room_id,
+            photo_ids=[photo.id for photo in photos],
+            confirmed_names=self.confirmed_names
+        )
+        return len(photos), 0
+
+BATCH_RUNNERS = {
+    FACE_RECOGNITION: FaceRecognitionBatch,
+    RETRAIN: RetrainBatch
+}
+
+@job_handler(BATCH_JOB_TYPE)
+def run_batch_job(job):
+    """Background job handler that executes (or resumes) a batch run"""
+    from models import BatchRun
+
+    run = db.session.get(BatchRun, job.get_payload().get('batch_run_id'))
+    if not run:
+        logger.info(f"Skipping batch job {job.id}, its batch run was deleted")
+        return
+    if run.status == 'done':
+        return
+
+    attempts = job.attempts
+    try:
+        BATCH_RUNNERS[run.kind](run, job=job).execute()
+    except LeaseLost:
+        raise
+    except Exception as e:
+        db.session.rollback()
+        run.last_error = str(e)
+        run.updated_at = datetime.utcnow()
+        if attempts >= job.max_attempts:
+            run.status = 'failed'
+        db.session.commit()
+        raise
@@ -0,0 +1,120 @@
+"""
+Batch upload benchmark
+Uploads the same kind of multi-file batch two ways: the way upload_photo
+used to, storing and committing one file after the other, and with
+add_photo_batch, which stores the files on a thread pool and commits every
+photo at once. Reports files per second and the commits each way needed.
+
+Usage: python benchmarks/batch_upload.py [--files 50] [--width 2400] [--workers 4] [--database-url URL]
+Each way uploads its own images so neither reuses the other's blobs or derivatives.
+"""
+
+import io
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+def make_images(count, width, seed):
+    """Encode `count` distinct JPEGs with enough detail to compress like photos"""
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.RandomState(seed)
+    height = width * 3 // 4
+    images = []
+    for _ in range(count):
+        pixels = rng.randint(0, 256, (height // 16, width // 16, 3), dtype=np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).resize((width, height), Image.BILINEAR).save(buffer, 'JPEG', quality=90)
+        images.append(buffer.getvalue())
+    return images
+
+def as_files(images, prefix):
+    """Wrap encoded images as the FileStorage objects a multipart request hands to the view"""
+    from werkzeug.datastructures import FileStorage
+
+    return [FileStorage(io.BytesIO(data), filename=f'{prefix}{i}.jpg', content_type='image/jpeg') for i, data in enumerate(images)]
+
+def upload_sequentially(room, files, user_id):
+    """The old upload_photo loop: store, add and commit each file in turn"""
+    from app import db
+    from storage_utils import store_upload
+    from upload_utils import add_photo, is_allowed_extension
+    from werkzeug.utils import secure_filename
+
+    successful = 0
+    for file in files:
+        if not is_allowed_extension(file.filename):
+            continue
+        try:
+            stored = store_upload(file)
+            add_photo(room, stored, secure_filename(file.filename), '', user_id)
+            db.session.commit()
+            successful += 1
+        except Exception:
+            db.session.rollback()
+    return successful
+
+def upload_batch(room, files, user_id):
+    from upload_utils import add_photo_batch
+
+    uploads, failures = add_photo_batch(room, files, '', user_id)
+    return len(uploads)
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare per-file and batched multi-file uploads')
+    parser.add_argument('--files', type=int, default=50, help='Files in the batch')
+    parser.add_argument('--width', type=int, default=2400, help='Image width in pixels')
+    parser.add_argument('--workers', type=int, default=4, help='UPLOAD_WORKERS for the batched upload')
+    parser.add_argument('--database-url', default=None, help='Empty database to use (default: temporary SQLite file)')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='batch-upload-')
+    os.environ['DATABASE_URL'] = args.database_url or f'sqlite:///{os.path.join(workdir, "uploads.db")}'
+    os.chdir(workdir)
+
+    from sqlalchemy import event
+    from app import create_app, init_db, db
+
+    app = create_app({'UPLOAD_WORKERS': args.workers, 'ANALYTICS_BUFFER_ENABLED': False})
+    init_db(app)
+
+    print(f'{args.files} files of {args.width}px per batch, {args.workers} upload workers\n')
+    with app.app_context():
+        from models import User, Room
+
+        user = User(username='bench', email='bench@example.com', password_hash='-')
+        db.session.add(user)
+        db.session.flush()
+        rooms = {way: Room(name=way, creator_id=user.id, is_public=True) for way in ('sequential', 'batch')}
+        db.session.add_all(rooms.values())
+        db.session.commit()
+        user_id = user.id
+        room_ids = {way: room.id for way, room in rooms.items()}
+
+        commits = []
+        event.listen(db.engine, 'commit', lambda connection: commits.append(1))
+
+    for seed, (way, upload) in enumerate((('sequential', upload_sequentially), ('batch', upload_batch))):
+        images = make_images(args.files, args.width, seed)
+        size = sum(len(data) for data in images)
+
+        with app.test_request_context():
+            room = db.session.get(Room, room_ids[way])
+            files = as_files(images, way)
+            commits.clear()
+            start = time.perf_counter()
+            successful = upload(room, files, user_id)
+            elapsed = time.perf_counter() - start
+
+        print(f'{way}: {successful} photos in {elapsed:.2f}s, {successful / elapsed:.1f} files/s, {size / elapsed / 1e6:.1f} MB/s')
+        print(f'    {len(commits)} commits')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""
+Concurrency benchmark
+Runs a mixed read/write load from several processes and threads against a
+seeded database, once with the old engine settings (rollback journal, driver
+defaults, a ping on every checkout) and once with the per-dialect profile
+from database_utils.
+Reads fetch a room's photo feed; writes are photo views, each of which
+records an analytics event straight to the database. Reports throughput,
+latency and failed requests or dropped writes for each profile.
+
+Usage: python benchmarks/concurrency.py [--processes 4] [--threads 2] [--seconds 5] [--write-ratio 0.3] [--database-url URL]
+Each profile gets a fresh temporary SQLite file unless --database-url is given.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The engine settings app.py used for every database before per-dialect profiles
+BASELINE_CONFIG = {
+    'SQLALCHEMY_ENGINE_OPTIONS': {'pool_recycle': 300, 'pool_pre_ping': True},
+    'SQLITE_PRAGMAS': {},
+    'DB_VALIDATE_IDLE': None,
+}
+
+def _create_app(profile):
+    from app import create_app
+
+    config = dict(BASELINE_CONFIG) if profile == 'baseline' else {}
+    config['ANALYTICS_BUFFER_ENABLED'] = False
+    return create_app(config)
+
+def _load_process(profile, threads, deadline, write_ratio, user_id, photo_ids, seed_value, results):
+    """Run `threads` client threads in this process until the deadline, like one gunicorn worker"""
+    app = _create_app(profile)
+    latencies = []
+    failed = [0]
+    lock = threading.Lock()
+
+    def client_thread(thread_seed):
+        rng = random.Random(thread_seed)
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = user_id
+
+        while time.time() < deadline:
+            url = f'/photo/{rng.choice(photo_ids)}' if rng.random() < write_ratio else '/api/room/1/photos'
+            start = time.perf_counter()
+            try:
+                ok = client.get(url).status_code == 200
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if not ok:
+                    failed[0] += 1
+
+    workers = [threading.Thread(target=client_thread, args=(seed_value * 1000 + i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    results.put((latencies, failed[0], app.extensions['analytics_buffer'].dropped_count))
+
+def run_load(profile, processes, threads, seconds, write_ratio):
+    """Seed the database, run the load with one engine profile and print the results as JSON"""
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    from app import db, init_db
+    import synthetic_data
+
+    app = _create_app(profile)
+    init_db(app)
+
+    with app.app_context():
+        from models import Photo
+
+        user_id = synthetic_data.seed(rooms=2, photos_per_room=500, events_per_room=1000, members_per_room=5, empty_rooms=50)
+        db.session.commit()
+        photo_ids = [photo_id for (photo_id,) in db.session.query(Photo.id).filter(Photo.room_id == 1)]
+        db.engine.dispose()
+
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    deadline = time.time() + seconds
+    workers = [
+        context.Process(target=_load_process, args=(profile, threads, deadline, write_ratio, user_id, photo_ids, i, results))
+        for i in range(processes)
+    ]
+    for process in workers:
+        process.start()
+
+    latencies = []
+    failed = dropped = 0
+    for _ in workers:
+        process_latencies, process_failed, process_dropped = results.get()
+        latencies.extend(process_latencies)
+        failed += process_failed
+        dropped += process_dropped
+    for process in workers:
+        process.join()
+
+    latencies.sort()
+    print(json.dumps({
+        'requests': len(latencies),
+        'throughput': len(latencies) / seconds,
+        'p50': latencies[len(latencies) // 2],
+        'p95': latencies[int(len(latencies) * 0.95)],
+        'failed': failed,
+        'dropped_writes': dropped
+    }))
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare engine profiles under mixed read/write load')
+    parser.add_argument('--processes', type=int, default=4, help='Worker processes, like gunicorn workers')
+    parser.add_argument('--threads', type=int, default=2, help='Client threads per process')
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--write-ratio', type=float, default=0.3, help='Share of requests that write')
+    parser.add_argument('--database-url', default=None, help='Empty database to use for both runs (default: temporary SQLite files)')
+    parser.add_argument('--profile', choices=['baseline', 'tuned'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.profile:
+        run_load(args.profile, args.processes, args.threads, args.seconds, args.write_ratio)
+        return
+
+    print(f'{args.processes} processes x {args.threads} threads for {args.seconds:g}s, {args.write_ratio:.0%} writes\n')
+    for profile in ('baseline', 'tuned'):
+        workdir = tempfile.mkdtemp(prefix=f'concurrency-{profile}-')
+        env = dict(os.environ, LOG_LEVEL='CRITICAL', SESSION_SECRET='concurrency-benchmark')
+        env['DATABASE_URL'] = args.database_url or f'sqlite:///{os.path.join(workdir, "load.db")}'
+
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--profile', profile, '--processes', str(args.processes), '--threads', str(args.threads),
+             '--seconds', str(args.seconds), '--write-ratio', str(args.write_ratio)],
+            cwd=workdir, env=env, check=True, capture_output=True, text=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+
+        print(f'{profile}: {result["throughput"]:.0f} requests/s over {result["requests"]} requests')
+        print(f'    p50 {result["p50"] * 1e3:.1f} ms, p95 {result["p95"] * 1e3:.1f} ms')
+        print(f'    {result["failed"]} failed requests, {result["dropped_writes"]} dropped writes')
+
+if __name__ == '__main__':
+    main()
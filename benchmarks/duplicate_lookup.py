@@ -0,0 +1,58 @@
+"""
+Duplicate lookup benchmark
+Fills a room hash index with N random perceptual hashes and times
+near-duplicate lookups against it, half of them for near-copies of stored
+photos and half for new ones.
+
+Usage: python benchmarks/duplicate_lookup.py [--photos 100000] [--lookups 10000]
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def main():
+    parser = argparse.ArgumentParser(description='Time per-room near-duplicate lookups')
+    parser.add_argument('--photos', type=int, default=100000, help='Photos in the room')
+    parser.add_argument('--lookups', type=int, default=10000)
+    parser.add_argument('--max-distance', type=int, default=6)
+    args = parser.parse_args()
+
+    os.environ.setdefault('DATABASE_URL', 'sqlite://')
+    import app  # noqa: F401 - set up the app before its modules
+    from duplicate_utils import HashIndex
+
+    rng = np.random.default_rng(0)
+    hashes = rng.integers(np.iinfo(np.int64).min, np.iinfo(np.int64).max, args.photos, dtype=np.int64)
+
+    index = HashIndex(room_id=0)
+    index.add_many(np.arange(1, args.photos + 1), hashes)
+
+    # Near-copies flip a few bits of a stored hash
+    queries = []
+    for i in range(args.lookups):
+        if i % 2:
+            queries.append(int(rng.integers(np.iinfo(np.int64).min, np.iinfo(np.int64).max, dtype=np.int64)))
+        else:
+            value = int(hashes[rng.integers(0, args.photos)])
+            for bit in rng.choice(63, size=3, replace=False):
+                value ^= 1 << int(bit)
+            queries.append(value)
+
+    found = 0
+    start = time.perf_counter()
+    for query in queries:
+        if index.nearest(query, args.max_distance):
+            found += 1
+    seconds = time.perf_counter() - start
+
+    print(f'{args.lookups} lookups over {args.photos} photos in {seconds:.2f}s: {seconds / args.lookups * 1e6:.0f} us per lookup')
+    print(f'{found} near-duplicates found (expected about {args.lookups // 2})')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Face matching benchmark
+Builds a room index of N known faces from the deterministic backend's people,
+then times loading it from stored embedding bytes and matching new faces
+against it.
+
+Usage: python benchmarks/face_matching.py [--faces 100000] [--queries 1000]
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def main():
+    parser = argparse.ArgumentParser(description='Time per-room face matching')
+    parser.add_argument('--faces', type=int, default=100000, help='Known faces in the room')
+    parser.add_argument('--people', type=int, default=500, help='Distinct people among them')
+    parser.add_argument('--queries', type=int, default=1000, help='New faces to match')
+    parser.add_argument('--tolerance', type=float, default=0.6)
+    args = parser.parse_args()
+
+    os.environ.setdefault('DATABASE_URL', 'sqlite://')
+    import app  # noqa: F401 - set up the app before its modules
+    from face_index import FaceIndex, EMBEDDING_SIZE, encode_embedding, EMBEDDING_DTYPE
+    from face_recognition_utils import _person_embedding, DETERMINISTIC_NOISE
+
+    rng = np.random.default_rng(0)
+    people = np.stack([_person_embedding(k) for k in range(args.people)])
+    known_people = rng.integers(0, args.people, args.faces)
+    known = people[known_people] + rng.normal(0, DETERMINISTIC_NOISE, (args.faces, EMBEDDING_SIZE))
+    blobs = [encode_embedding(embedding) for embedding in known]
+
+    # Loading mirrors FaceIndex.refresh: one join of the stored bytes
+    start = time.perf_counter()
+    index = FaceIndex(room_id=0)
+    embeddings = np.frombuffer(b''.join(blobs), dtype=EMBEDDING_DTYPE).reshape(-1, EMBEDDING_SIZE)
+    index.add_many(np.arange(1, args.faces + 1), embeddings)
+    load_seconds = time.perf_counter() - start
+
+    query_people = rng.integers(0, args.people, args.queries)
+    queries = people[query_people] + rng.normal(0, DETERMINISTIC_NOISE, (args.queries, EMBEDDING_SIZE))
+
+    correct = 0
+    start = time.perf_counter()
+    for person, query in zip(query_people, queries):
+        candidates = index.candidates(query, args.tolerance)
+        if candidates and known_people[candidates[0][0] - 1] == person:
+            correct += 1
+    match_seconds = time.perf_counter() - start
+
+    print(f'Index of {args.faces} faces ({index.size * EMBEDDING_SIZE * 4 / 1e6:.1f} MB) loaded in {load_seconds * 1000:.1f} ms')
+    print(f'{args.queries} matches in {match_seconds:.2f}s: {match_seconds / args.queries * 1000:.2f} ms per face')
+    print(f'{correct}/{args.queries} matched to the right person')
+
+if __name__ == '__main__':
+    main()
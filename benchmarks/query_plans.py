@@ -0,0 +1,157 @@
+"""
+Query plan regression check
+Seeds a large synthetic dataset, requests every hot page and API endpoint
+through the Flask test client while recording the SELECT statements they
+issue, then runs EXPLAIN (Postgres) or EXPLAIN QUERY PLAN (SQLite) on each
+one. Exits non-zero if any statement falls back to a full table scan.
+
+Usage: python benchmarks/query_plans.py [--database-url URL] [--rooms N] [--photos-per-room N]
+The database must be empty; by default a temporary SQLite file is used.
+"""
+
+import os
+import re
+import sys
+import argparse
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Tables that stay tiny no matter how much the app is used
+SMALL_TABLES = {'face_recognition_settings', 'schema_migration'}
+
+SQLITE_SCAN = re.compile(r'^SCAN (\w+)')
+POSTGRES_SCAN = re.compile(r'Seq Scan on (\w+)')
+
+def hot_requests(room_id, photo_id, album_id, link_token, cursor):
+    """Pages and endpoints whose queries must stay indexed"""
+    return [
+        ('room', f'/room/{room_id}'),
+        ('view_photo', f'/photo/{photo_id}'),
+        ('photo_thumbnail', f'/photo/{photo_id}/thumb/grid'),
+        ('download_photo', f'/photo/{photo_id}/download'),
+        ('face_recognition_status', f'/api/photo/{photo_id}/face-recognition-status'),
+        ('api_room_photos', f'/api/room/{room_id}/photos'),
+        ('api_room_photos_next_page', f'/api/room/{room_id}/photos?after={cursor}'),
+        ('view_album', f'/album/{album_id}'),
+        ('api_album_photos', f'/api/album/{album_id}/photos'),
+        ('download_room_zip', f'/room/{room_id}/download.zip'),
+        ('download_album_zip', f'/album/{album_id}/download.zip'),
+        ('join_room', '/join-room'),
+        ('share_room', f'/room/{room_id}/share'),
+        ('access_shared_link', f'/s/{link_token}'),
+        ('dashboard', '/dashboard'),
+        ('room_analytics', f'/room/{room_id}/analytics'),
+        ('api_room_analytics', f'/api/room/{room_id}/analytics?days=30'),
+        ('face_recognition_settings', '/face-recognition-settings'),
+        ('face_recognition_progress', f'/api/room/{room_id}/face-recognition-progress'),
+        ('api_face_recognition_settings', '/api/face_recognition_settings'),
+    ]
+
+def explain(connection, statement, parameters):
+    """Return the plan lines for a statement"""
+    if connection.dialect.name == 'sqlite':
+        rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).fetchall()
+        return [row[-1] for row in rows]
+    rows = connection.exec_driver_sql(f'EXPLAIN {statement}', parameters).fetchall()
+    return [row[0] for row in rows]
+
+def full_scans(dialect, plan, tables):
+    """Find large tables that a plan reads in full"""
+    pattern = SQLITE_SCAN if dialect == 'sqlite' else POSTGRES_SCAN
+    scanned = []
+    for line in plan:
+        match = pattern.search(line.strip())
+        if match and match.group(1) in tables and match.group(1) not in SMALL_TABLES:
+            scanned.append(match.group(1))
+    return scanned
+
+def main():
+    parser = argparse.ArgumentParser(description='Fail if a hot query plans a full table scan')
+    parser.add_argument('--database-url', default=None, help='Empty database to seed (default: temporary SQLite file)')
+    parser.add_argument('--rooms', type=int, default=20)
+    parser.add_argument('--photos-per-room', type=int, default=2000)
+    parser.add_argument('--events-per-room', type=int, default=5000)
+    parser.add_argument('--verbose', action='store_true', help='Print every plan')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='query-plans-')
+    os.environ['DATABASE_URL'] = args.database_url or f'sqlite:///{os.path.join(workdir, "plans.db")}'
+    os.chdir(workdir)
+
+    from sqlalchemy import event
+    from app import create_app, init_db, db
+    import synthetic_data
+
+    app = create_app({'ANALYTICS_BUFFER_ENABLED': False})
+    init_db(app)
+
+    with app.app_context():
+        print(f'Seeding {args.rooms} rooms x {args.photos_per_room} photos...')
+        user_id = synthetic_data.seed(args.rooms, args.photos_per_room, args.events_per_room)
+
+        with db.engine.begin() as connection:
+            connection.exec_driver_sql('ANALYZE')
+
+        from models import Photo, Album, ShareableLink
+        from pagination_utils import encode_cursor
+        room_id = 1
+        photo_id = Photo.query.filter_by(room_id=room_id).first().id
+        album_id = Album.query.filter_by(room_id=room_id).first().id
+        cursor = encode_cursor(Photo.query.filter_by(room_id=room_id).order_by(Photo.uploaded_at.desc()).first())
+        link_token = ShareableLink.query.filter_by(room_id=room_id).order_by(ShareableLink.expires_at.desc()).first().token
+        tables = set(db.metadata.tables)
+        engine = db.engine
+
+    captured = []
+    current = {'route': None}
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def capture(connection, cursor, statement, parameters, context, executemany):
+        if current['route'] and not executemany and statement.lstrip().upper().startswith('SELECT'):
+            captured.append((current['route'], statement, parameters))
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+        session['csrf_token'] = 'query-plans'
+
+    for route, url in hot_requests(room_id, photo_id, album_id, link_token, cursor):
+        current['route'] = route
+        response = client.get(url)
+        # Streamed responses only run their queries as the body is read
+        response.get_data()
+        if response.status_code >= 500:
+            print(f'{route}: {url} returned {response.status_code}')
+    current['route'] = None
+
+    failures = []
+    seen = set()
+    with app.app_context():
+        with engine.connect() as connection:
+            for route, statement, parameters in captured:
+                key = (route, statement)
+                if key in seen:
+                    continue
+                seen.add(key)
+
+                plan = explain(connection, statement, parameters)
+                scanned = full_scans(connection.dialect.name, plan, tables)
+                if args.verbose or scanned:
+                    print(f'\n[{route}] {" ".join(statement.split())}')
+                    for line in plan:
+                        print(f'    {line}')
+                if scanned:
+                    failures.append((route, scanned))
+
+    print(f'\nChecked {len(seen)} distinct queries from {len(hot_requests(0, 0, 0, "", ""))} endpoints')
+    if failures:
+        for route, scanned in failures:
+            print(f'FULL SCAN in {route}: {", ".join(scanned)}')
+        sys.exit(1)
+    print('No full table scans')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Session overhead benchmark
+Gives a guest who unlocked N rooms the same session under Flask's signed
+cookie and under the server-side store, then compares the cookie the browser
+sends with every request and the time per request for a static file and for
+a room's photo feed.
+
+Usage: python benchmarks/session_overhead.py [--rooms-unlocked 500] [--requests 500]
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+def time_requests(client, url, count):
+    """Mean seconds per GET of a URL"""
+    response = client.get(url)
+    if response.status_code != 200:
+        raise SystemExit(f'{url} returned {response.status_code}')
+    start = time.perf_counter()
+    for _ in range(count):
+        client.get(url).get_data()
+    return (time.perf_counter() - start) / count
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare cookie and server-side session overhead')
+    parser.add_argument('--rooms-unlocked', type=int, default=500, help='Rooms in the guest session')
+    parser.add_argument('--requests', type=int, default=500, help='Requests timed per URL')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='session-overhead-')
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(workdir, "sessions.db")}'
+    os.chdir(workdir)
+
+    from flask.sessions import SecureCookieSessionInterface
+    from app import create_app, init_db
+    from session_utils import ServerSideSessionInterface, DatabaseSessionStore
+    import synthetic_data
+
+    app = create_app({'ANALYTICS_BUFFER_ENABLED': False})
+    init_db(app)
+
+    with app.app_context():
+        synthetic_data.seed(rooms=1, photos_per_room=50, events_per_room=0, members_per_room=1, empty_rooms=args.rooms_unlocked)
+
+    # Room 1 is private; the guest unlocked it and every empty room with its access code
+    access_codes = {str(room_id): f'code{room_id:06d}' for room_id in range(1, args.rooms_unlocked + 2)}
+    urls = [('static file', '/static/css/custom.css'), ('photo feed', '/api/room/1/photos')]
+
+    interfaces = [
+        ('cookie', SecureCookieSessionInterface()),
+        ('database', ServerSideSessionInterface(DatabaseSessionStore()))
+    ]
+
+    print(f'Guest with {len(access_codes)} unlocked rooms, {args.requests} requests per URL\n')
+    for name, interface in interfaces:
+        app.session_interface = interface
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['csrf_token'] = 'session-overhead'
+            session['room_access_codes'] = access_codes
+
+        cookie = client.get_cookie(app.config['SESSION_COOKIE_NAME'])
+        print(f'{name}: cookie {len(cookie.value)} bytes')
+        for label, url in urls:
+            seconds = time_requests(client, url, args.requests)
+            print(f'    {label:<12} {seconds * 1e3:.2f} ms per request')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Startup benchmark
+Boots the app in fresh interpreters, the way each gunicorn worker or CLI
+invocation does, and reports the time from the first import to the app being
+created and to the first request being answered, and how many statements
+reach the database along the way. Creating the app should issue none.
+
+Usage: python benchmarks/startup.py [--runs 10] [--database-url URL]
+The database is set up once with init_db; by default a temporary SQLite file is used.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def boot():
+    """Create the app and answer one request, printing the measurements as JSON"""
+    start = time.perf_counter()
+
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    statements = []
+    event.listen(Engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+
+    from app import create_app
+    imported = time.perf_counter()
+
+    app = create_app()
+    app.config['ANALYTICS_BUFFER_ENABLED'] = False
+    created = time.perf_counter()
+    boot_statements = len(statements)
+
+    response = app.test_client().get('/')
+    answered = time.perf_counter()
+    if response.status_code != 200:
+        raise SystemExit(f'/ returned {response.status_code}')
+
+    print(json.dumps({
+        'import': imported - start,
+        'create_app': created - imported,
+        'first_request': answered - start,
+        'boot_statements': boot_statements,
+        'first_request_statements': len(statements) - boot_statements
+    }))
+
+def main():
+    parser = argparse.ArgumentParser(description='Time app startup in fresh processes')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--database-url', default=None, help='Database to boot against (default: temporary SQLite file)')
+    parser.add_argument('--boot', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.boot:
+        sys.path.insert(0, ROOT)
+        boot()
+        return
+
+    workdir = tempfile.mkdtemp(prefix='startup-')
+    env = dict(os.environ)
+    env['DATABASE_URL'] = args.database_url or f'sqlite:///{os.path.join(workdir, "startup.db")}'
+    env['SESSION_SECRET'] = 'startup-benchmark'
+
+    # Tables and default settings exist before the workers start, as after 'flask upgrade-db'
+    subprocess.run(
+        [sys.executable, '-c', 'import app; app.init_db(app.create_app())'],
+        cwd=workdir, env=dict(env, PYTHONPATH=ROOT), check=True, capture_output=True
+    )
+
+    results = []
+    for _ in range(args.runs):
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--boot'],
+            cwd=workdir, env=env, check=True, capture_output=True, text=True
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f'{args.runs} cold starts (median)')
+    for key, label in (('import', 'import app'), ('create_app', 'create_app()'), ('first_request', 'import to first response')):
+        print(f'    {label:<26} {statistics.median(r[key] for r in results) * 1e3:.1f} ms')
+    print(f'    statements while booting   {max(r["boot_statements"] for r in results)}')
+    print(f'    statements for GET /       {max(r["first_request_statements"] for r in results)}')
+
+if __name__ == '__main__':
+    main()
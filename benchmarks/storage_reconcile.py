@@ -0,0 +1,105 @@
+"""
+Storage reconciliation benchmark
+Builds an upload tree of blobs fanned out like the blob store, with a photo
+for most of them and some orphans, then runs one full reconcile_storage
+pass over it. Reports files checked per second, the orphans quarantined and
+the peak memory the pass allocated, which should stay flat as the tree grows.
+
+Usage: python benchmarks/storage_reconcile.py [--files 100000] [--orphans 0.01] [--batch-size 1000] [--database-url URL]
+Files are empty, so the tree mostly costs inodes; the database and tree go in a temporary directory.
+"""
+
+import os
+import sys
+import time
+import random
+import hashlib
+import argparse
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def build_tree(room_id, user_id, files, orphan_ratio, seed):
+    """Write `files` empty blobs and add a photo for each one that isn't meant to be an orphan"""
+    from app import db
+    from models import Blob, Photo
+    from storage_utils import get_blob_path
+
+    rng = random.Random(seed)
+    old = time.time() - 2 * 86400
+    orphans = 0
+    blobs, photos = [], []
+
+    for i in range(files):
+        digest = hashlib.sha256(f'{seed}-{i}'.encode()).hexdigest()
+        path = get_blob_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, 'wb').close()
+        os.utime(path, (old, old))
+
+        if rng.random() < orphan_ratio:
+            orphans += 1
+            continue
+        blobs.append({'digest': digest, 'size': 0, 'ref_count': 1})
+        photos.append({'filename': digest, 'original_filename': f'{i}.jpg', 'room_id': room_id, 'user_id': user_id, 'blob_digest': digest})
+
+        if len(photos) >= 5000:
+            db.session.execute(Blob.__table__.insert(), blobs)
+            db.session.execute(Photo.__table__.insert(), photos)
+            db.session.commit()
+            blobs, photos = [], []
+
+    if photos:
+        db.session.execute(Blob.__table__.insert(), blobs)
+        db.session.execute(Photo.__table__.insert(), photos)
+        db.session.commit()
+    return orphans
+
+def main():
+    parser = argparse.ArgumentParser(description='Time a full storage reconciliation pass')
+    parser.add_argument('--files', type=int, default=100000, help='Blobs in the upload tree')
+    parser.add_argument('--orphans', type=float, default=0.01, help='Share of blobs without a photo')
+    parser.add_argument('--batch-size', type=int, default=1000, help='Files looked up per query')
+    parser.add_argument('--database-url', default=None, help='Empty database to use (default: temporary SQLite file)')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='storage-reconcile-')
+    os.environ['DATABASE_URL'] = args.database_url or f'sqlite:///{os.path.join(workdir, "storage.db")}'
+    os.chdir(workdir)
+
+    from app import create_app, init_db, db
+
+    app = create_app({'UPLOAD_FOLDER': os.path.join(workdir, 'uploads')})
+    init_db(app)
+
+    with app.app_context():
+        from models import User, Room
+        from storage_reconciler import reconcile_storage
+
+        user = User(username='bench', email='bench@example.com', password_hash='-')
+        db.session.add(user)
+        db.session.flush()
+        room = Room(name='bench', creator_id=user.id, is_public=True)
+        db.session.add(room)
+        db.session.commit()
+
+        start = time.perf_counter()
+        orphans = build_tree(room.id, user.id, args.files, args.orphans, seed=1)
+        print(f'Built {args.files} files, {orphans} of them orphans, in {time.perf_counter() - start:.1f}s\n')
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = reconcile_storage(batch_size=args.batch_size, now=datetime.utcnow() + timedelta(seconds=1))
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    print(f"Checked {result['checked']} files in {elapsed:.1f}s, {result['checked'] / elapsed:.0f} files/s")
+    print(f"    {result['quarantined']} orphans quarantined, pass completed: {result['completed']}")
+    print(f'    peak memory allocated during the pass: {peak / 1e6:.1f} MB')
+
+if __name__ == '__main__':
+    main()
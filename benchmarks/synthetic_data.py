@@ -0,0 +1,115 @@
+"""
+Synthetic dataset for benchmarks and query plan checks
+Seeds users, rooms, photos, tags, albums, members, links and analytics events
+with Core bulk inserts so large datasets load in seconds.
+"""
+
+import json
+import random
+from datetime import datetime, timedelta
+from app import db
+
+def _insert(table, rows, batch_size=5000):
+    for start in range(0, len(rows), batch_size):
+        db.session.execute(table.insert(), rows[start:start + batch_size])
+
+def seed(rooms=20, photos_per_room=2000, events_per_room=5000, members_per_room=20, empty_rooms=2000, seed_value=42):
+    """
+    Fill an empty database; returns the id of the user who created room 1
+    That user is an admin of the first `rooms` rooms, which hold the photos and events.
+    `empty_rooms` more rooms owned by other users keep the room table realistically sized.
+    """
+    from models import User, Room, RoomMember, Photo, PhotoTag, Album, Analytics, ShareableLink
+
+    rng = random.Random(seed_value)
+    now = datetime.utcnow()
+
+    user_count = rooms * members_per_room + 1
+    _insert(User.__table__, [
+        {'id': i, 'username': f'user{i}', 'email': f'user{i}@example.com', 'password_hash': 'x', 'created_at': now}
+        for i in range(1, user_count + 1)
+    ])
+
+    _insert(Room.__table__, [
+        {
+            'id': room_id, 'name': f'Room {room_id}', 'description': '',
+            'creator_id': 1 if room_id == 1 else 2 + room_id % (user_count - 1),
+            'access_code': f'code{room_id:06d}', 'is_public': room_id % 10 == 0,
+            'created_at': now - timedelta(hours=room_id), 'face_recognition_enabled': True
+        }
+        for room_id in range(1, rooms + empty_rooms + 1)
+    ])
+
+    members = []
+    for room_id in range(1, rooms + 1):
+        members.append({'room_id': room_id, 'user_id': 1, 'role': 'admin', 'joined_at': now})
+        for j in range(members_per_room):
+            members.append({'room_id': room_id, 'user_id': 2 + (room_id - 1) * members_per_room + j, 'role': 'member', 'joined_at': now})
+    _insert(RoomMember.__table__, members)
+
+    albums = []
+    album_id = 0
+    room_albums = {}
+    for room_id in range(1, rooms + 1):
+        room_albums[room_id] = []
+        for k in range(10):
+            album_id += 1
+            room_albums[room_id].append(album_id)
+            albums.append({'id': album_id, 'name': f'Person_{k + 1}', 'room_id': room_id, 'is_auto_generated': True, 'created_at': now})
+    _insert(Album.__table__, albums)
+
+    photos = []
+    tags = []
+    photo_id = 0
+    for room_id in range(1, rooms + 1):
+        for _ in range(photos_per_room):
+            photo_id += 1
+            photos.append({
+                'id': photo_id, 'filename': f'{photo_id:08x}_photo.jpg', 'original_filename': 'photo.jpg',
+                'user_id': 1, 'room_id': room_id, 'description': '',
+                'uploaded_at': now - timedelta(minutes=rng.randint(0, 60 * 24 * 90)),
+                'album_id': rng.choice(room_albums[room_id]) if rng.random() < 0.5 else None,
+                'download_count': rng.randint(0, 50)
+            })
+            for k in range(rng.randint(0, 3)):
+                tags.append({
+                    'photo_id': photo_id, 'tag_name': f'Person_{rng.randint(1, 10)}',
+                    'confidence': rng.uniform(0.5, 0.9), 'is_manual': rng.random() < 0.1,
+                    'box_coordinates': json.dumps({'x': 0.1, 'y': 0.1, 'width': 0.1, 'height': 0.1})
+                })
+    _insert(Photo.__table__, photos)
+    _insert(PhotoTag.__table__, tags)
+
+    events = []
+    event_types = ['room_view', 'photo_view', 'photo_download', 'link_access']
+    for room_id in range(1, rooms + 1):
+        first_photo = (room_id - 1) * photos_per_room + 1
+        for _ in range(events_per_room):
+            event_type = rng.choice(event_types)
+            event_photo = rng.randint(first_photo, first_photo + photos_per_room - 1) if event_type.startswith('photo') else None
+            events.append({
+                'room_id': room_id, 'event_type': event_type,
+                'event_data': json.dumps({'photo_id': event_photo}) if event_photo else None,
+                'photo_id': event_photo, 'user_id': None, 'ip_address': '127.0.0.1', 'user_agent': 'bench',
+                'timestamp': now - timedelta(minutes=rng.randint(0, 60 * 24 * 60))
+            })
+    _insert(Analytics.__table__, events)
+
+    links = []
+    for room_id in range(1, rooms + 1):
+        for k in range(5):
+            links.append({
+                'room_id': room_id, 'token': f'token-{room_id}-{k}', 'created_at': now, 'created_by': 1,
+                'expires_at': now + timedelta(days=rng.randint(-10, 10)), 'is_active': True, 'access_count': 0
+            })
+    _insert(ShareableLink.__table__, links)
+
+    db.session.commit()
+
+    # Bulk inserts bypass the ORM hooks that maintain these
+    from analytics_rollup import rebuild_rollup
+    from album_utils import repair_album_stats
+    rebuild_rollup()
+    repair_album_stats()
+
+    return 1
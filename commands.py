@@ -0,0 +1,168 @@
+"""
+CLI commands for the Photo Sharing App
+Run with: flask --app main <command>
+"""
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+# create_app adds each command to the app's own CLI
+cli = AppGroup('commands')
+
+@cli.command('upgrade-db')
+def upgrade_db_command():
+    """Create missing tables, apply pending schema migrations and seed default settings."""
+    from app import init_db
+
+    init_db(current_app._get_current_object())
+    click.echo('Database is up to date')
+
+@cli.command('rebuild-analytics-rollup')
+@click.option('--room-id', type=int, default=None, help='Only rebuild this room')
+def rebuild_analytics_rollup_command(room_id):
+    """Recompute the daily analytics rollup from raw events."""
+    from analytics_rollup import rebuild_rollup
+
+    rows = rebuild_rollup(room_id)
+    click.echo(f'Wrote {rows} rollup rows')
+
+@cli.command('repair-album-stats')
+@click.option('--room-id', type=int, default=None, help='Only repair albums in this room')
+def repair_album_stats_command(room_id):
+    """Recompute album photo counts and cover photos."""
+    from album_utils import repair_album_stats
+
+    albums = repair_album_stats(room_id)
+    click.echo(f'Updated {albums} albums')
+
+@cli.command('backfill-phash')
+@click.option('--batch-size', type=int, default=500, help='Photos hashed per commit')
+def backfill_phash_command(batch_size):
+    """Compute perceptual hashes for photos uploaded before duplicate detection."""
+    from app import db
+    from models import Photo
+    from duplicate_utils import compute_phash
+    from storage_utils import get_photo_path
+
+    last_id = 0
+    hashed = 0
+    while True:
+        photos = Photo.query.filter(Photo.id > last_id, Photo.phash.is_(None)).order_by(Photo.id).limit(batch_size).all()
+        if not photos:
+            break
+        last_id = photos[-1].id
+
+        for photo in photos:
+            photo.phash = compute_phash(get_photo_path(photo))
+            hashed += photo.phash is not None
+        db.session.commit()
+
+    click.echo(f'Hashed {hashed} photos')
+
+@cli.command('migrate-storage')
+@click.option('--batch-size', type=int, default=200, help='Photos moved per commit')
+def migrate_storage_command(batch_size):
+    """Move photos uploaded before content addressing into the blob store."""
+    from storage_utils import migrate_legacy_photos
+
+    migrated, missing = migrate_legacy_photos(batch_size)
+    click.echo(f'Moved {migrated} photos, {missing} had no file')
+
+@cli.command('purge-uploads')
+def purge_uploads_command():
+    """Delete expired upload sessions and the chunks they received."""
+    from upload_utils import purge_expired_uploads
+
+    purged = purge_expired_uploads()
+    click.echo(f'Purged {purged} upload sessions')
+
+@cli.command('purge-sessions')
+@click.option('--batch-size', type=int, default=1000, help='Sessions deleted per transaction')
+def purge_sessions_command(batch_size):
+    """Delete expired server-side sessions."""
+    from session_utils import purge_expired_sessions
+
+    purged = purge_expired_sessions(current_app, batch_size)
+    click.echo(f'Purged {purged} sessions')
+
+@cli.command('replay-counters')
+def replay_counters_command():
+    """Add the download and link access counts of workers that died before flushing them."""
+    from counter_buffer import counter_buffer
+
+    replayed = counter_buffer.recover()
+    click.echo(f'Replayed {replayed} counter journal segments')
+
+@cli.command('run-maintenance')
+@click.option('--task', 'tasks', multiple=True, help='Only run this task (repeatable)')
+@click.option('--force', is_flag=True, help='Run even if not due yet')
+def run_maintenance_command(tasks, force):
+    """Run the maintenance tasks that are due."""
+    from maintenance import run_due_tasks, get_task_names
+    from job_queue import make_worker_id
+
+    unknown = [task for task in tasks if task not in get_task_names()]
+    if unknown:
+        raise click.BadParameter(f"unknown task {unknown[0]!r}, expected one of {', '.join(get_task_names())}", param_hint='--task')
+
+    results = run_due_tasks(make_worker_id(), names=tasks or None, force=force)
+    for name, result in results.items():
+        click.echo(f'{name}: {"failed" if result is None else result}')
+    if not results:
+        click.echo('No maintenance tasks were due')
+
+@cli.command('maintenance-status')
+def maintenance_status_command():
+    """Show when each maintenance task last ran and how it went."""
+    from models import MaintenanceTask
+    from maintenance import get_task_names, task_status
+
+    tasks = {task.name: task for task in MaintenanceTask.query.all()}
+    for name in get_task_names():
+        if name not in tasks:
+            click.echo(f'{name}: never run')
+            continue
+        status = task_status(tasks[name])
+        click.echo(
+            f"{name}: {status['last_status'] or 'running'} at {status['last_started_at']} "
+            f"in {status['last_duration'] or 0:.1f}s, next {status['next_run_at'] or 'now'}, "
+            f"{status['run_count']} runs, {status['failure_count']} failed, result {status['last_result']}"
+        )
+        if status['last_error']:
+            click.echo(f"    last error: {status['last_error']}")
+
+@cli.command('reconcile-storage')
+@click.option('--max-files', type=int, default=None, help='Stop after checking this many files (default: finish the pass)')
+@click.option('--batch-size', type=int, default=None, help='Files looked up per query')
+@click.option('--dry-run', is_flag=True, help='Only list the orphans, without moving them or saving progress')
+def reconcile_storage_command(max_files, batch_size, dry_run):
+    """Move upload files that no photo references into quarantine."""
+    from storage_reconciler import reconcile_storage
+
+    on_orphan = (lambda path: click.echo(f'orphan: {path}')) if dry_run else None
+    result = reconcile_storage(max_files=max_files, batch_size=batch_size, dry_run=dry_run, on_orphan=on_orphan)
+    click.echo(
+        f"Checked {result['checked']} files, found {result['orphans']} orphans, quarantined {result['quarantined']}"
+        f"{'' if result['completed'] else ', run again to continue the pass'}"
+    )
+
+@cli.command('purge-quarantine')
+def purge_quarantine_command():
+    """Delete quarantined upload files past their retention."""
+    from storage_reconciler import purge_quarantine
+
+    deleted, restored = purge_quarantine()
+    click.echo(f'Deleted {deleted} quarantined files, restored {restored}')
+
+@cli.command('report-missing-files')
+@click.option('--output', type=click.File('w'), default='-', help='Write the list here instead of stdout')
+def report_missing_files_command(output):
+    """List photos whose original file is missing."""
+    from storage_reconciler import find_missing_files
+
+    count = 0
+    for photo_id, path in find_missing_files():
+        output.write(f'{photo_id}\t{path}\n')
+        count += 1
+    click.echo(f'{count} photos have no original file', err=True)
@@ -0,0 +1,357 @@
+"""
+Counter Buffer for the Photo Sharing App
+This module collects increments of hot counters (photo downloads, shareable
+link accesses) in memory and adds them to the database from a background
+thread, as one `x = x + delta` UPDATE per row and batch, so a hit no longer
+pays for a read-modify-write and a COMMIT of its own, and concurrent hits
+can't overwrite each other.
+
+Every increment is also appended to a journal segment file owned by the
+process, which holds an exclusive lock on it. A flush starts a new segment,
+adds the old one's counts and records its name in the CounterFlush table in
+the same transaction, then deletes the file. Segments left behind by a
+process that died are replayed by the next one to start; the CounterFlush
+row makes sure a segment is only ever added once.
+
+Every app has a buffer and journal directory of its own in app.extensions;
+`counter_buffer` is the buffer of the current app.
+"""
+
+import os
+import time
+import uuid
+import fcntl
+import atexit
+import logging
+import threading
+import weakref
+from collections import Counter
+from datetime import datetime, timedelta
+from flask import current_app
+from werkzeug.local import LocalProxy
+from sqlalchemy import bindparam, func, exc
+from app import db
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Buffers of every app in this process, stopped together at exit
+_buffers = weakref.WeakSet()
+
+# Counter name -> (model name, column); increments are counted per row id
+COUNTERS = {
+    'photo_download': ('Photo', 'download_count'),
+    'link_access': ('ShareableLink', 'access_count'),
+}
+
+JOURNAL_SUFFIX = '.journal'
+
+def get_counter_column(counter):
+    """Get the table and column a counter is stored in"""
+    import models
+
+    model_name, column_name = COUNTERS[counter]
+    table = getattr(models, model_name).__table__
+    return table, table.c[column_name]
+
+def read_journal(path):
+    """Sum the increments in a journal segment; a line torn by a crash is skipped"""
+    counts = Counter()
+    with open(path, 'r') as journal:
+        for line in journal:
+            parts = line.split()
+            if len(parts) != 3 or not line.endswith('\n') or parts[0] not in COUNTERS:
+                continue
+            try:
+                counts[(parts[0], int(parts[1]))] += int(parts[2])
+            except ValueError:
+                continue
+    return counts
+
+def apply_counts(connection, segment, counts, now=None):
+    """
+    Add a segment's counts and record the segment as flushed
+    Run it in a transaction; raises IntegrityError if the segment was already flushed.
+    """
+    from models import CounterFlush
+
+    connection.execute(CounterFlush.__table__.insert().values(segment=segment, flushed_at=now or datetime.utcnow()))
+
+    by_counter = {}
+    for (counter, row_id), delta in counts.items():
+        if delta:
+            by_counter.setdefault(counter, []).append({'row_id': row_id, 'delta': delta})
+
+    for counter, rows in by_counter.items():
+        table, column = get_counter_column(counter)
+        connection.execute(
+            table.update().where(table.c.id == bindparam('row_id')).values({column: func.coalesce(column, 0) + bindparam('delta')}),
+            rows
+        )
+
+class _Segment:
+    """A journal segment this process writes to, or has finished writing and not flushed yet"""
+
+    def __init__(self, journal_dir):
+        self.name = f"{os.getpid()}-{uuid.uuid4().hex}"
+        self.path = os.path.join(journal_dir, self.name + JOURNAL_SUFFIX)
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        self.counts = Counter()
+
+    def write(self, counter, row_id, delta):
+        os.write(self.fd, f"{counter} {row_id} {delta}\n".encode())
+        self.counts[(counter, row_id)] += delta
+
+    def remove(self):
+        """Delete the file, then release its lock"""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        os.close(self.fd)
+
+class CounterBuffer:
+    """
+    In-process buffer of counter increments
+    Increments are flushed every flush_interval_ms. A segment that fails to
+    flush is kept, and retried on the next flush.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = True
+        self.flush_interval = 1.0
+        self.journal_dir = None
+        self.flush_log_ttl = timedelta(days=7)
+        self.shutdown_timeout = 5.0
+
+        self.flushed_count = 0
+        self.recovered_count = 0
+        self.flush_count = 0
+
+        self._active = None
+        self._finished = []
+        self._condition = threading.Condition()
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('COUNTER_BUFFER_ENABLED', True)
+        self.flush_interval = app.config.get('COUNTER_FLUSH_INTERVAL_MS', 1000) / 1000.0
+        self.journal_dir = app.config.get('COUNTER_JOURNAL_DIR', os.path.join(app.instance_path, 'counters'))
+        self.flush_log_ttl = app.config.get('COUNTER_FLUSH_LOG_TTL', timedelta(days=7))
+        self.shutdown_timeout = app.config.get('COUNTER_SHUTDOWN_TIMEOUT', 5.0)
+        app.extensions['counter_buffer'] = self
+        _buffers.add(self)
+
+    def _ensure_started(self):
+        """Start the flusher thread lazily so each forked worker gets its own"""
+        if self._thread is not None and self._pid == os.getpid():
+            return
+
+        with self._condition:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+
+            # Segments copied from a parent process belong to the parent
+            for segment in self._segments():
+                os.close(segment.fd)
+            self._active = None
+            self._finished = []
+            self._stopping = False
+            self._pid = os.getpid()
+            os.makedirs(self.journal_dir, exist_ok=True)
+            self._thread = threading.Thread(target=self._run, name='counter-flusher', daemon=True)
+            self._thread.start()
+
+    def increment(self, counter, row_id, delta=1):
+        """Count `delta` more for a row; it reaches the database with the next flush"""
+        if not self.enabled:
+            self._write_now(counter, row_id, delta)
+            return
+
+        self._ensure_started()
+
+        with self._condition:
+            if self._active is None:
+                self._active = _Segment(self.journal_dir)
+            self._active.write(counter, row_id, delta)
+
+    def _segments(self):
+        return self._finished + ([self._active] if self._active is not None else [])
+
+    def pending(self, counter, row_id):
+        """Get the increments of a row this process has not flushed yet"""
+        if self._pid != os.getpid():
+            return 0
+        with self._condition:
+            return sum(segment.counts[(counter, row_id)] for segment in self._segments())
+
+    def value(self, counter, row):
+        """Get a row's flushed count plus what this process has pending for it"""
+        return (getattr(row, COUNTERS[counter][1]) or 0) + self.pending(counter, row.id)
+
+    def _write_now(self, counter, row_id, delta):
+        table, column = get_counter_column(counter)
+        with self.app.app_context():
+            with db.engine.begin() as connection:
+                connection.execute(table.update().where(table.c.id == row_id).values({column: func.coalesce(column, 0) + delta}))
+
+    def _run(self):
+        self.recover()
+
+        while True:
+            with self._condition:
+                deadline = time.monotonic() + self.flush_interval
+                while not self._stopping:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                stopping = self._stopping
+
+            self.flush()
+
+            if stopping:
+                return
+
+    def _apply(self, segment_name, counts):
+        """Add one segment's counts; returns False if they were added before"""
+        try:
+            with self.app.app_context():
+                with db.engine.begin() as connection:
+                    apply_counts(connection, segment_name, counts)
+            return True
+        except exc.IntegrityError:
+            return False
+
+    def flush(self):
+        """Add every finished segment's counts to the database, starting a new segment first"""
+        with self._condition:
+            if self._pid != os.getpid():
+                return
+            # The next increment opens a new segment
+            if self._active is not None:
+                self._finished.append(self._active)
+                self._active = None
+            finished = list(self._finished)
+
+        for segment in finished:
+            try:
+                if not self._apply(segment.name, segment.counts):
+                    logger.warning(f"Counter segment {segment.name} was already flushed")
+            except Exception as e:
+                logger.error(f"Error flushing counter segment {segment.name}, keeping it for the next flush: {str(e)}")
+                return
+
+            with self._condition:
+                self._finished.remove(segment)
+                self.flushed_count += sum(segment.counts.values())
+                self.flush_count += 1
+            segment.remove()
+
+    def recover(self):
+        """
+        Replay journal segments left behind by processes that died before flushing them
+        A segment whose lock can be taken has no live owner. Also prunes old
+        CounterFlush rows. Returns the number of segments replayed.
+        """
+        if not self.journal_dir or not os.path.isdir(self.journal_dir):
+            return 0
+
+        with self._condition:
+            own = {segment.name for segment in self._segments()} if self._pid == os.getpid() else set()
+
+        replayed = 0
+        for entry in os.scandir(self.journal_dir):
+            name = entry.name[:-len(JOURNAL_SUFFIX)]
+            if not entry.name.endswith(JOURNAL_SUFFIX) or name in own:
+                continue
+
+            try:
+                fd = os.open(entry.path, os.O_RDONLY)
+            except FileNotFoundError:
+                continue
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+
+            try:
+                counts = read_journal(entry.path)
+                if self._apply(name, counts):
+                    replayed += 1
+                    with self._condition:
+                        self.recovered_count += sum(counts.values())
+                os.remove(entry.path)
+            except FileNotFoundError:
+                # Replayed and removed by another process in the meantime
+                pass
+            except Exception as e:
+                logger.error(f"Error replaying counter segment {name}: {str(e)}")
+            finally:
+                os.close(fd)
+
+        if replayed:
+            logger.info(f"Replayed {replayed} counter journal segments")
+        self._prune_flush_log()
+        return replayed
+
+    def _prune_flush_log(self):
+        from models import CounterFlush
+
+        try:
+            with self.app.app_context():
+                with db.engine.begin() as connection:
+                    table = CounterFlush.__table__
+                    connection.execute(table.delete().where(table.c.flushed_at < datetime.utcnow() - self.flush_log_ttl))
+        except Exception as e:
+            logger.error(f"Error pruning the counter flush log: {str(e)}")
+
+    def shutdown(self, timeout=None):
+        """Stop the flusher, giving it at most `timeout` seconds to write what is pending"""
+        timeout = self.shutdown_timeout if timeout is None else timeout
+
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                # The journal keeps what is left; the next process to start replays it
+                logger.warning(f"Counter flusher did not finish within {timeout}s")
+                return
+            self.flush()
+
+        logger.info(f"Counter buffer stopped: {self.flushed_count} increments flushed")
+
+    def stats(self):
+        with self._condition:
+            segments = self._segments() if self._pid == os.getpid() else []
+            pending = sum(sum(segment.counts.values()) for segment in segments)
+        return {
+            'pending': pending,
+            'segments': len(segments),
+            'flushed': self.flushed_count,
+            'recovered': self.recovered_count,
+            'flushes': self.flush_count
+        }
+
+def get_counter_buffer(app=None):
+    """Get the counter buffer of an app, by default the current one"""
+    return (app or current_app).extensions['counter_buffer']
+
+counter_buffer = LocalProxy(get_counter_buffer)
+
+@atexit.register
+def _shutdown_buffers():
+    for buffer in list(_buffers):
+        buffer.shutdown()
@@ -0,0 +1,109 @@
+"""
+Database Utilities for the Photo Sharing App
+Engine settings per database dialect.
+
+SQLite gets its concurrency settings on every new connection: WAL so readers
+never block the writer, synchronous=NORMAL (safe with WAL), a busy timeout so
+a second writer waits instead of failing with "database is locked", and a
+larger page cache and memory map.
+
+Postgres gets a sized connection pool. Instead of pinging on every checkout,
+a connection is only tested when it has sat idle in the pool for longer than
+DB_VALIDATE_IDLE seconds; a failed test makes the pool open a new one.
+
+Python's sqlite3 driver only opens a transaction at the first INSERT, UPDATE
+or DELETE, so a SAVEPOINT issued before that runs on its own and releasing it
+commits. Code that nests savepoints calls begin_write first.
+"""
+
+import time
+import logging
+from sqlalchemy import event, exc
+from sqlalchemy.engine import make_url
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,  # milliseconds
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # negative means KiB, so 64 MiB
+}
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_MAX_OVERFLOW = 20
+DEFAULT_POOL_TIMEOUT = 30
+DEFAULT_POOL_RECYCLE = 1800
+DEFAULT_VALIDATE_IDLE = 30
+
+def get_engine_options(config, database_uri=None):
+    """Get create_engine options for the configured database"""
+    url = make_url(database_uri or config['SQLALCHEMY_DATABASE_URI'])
+
+    if url.get_backend_name() == 'sqlite':
+        # Wait in Python's sqlite3 as well as in SQLite itself
+        busy_timeout = config.get('SQLITE_PRAGMAS', DEFAULT_SQLITE_PRAGMAS).get('busy_timeout', 0)
+        return {'connect_args': {'timeout': busy_timeout / 1000.0}}
+
+    return {
+        'pool_size': config.get('DB_POOL_SIZE', DEFAULT_POOL_SIZE),
+        'max_overflow': config.get('DB_MAX_OVERFLOW', DEFAULT_MAX_OVERFLOW),
+        'pool_timeout': config.get('DB_POOL_TIMEOUT', DEFAULT_POOL_TIMEOUT),
+        'pool_recycle': config.get('DB_POOL_RECYCLE', DEFAULT_POOL_RECYCLE),
+    }
+
+def configure_engine(engine, config):
+    """Attach the connection setup for the engine's dialect"""
+    if engine.dialect.name == 'sqlite':
+        _apply_sqlite_pragmas(engine, config.get('SQLITE_PRAGMAS', DEFAULT_SQLITE_PRAGMAS))
+    else:
+        _validate_idle_connections(engine, config.get('DB_VALIDATE_IDLE', DEFAULT_VALIDATE_IDLE))
+
+def _apply_sqlite_pragmas(engine, pragmas):
+    if not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
+
+def _validate_idle_connections(engine, validate_idle):
+    if validate_idle is None:
+        return
+
+    @event.listens_for(engine, 'checkin')
+    def remember_checkin(dbapi_connection, connection_record):
+        connection_record.info['checked_in_at'] = time.monotonic()
+
+    @event.listens_for(engine, 'checkout')
+    def validate_idle_connection(dbapi_connection, connection_record, connection_proxy):
+        checked_in_at = connection_record.info.get('checked_in_at')
+        if checked_in_at is None or time.monotonic() - checked_in_at < validate_idle:
+            return
+
+        try:
+            cursor = dbapi_connection.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
+            dbapi_connection.rollback()
+        except Exception as e:
+            logger.warning(f"Replacing a pooled connection that failed validation: {str(e)}")
+            # The pool discards this connection and checks out a new one
+            raise exc.DisconnectionError() from e
+
+def begin_write(session):
+    """
+    Make sure the session's transaction is open on the database before savepoints are nested in it
+    On SQLite this also takes the write lock up front, so the transaction can't
+    fail halfway to upgrade a read lock while another process writes.
+    """
+    connection = session.connection()
+    if connection.dialect.name == 'sqlite' and not connection.connection.dbapi_connection.in_transaction:
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
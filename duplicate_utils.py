@@ -0,0 +1,248 @@
+"""
+Duplicate Detection Utilities for the Photo Sharing App
+This module computes a 64-bit perceptual hash (pHash) of each uploaded photo
+and finds near-duplicates in the same room by Hamming distance. Each room's
+hashes are kept in memory as one uint64 array, so a lookup is a single
+vectorized XOR and popcount over every photo in the room.
+"""
+
+import time
+import logging
+import threading
+import numpy as np
+from flask import current_app
+from sqlalchemy import func, or_
+from app import db
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_DISTANCE = 6
+
+# What to do with a near-duplicate upload: 'flag' stores it and links it to the
+# photo it duplicates, 'reject' refuses it
+DUPLICATE_ACTIONS = ('flag', 'reject')
+DEFAULT_ACTION = 'flag'
+
+HASH_SIZE = 8
+DCT_SIZE = 32
+
+def _dct_matrix(size):
+    """Orthonormal DCT-II basis"""
+    n = np.arange(size)
+    matrix = np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / (2 * size)) * np.sqrt(2.0 / size)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+_DCT = _dct_matrix(DCT_SIZE)
+
+# Loaded indexes by room id, one set per process
+_indexes = {}
+_indexes_lock = threading.Lock()
+# Highest photo id already handed to the loaded indexes
+_last_seen_photo_id = None
+# Photo ids below it that weren't committed yet when it was read, see face_index
+_pending_photo_ids = {}
+
+CATCH_UP_WINDOW = 1000
+CATCH_UP_PENDING_SECONDS = 300
+
+def get_max_distance():
+    """Get the largest Hamming distance that counts as a near-duplicate"""
+    return current_app.config.get('DUPLICATE_MAX_DISTANCE', DEFAULT_MAX_DISTANCE)
+
+def get_duplicate_action():
+    """Get the configured action for near-duplicate uploads"""
+    action = current_app.config.get('DUPLICATE_ACTION', DEFAULT_ACTION)
+    return action if action in DUPLICATE_ACTIONS else DEFAULT_ACTION
+
+def to_signed(value):
+    """Store an unsigned 64-bit hash in a signed BIGINT column"""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+def compute_phash(file_path):
+    """
+    Compute the 64-bit perceptual hash of an image
+    The image is reduced to 32x32 grayscale and transformed with a DCT; each bit
+    says whether one of the 8x8 lowest frequencies is above their median, so
+    resizing, recompression and small edits leave most bits unchanged.
+    Returns a signed integer for Photo.phash, or None if the image can't be read.
+    """
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        logger.warning("Pillow is not installed, duplicate detection is disabled")
+        return None
+
+    try:
+        with Image.open(file_path) as image:
+            image = ImageOps.exif_transpose(image).convert('L').resize((DCT_SIZE, DCT_SIZE), Image.LANCZOS)
+            pixels = np.asarray(image, dtype=np.float64)
+    except Exception as e:
+        logger.error(f"Error hashing {file_path}: {str(e)}")
+        return None
+
+    low = (_DCT @ pixels @ _DCT.T)[:HASH_SIZE, :HASH_SIZE].flatten()
+    bits = low > np.median(low[1:])
+    return to_signed(int.from_bytes(np.packbits(bits).tobytes(), 'big'))
+
+class HashIndex:
+    """
+    Perceptual hashes of one room's photos
+    Loaded in full once, then kept current by _catch_up like the face index.
+    """
+
+    def __init__(self, room_id):
+        self.room_id = room_id
+        self.size = 0
+
+        self._hashes = np.empty(0, dtype=np.uint64)
+        self._photo_ids = np.empty(0, dtype=np.int64)
+
+    def add_many(self, photo_ids, hashes):
+        """Append hashes (signed, as stored) for the given photo ids"""
+        if not len(photo_ids):
+            return
+
+        needed = self.size + len(photo_ids)
+        if needed > len(self._photo_ids):
+            capacity = max(needed, len(self._photo_ids) * 2, 1024)
+            grown_hashes = np.empty(capacity, dtype=np.uint64)
+            grown_ids = np.empty(capacity, dtype=np.int64)
+            grown_hashes[:self.size] = self._hashes[:self.size]
+            grown_ids[:self.size] = self._photo_ids[:self.size]
+            self._hashes, self._photo_ids = grown_hashes, grown_ids
+
+        self._hashes[self.size:needed] = np.asarray(hashes, dtype=np.int64).view(np.uint64)
+        self._photo_ids[self.size:needed] = photo_ids
+        self.size = needed
+
+    def add(self, photo_id, phash):
+        """Append one photo's hash"""
+        self.add_many([photo_id], [phash])
+
+    def add_new(self, photo_ids, hashes):
+        """Append the hashes of photos the index doesn't hold yet"""
+        photo_ids = np.asarray(photo_ids, dtype=np.int64)
+        new = ~np.isin(photo_ids, self._photo_ids[:self.size])
+        self.add_many(photo_ids[new], np.asarray(hashes, dtype=np.int64)[new])
+
+    def load(self):
+        """Read every stored hash in the room"""
+        from models import Photo
+
+        rows = db.session.query(Photo.id, Photo.phash).filter(
+            Photo.room_id == self.room_id,
+            Photo.phash.isnot(None)
+        ).order_by(Photo.id).all()
+
+        if rows:
+            self.add_many([photo_id for photo_id, _ in rows], [phash for _, phash in rows])
+
+    def nearest(self, phash, max_distance, exclude_photo_id=None, limit=5):
+        """Get up to `limit` (photo_id, distance) pairs within max_distance, nearest first"""
+        if not self.size:
+            return []
+
+        query = np.array([phash], dtype=np.int64).view(np.uint64)[0]
+        distances = np.bitwise_count(self._hashes[:self.size] ^ query)
+
+        within = np.flatnonzero(distances <= max_distance)
+        if exclude_photo_id is not None:
+            within = within[self._photo_ids[within] != exclude_photo_id]
+        within = within[np.argsort(distances[within], kind='stable')][:limit]
+
+        return [(int(self._photo_ids[i]), int(distances[i])) for i in within]
+
+def _catch_up():
+    """
+    Hand photos stored since the last call to the loaded indexes of their rooms
+    Ids skipped in the range read are read again on later calls, until they
+    show up or CATCH_UP_PENDING_SECONDS pass.
+    """
+    global _last_seen_photo_id
+    from models import Photo
+
+    if _last_seen_photo_id is None:
+        highest = db.session.query(func.max(Photo.id)).scalar() or 0
+        _last_seen_photo_id = max(highest - CATCH_UP_WINDOW, 0)
+
+    condition = Photo.id > _last_seen_photo_id
+    if _pending_photo_ids:
+        condition = or_(condition, Photo.id.in_(list(_pending_photo_ids)))
+    rows = db.session.query(Photo.id, Photo.room_id, Photo.phash).filter(condition).order_by(Photo.id).all()
+
+    new_by_room = {}
+    for photo_id, room_id, phash in rows:
+        _pending_photo_ids.pop(photo_id, None)
+        if phash is not None and room_id in _indexes:
+            photo_ids, hashes = new_by_room.setdefault(room_id, ([], []))
+            photo_ids.append(photo_id)
+            hashes.append(phash)
+
+    for room_id, (photo_ids, hashes) in new_by_room.items():
+        _indexes[room_id].add_new(photo_ids, hashes)
+
+    now = time.monotonic()
+    if rows and rows[-1].id > _last_seen_photo_id:
+        seen = {row.id for row in rows}
+        for photo_id in range(_last_seen_photo_id + 1, rows[-1].id):
+            if photo_id not in seen:
+                _pending_photo_ids[photo_id] = now
+        _last_seen_photo_id = rows[-1].id
+
+    for photo_id, missed_at in list(_pending_photo_ids.items()):
+        if now - missed_at > CATCH_UP_PENDING_SECONDS:
+            del _pending_photo_ids[photo_id]
+
+def reset_indexes():
+    """
+    Forget every loaded index
+    Called after rolling back a transaction whose photos the indexes may
+    already have picked up, since their ids can be handed out again.
+    """
+    global _last_seen_photo_id
+
+    with _indexes_lock:
+        _indexes.clear()
+        _pending_photo_ids.clear()
+        _last_seen_photo_id = None
+
+def find_duplicate(room_id, phash, max_distance=None, exclude_photo_id=None):
+    """Get the closest existing photo in the room within max_distance, or None"""
+    from models import Photo
+
+    if phash is None:
+        return None
+    if max_distance is None:
+        max_distance = get_max_distance()
+
+    with _indexes_lock:
+        _catch_up()
+        index = _indexes.get(room_id)
+        if index is None:
+            index = HashIndex(room_id)
+            index.load()
+            _indexes[room_id] = index
+        candidates = index.nearest(phash, max_distance, exclude_photo_id)
+
+    for photo_id, distance in candidates:
+        # Skip photos deleted since the index loaded them
+        photo = db.session.get(Photo, photo_id)
+        if photo is not None:
+            return photo
+    return None
+
+def copy_face_tags(source, target):
+    """Give a duplicate the automatic face tags of the photo it duplicates; returns how many"""
+    from models import PhotoTag
+
+    table = PhotoTag.__table__
+    columns = ['tag_name', 'confidence', 'detection_confidence', 'is_manual', 'box_coordinates', 'embedding']
+    select_tags = db.select(
+        db.literal(target.id).label('photo_id'),
+        *[table.c[column] for column in columns]
+    ).where(table.c.photo_id == source.id, table.c.is_manual == False)
+
+    result = db.session.execute(table.insert().from_select(['photo_id'] + columns, select_tags))
+    return result.rowcount
@@ -0,0 +1,209 @@
+"""
+Face Index for the Photo Sharing App
+This module keeps each room's known face embeddings in memory as one float32
+matrix, so a new face is matched against every face in the room with a single
+matrix-vector product instead of a query or Python loop per face.
+"""
+
+import time
+import logging
+import threading
+import numpy as np
+from sqlalchemy import func, or_
+from app import db
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+EMBEDDING_SIZE = 128
+EMBEDDING_DTYPE = np.dtype('<f4')
+
+# Loaded indexes by room id, one set per process
+_indexes = {}
+_indexes_lock = threading.Lock()
+# Highest tag id already handed to the loaded indexes
+_last_seen_tag_id = None
+# Tag ids below it that weren't committed yet when it was read, by when they
+# were first missed; on Postgres a lower id can commit after a higher one
+_pending_tag_ids = {}
+
+# How far below the highest id a process starts, to cover transactions in flight
+CATCH_UP_WINDOW = 1000
+# How long a missed id is looked for before it counts as rolled back
+CATCH_UP_PENDING_SECONDS = 300
+
+def encode_embedding(embedding):
+    """Pack an embedding into bytes for PhotoTag.embedding"""
+    return np.asarray(embedding, dtype=EMBEDDING_DTYPE).reshape(EMBEDDING_SIZE).tobytes()
+
+def decode_embedding(data):
+    """Unpack bytes from PhotoTag.embedding into a float32 vector"""
+    return np.frombuffer(data, dtype=EMBEDDING_DTYPE)
+
+class FaceIndex:
+    """
+    Known face embeddings for one room
+    The room is read in full once; after that new tags are appended as they are
+    stored here or found by _catch_up.
+    """
+
+    def __init__(self, room_id):
+        self.room_id = room_id
+        self.size = 0
+        self.lock = threading.Lock()
+
+        self._embeddings = np.empty((0, EMBEDDING_SIZE), dtype=np.float32)
+        self._norms = np.empty(0, dtype=np.float32)
+        self._tag_ids = np.empty(0, dtype=np.int64)
+        self._live = np.empty(0, dtype=bool)
+
+    def _reserve(self, extra):
+        """Grow the arrays geometrically so appends are amortized O(1)"""
+        needed = self.size + extra
+        capacity = len(self._tag_ids)
+        if needed <= capacity:
+            return
+
+        capacity = max(needed, capacity * 2, 1024)
+        embeddings = np.empty((capacity, EMBEDDING_SIZE), dtype=np.float32)
+        norms = np.empty(capacity, dtype=np.float32)
+        tag_ids = np.empty(capacity, dtype=np.int64)
+        live = np.zeros(capacity, dtype=bool)
+
+        embeddings[:self.size] = self._embeddings[:self.size]
+        norms[:self.size] = self._norms[:self.size]
+        tag_ids[:self.size] = self._tag_ids[:self.size]
+        live[:self.size] = self._live[:self.size]
+
+        self._embeddings, self._norms, self._tag_ids, self._live = embeddings, norms, tag_ids, live
+
+    def add_many(self, tag_ids, embeddings):
+        """Append embeddings for the given tag ids"""
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, EMBEDDING_SIZE)
+        if not len(embeddings):
+            return
+
+        self._reserve(len(embeddings))
+        end = self.size + len(embeddings)
+        self._embeddings[self.size:end] = embeddings
+        self._norms[self.size:end] = np.einsum('ij,ij->i', embeddings, embeddings)
+        self._tag_ids[self.size:end] = tag_ids
+        self._live[self.size:end] = True
+        self.size = end
+
+    def add(self, tag_id, embedding):
+        """Append one embedding"""
+        self.add_many([tag_id], [embedding])
+
+    def add_new(self, tag_ids, embeddings):
+        """Append the embeddings of tags the index doesn't hold yet"""
+        tag_ids = np.asarray(tag_ids, dtype=np.int64)
+        new = ~np.isin(tag_ids, self._tag_ids[:self.size])
+        if new.any():
+            self.add_many(tag_ids[new], np.asarray(embeddings, dtype=np.float32).reshape(-1, EMBEDDING_SIZE)[new])
+
+    def discard(self, tag_id):
+        """Stop matching against a tag that no longer exists"""
+        self._live[:self.size][self._tag_ids[:self.size] == tag_id] = False
+
+    def load(self):
+        """Read every stored embedding in the room"""
+        from models import Photo, PhotoTag
+
+        rows = db.session.query(PhotoTag.id, PhotoTag.embedding).join(Photo).filter(
+            Photo.room_id == self.room_id,
+            PhotoTag.embedding.isnot(None)
+        ).order_by(PhotoTag.id).all()
+
+        if rows:
+            tag_ids = [tag_id for tag_id, _ in rows]
+            embeddings = np.frombuffer(b''.join(data for _, data in rows), dtype=EMBEDDING_DTYPE)
+            self.add_many(tag_ids, embeddings.reshape(-1, EMBEDDING_SIZE))
+        logger.debug(f"Loaded {len(rows)} face embeddings for room {self.room_id}")
+
+    def candidates(self, embedding, tolerance, limit=5):
+        """
+        Get up to `limit` (tag_id, distance) pairs within tolerance, nearest first
+        Distances are Euclidean, computed as |a|^2 - 2a.b + |b|^2 over the whole matrix.
+        """
+        if not self.size:
+            return []
+
+        query = np.asarray(embedding, dtype=np.float32).reshape(EMBEDDING_SIZE)
+        embeddings = self._embeddings[:self.size]
+        squared = self._norms[:self.size] - 2.0 * (embeddings @ query) + float(query @ query)
+        squared[~self._live[:self.size]] = np.inf
+
+        within = np.flatnonzero(squared <= tolerance * tolerance)
+        if not len(within):
+            return []
+        if len(within) > limit:
+            within = within[np.argpartition(squared[within], limit)[:limit]]
+        within = within[np.argsort(squared[within])]
+
+        return [(int(self._tag_ids[i]), float(np.sqrt(max(squared[i], 0.0)))) for i in within]
+
+def _catch_up():
+    """
+    Hand tags stored since the last call to the loaded indexes of their rooms
+    This reads a primary key range of new tags for all rooms at once, rather than
+    rescanning a room's photos on every lookup. Ids skipped in that range are
+    read again on later calls, until they show up or CATCH_UP_PENDING_SECONDS pass.
+    """
+    global _last_seen_tag_id
+    from models import Photo, PhotoTag
+
+    if _last_seen_tag_id is None:
+        highest = db.session.query(func.max(PhotoTag.id)).scalar() or 0
+        _last_seen_tag_id = max(highest - CATCH_UP_WINDOW, 0)
+
+    condition = PhotoTag.id > _last_seen_tag_id
+    if _pending_tag_ids:
+        condition = or_(condition, PhotoTag.id.in_(list(_pending_tag_ids)))
+    rows = db.session.query(PhotoTag.id, Photo.room_id, PhotoTag.embedding).join(Photo).filter(
+        condition
+    ).order_by(PhotoTag.id).all()
+
+    new_by_room = {}
+    for tag_id, room_id, embedding in rows:
+        _pending_tag_ids.pop(tag_id, None)
+        if embedding is not None and room_id in _indexes:
+            tag_ids, embeddings = new_by_room.setdefault(room_id, ([], []))
+            tag_ids.append(tag_id)
+            embeddings.append(decode_embedding(embedding))
+
+    for room_id, (tag_ids, embeddings) in new_by_room.items():
+        index = _indexes[room_id]
+        with index.lock:
+            index.add_new(tag_ids, embeddings)
+
+    now = time.monotonic()
+    if rows and rows[-1].id > _last_seen_tag_id:
+        seen = {row.id for row in rows}
+        for tag_id in range(_last_seen_tag_id + 1, rows[-1].id):
+            if tag_id not in seen:
+                _pending_tag_ids[tag_id] = now
+        _last_seen_tag_id = rows[-1].id
+
+    for tag_id, missed_at in list(_pending_tag_ids.items()):
+        if now - missed_at > CATCH_UP_PENDING_SECONDS:
+            del _pending_tag_ids[tag_id]
+
+def get_face_index(room_id):
+    """Get the room's face index, with every tag stored so far"""
+    with _indexes_lock:
+        _catch_up()
+        index = _indexes.get(room_id)
+        if index is None:
+            index = FaceIndex(room_id)
+            index.load()
+            _indexes[room_id] = index
+    return index
+
+def clear_face_indexes(room_id=None):
+    """Drop cached indexes so they are rebuilt from the database on next use"""
+    with _indexes_lock:
+        if room_id is None:
+            _indexes.clear()
+        else:
+            _indexes.pop(room_id, None)
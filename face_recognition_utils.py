@@ -1,18 +1,76 @@
 """
 Face Recognition Utilities for the Photo Sharing App
-This module provides placeholder functionality for face recognition features.
+This module detects faces, stores each one with its embedding, and names it
+after the nearest known face in the room. Detection uses the face_recognition
+library when FACE_EMBEDDING_BACKEND is 'face_recognition', or a deterministic
+stand-in derived from the image bytes otherwise.
 """
 
 import os
 import json
+import time
+import hashlib
 import logging
-import random
+import numpy as np
+from collections import namedtuple
 from datetime import datetime
+from flask import current_app
+from sqlalchemy import case, update
 from app import db
+from job_queue import job_handler
+from face_index import EMBEDDING_SIZE, get_face_index, encode_embedding
 
 # Setup logging
 logger = logging.getLogger(__name__)
 
+DEFAULT_BACKEND = 'deterministic'
+
+# Number of distinct people the deterministic backend draws faces from
+DETERMINISTIC_PEOPLE = 8
+# Per-dimension noise between two sightings of the same deterministic person
+DETERMINISTIC_NOISE = 0.02
+
+# Retraining raises automatic tags of hand-confirmed people by this much
+CONFIRMED_BOOST = 0.1
+MAX_CONFIDENCE = 0.95
+
+# Immutable copy of the settings row that callers share and pass around
+FaceSettings = namedtuple('FaceSettings', [
+    'min_confidence', 'detection_algorithm', 'face_encoding_model',
+    'auto_categorize', 'recognition_tolerance', 'last_updated'
+])
+
+DEFAULT_FACE_SETTINGS = FaceSettings(
+    min_confidence=0.6,
+    detection_algorithm='hog',
+    face_encoding_model='small',
+    auto_categorize=True,
+    recognition_tolerance=0.6,
+    last_updated=None
+)
+
+# Seconds a snapshot is used before checking whether another process saved newer settings
+DEFAULT_SETTINGS_CHECK_INTERVAL = 5
+
+# The process-wide (snapshot, checked_at) pair, replaced as a whole
+_settings_snapshot = None
+
+def _snapshot(settings):
+    """Copy a FaceRecognitionSettings row into a FaceSettings"""
+    return FaceSettings(
+        min_confidence=settings.min_confidence,
+        detection_algorithm=settings.detection_algorithm,
+        face_encoding_model=settings.face_encoding_model,
+        auto_categorize=settings.auto_categorize,
+        recognition_tolerance=settings.recognition_tolerance,
+        last_updated=settings.last_updated
+    )
+
+def _publish_settings(snapshot):
+    global _settings_snapshot
+    _settings_snapshot = (snapshot, time.monotonic())
+    return snapshot
+
 def init_face_recognition_settings():
     """Initialize face recognition settings if not already exists"""
     from models import FaceRecognitionSettings
@@ -23,56 +81,247 @@ def init_face_recognition_settings():
         if not settings:
             logger.info("Creating default face recognition settings")
             settings = FaceRecognitionSettings(
-                min_confidence=0.6,
-                detection_algorithm='hog',
-                face_encoding_model='small',
-                auto_categorize=True,
-                recognition_tolerance=0.6
+                min_confidence=DEFAULT_FACE_SETTINGS.min_confidence,
+                detection_algorithm=DEFAULT_FACE_SETTINGS.detection_algorithm,
+                face_encoding_model=DEFAULT_FACE_SETTINGS.face_encoding_model,
+                auto_categorize=DEFAULT_FACE_SETTINGS.auto_categorize,
+                recognition_tolerance=DEFAULT_FACE_SETTINGS.recognition_tolerance,
+                last_updated=datetime.utcnow()
             )
             db.session.add(settings)
             db.session.commit()
             logger.info("Default face recognition settings created")
-        return settings
+        return _publish_settings(_snapshot(settings))
     except Exception as e:
+        db.session.rollback()
         logger.error(f"Error initializing face recognition settings: {str(e)}")
         # If there's an error, we'll still return default settings
-        fallback = FaceRecognitionSettings(
-            min_confidence=0.6,
-            detection_algorithm='hog',
-            face_encoding_model='small',
-            auto_categorize=True,
-            recognition_tolerance=0.6
-        )
-        return fallback
+        return DEFAULT_FACE_SETTINGS
 
 def get_face_settings():
-    """Get face recognition settings"""
+    """
+    Get the current face recognition settings as an immutable FaceSettings
+    The snapshot is shared by the whole process. Every few seconds one query
+    compares its last_updated with the row's, and only a newer row is loaded.
+    """
     from models import FaceRecognitionSettings
     
+    current = _settings_snapshot
+    interval = current_app.config.get('FACE_SETTINGS_CHECK_INTERVAL', DEFAULT_SETTINGS_CHECK_INTERVAL)
+    if current is not None and time.monotonic() - current[1] < interval:
+        return current[0]
+    
     try:
-        settings = FaceRecognitionSettings.query.first()
-        if not settings:
-            settings = init_face_recognition_settings()
-        return settings
+        version = db.session.query(FaceRecognitionSettings.last_updated).order_by(FaceRecognitionSettings.id).limit(1).first()
+        if version is None:
+            return init_face_recognition_settings()
+        
+        if current is not None and current[0].last_updated == version.last_updated:
+            return _publish_settings(current[0])
+        
+        settings = FaceRecognitionSettings.query.order_by(FaceRecognitionSettings.id).first()
+        return _publish_settings(_snapshot(settings))
     except Exception as e:
+        db.session.rollback()
         logger.error(f"Error getting face recognition settings: {str(e)}")
-        # Create a FaceRecognitionSettings object even for the fallback case
-        from models import FaceRecognitionSettings
-        fallback = FaceRecognitionSettings(
-            min_confidence=0.6,
-            detection_algorithm='hog',
-            face_encoding_model='small',
-            auto_categorize=True,
-            recognition_tolerance=0.6
-        )
-        return fallback
+        return current[0] if current is not None else DEFAULT_FACE_SETTINGS
+
+def save_face_settings(min_confidence, detection_algorithm, face_encoding_model, auto_categorize, recognition_tolerance):
+    """Save new face recognition settings and make them this process's snapshot"""
+    from models import FaceRecognitionSettings
+    
+    settings = FaceRecognitionSettings.query.order_by(FaceRecognitionSettings.id).first()
+    if not settings:
+        settings = FaceRecognitionSettings()
+        db.session.add(settings)
+    
+    settings.min_confidence = min_confidence
+    settings.detection_algorithm = detection_algorithm
+    settings.face_encoding_model = face_encoding_model
+    settings.auto_categorize = auto_categorize
+    settings.recognition_tolerance = recognition_tolerance
+    settings.last_updated = datetime.utcnow()
+    db.session.commit()
+    
+    return _publish_settings(_snapshot(settings))
+
+def get_embedding_backend():
+    """Get the configured face detection backend name"""
+    return current_app.config.get('FACE_EMBEDDING_BACKEND', DEFAULT_BACKEND)
+
+def _person_embedding(person):
+    """Unit-length base embedding for one deterministic person"""
+    vector = np.random.default_rng(person).standard_normal(EMBEDDING_SIZE)
+    return vector / np.linalg.norm(vector)
 
-def process_photo_face_recognition(photo_id, file_path):
+def _detect_faces_deterministic(file_path):
     """
-    Process a photo with face recognition and tag faces
-    This is a placeholder implementation that simulates face detection
+    Stand-in detector for tests and development
+    The same file always gives the same faces, and faces of the same person in
+    different files land well within the default recognition tolerance.
     """
-    from models import Photo, PhotoTag
+    with open(file_path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).digest()
+    rng = np.random.default_rng(int.from_bytes(digest[:8], 'little'))
+    
+    faces = []
+    for _ in range(int(rng.integers(0, 4))):
+        person = int(rng.integers(0, DETERMINISTIC_PEOPLE))
+        embedding = _person_embedding(person) + rng.normal(0, DETERMINISTIC_NOISE, EMBEDDING_SIZE)
+        faces.append({
+            'confidence': float(rng.uniform(0.5, 0.99)),
+            'box': {
+                'x': float(rng.uniform(0.1, 0.8)),
+                'y': float(rng.uniform(0.1, 0.8)),
+                'width': float(rng.uniform(0.1, 0.2)),
+                'height': float(rng.uniform(0.1, 0.2))
+            },
+            'embedding': embedding.astype(np.float32)
+        })
+    return faces
+
+def _detect_faces_library(file_path, detection_model, encoding_model):
+    """Detect and encode faces with the face_recognition library"""
+    # Imported on first use: loading dlib's models slows down every process that imports this module
+    try:
+        import face_recognition
+    except ImportError:
+        raise RuntimeError("FACE_EMBEDDING_BACKEND is 'face_recognition' but the face_recognition package is not installed")
+    
+    image = face_recognition.load_image_file(file_path)
+    height, width = image.shape[:2]
+    locations = face_recognition.face_locations(image, model=detection_model)
+    encodings = face_recognition.face_encodings(image, locations, model=encoding_model)
+    
+    faces = []
+    for (top, right, bottom, left), encoding in zip(locations, encodings):
+        faces.append({
+            # The library doesn't score detections
+            'confidence': 1.0,
+            'box': {
+                'x': left / width,
+                'y': top / height,
+                'width': (right - left) / width,
+                'height': (bottom - top) / height
+            },
+            'embedding': np.asarray(encoding, dtype=np.float32)
+        })
+    return faces
+
+def detect_faces(file_path, min_confidence, backend=DEFAULT_BACKEND, detection_model='hog', encoding_model='small'):
+    """
+    Detect faces in an image file
+    Returns dicts with confidence, box (fractions of the image size) and a
+    float32 embedding. It doesn't touch the database, so it can run in a separate process.
+    """
+    if backend == 'face_recognition':
+        faces = _detect_faces_library(file_path, detection_model, encoding_model)
+    else:
+        faces = _detect_faces_deterministic(file_path)
+    
+    # Only keep faces with confidence above the threshold
+    faces = [face for face in faces if face['confidence'] >= min_confidence]
+    
+    logger.info(f"Detected {len(faces)} faces in {file_path}")
+    return faces
+
+def match_known_face(index, embedding, tolerance, replaced_names=None):
+    """
+    Get the tag name of the nearest known face within tolerance, or None
+    replaced_names maps ids of tags being replaced in this transaction to their names,
+    so reprocessing a photo keeps the names its faces already had.
+    """
+    from models import PhotoTag
+    
+    for tag_id, distance in index.candidates(embedding, tolerance):
+        if replaced_names and tag_id in replaced_names:
+            return replaced_names[tag_id]
+        
+        tag = db.session.get(PhotoTag, tag_id)
+        if tag is None:
+            # Tag was deleted since the index loaded it
+            index.discard(tag_id)
+            continue
+        return tag.tag_name
+    return None
+
+def apply_face_detections(photo, faces, settings, album_cache=None):
+    """
+    Store detected faces as tags and auto-categorize the photo
+    Changes are added to the session but not committed, so callers can batch them.
+    album_cache maps person names to albums and saves a lookup per photo in batch runs.
+    """
+    from models import PhotoTag, Album
+    
+    # Replace automatic tags from any earlier run so retries and reprocessing don't duplicate them
+    replaced_names = dict(
+        db.session.query(PhotoTag.id, PhotoTag.tag_name).filter_by(photo_id=photo.id, is_manual=False)
+    )
+    if replaced_names:
+        PhotoTag.query.filter_by(photo_id=photo.id, is_manual=False).delete()
+    
+    index = get_face_index(photo.room_id)
+    
+    # Create tags for each detected face, named after the closest known face
+    tags = []
+    with index.lock:
+        for face in faces:
+            embedding = face.get('embedding')
+            tag_name = None
+            if embedding is not None:
+                tag_name = match_known_face(index, embedding, settings.recognition_tolerance, replaced_names)
+            
+            tag = PhotoTag(
+                photo_id=photo.id,
+                tag_name=tag_name or 'Person',
+                confidence=face['confidence'],
+                detection_confidence=face['confidence'],
+                is_manual=False,
+                box_coordinates=json.dumps(face['box']),
+                embedding=encode_embedding(embedding) if embedding is not None else None
+            )
+            db.session.add(tag)
+            db.session.flush()
+            
+            # Someone new gets a name that is unique across workers
+            if tag_name is None:
+                tag.tag_name = f"Person_{tag.id}"
+            
+            if embedding is not None:
+                index.add(tag.id, embedding)
+            tags.append(tag)
+    
+    # If auto categorize is enabled and faces were detected, add to an album
+    if settings.auto_categorize and tags and not photo.album_id:
+        tag_name = tags[0].tag_name
+        album = album_cache.get(tag_name) if album_cache is not None else None
+        
+        # Look for an existing album for this person
+        if album is None:
+            album = Album.query.filter_by(
+                name=tag_name,
+                room_id=photo.room_id,
+                is_auto_generated=True
+            ).first()
+        
+        # Create the album if it doesn't exist
+        if album is None:
+            album = Album(
+                name=tag_name,
+                room_id=photo.room_id,
+                is_auto_generated=True
+            )
+            db.session.add(album)
+            db.session.flush()
+        
+        if album_cache is not None:
+            album_cache[tag_name] = album
+        
+        photo.album_id = album.id
+
+def process_photo_face_recognition(photo_id, file_path, settings=None):
+    """Process a photo with face recognition and tag faces, with the given or current settings"""
+    from models import Photo
     
     try:
         # Get the photo from database
@@ -81,142 +330,89 @@ def process_photo_face_recognition(photo_id, file_path):
             logger.error(f"Photo not found: {photo_id}")
             return False
         
-        # Get face recognition settings
-        settings = get_face_settings()
-        
-        # Simulate face detection (random number of faces between 0-3)
-        # In a real implementation, this would use a face recognition library
-        import random
-        num_faces = random.randint(0, 3)
-        
-        logger.info(f"Simulated detection of {num_faces} faces in {file_path}")
-        
-        # Create tags for each detected face
-        for i in range(num_faces):
-            # Simulate confidence level
-            confidence = random.uniform(0.5, 0.9)
-            
-            # Only add faces with confidence above the threshold
-            if confidence >= settings.min_confidence:
-                # Simulate face location (x, y, width, height as percentage of image)
-                x = random.uniform(0.1, 0.8)
-                y = random.uniform(0.1, 0.8)
-                width = random.uniform(0.1, 0.2)
-                height = random.uniform(0.1, 0.2)
-                
-                # Create coordinates JSON
-                coordinates = {
-                    'x': x, 
-                    'y': y, 
-                    'width': width, 
-                    'height': height
-                }
-                
-                # Create a generic tag name
-                tag_name = f"Person_{i+1}"
-                
-                # Create the photo tag
-                tag = PhotoTag(
-                    photo_id=photo_id,
-                    tag_name=tag_name,
-                    confidence=confidence,
-                    is_manual=False,
-                    box_coordinates=json.dumps(coordinates)
-                )
-                
-                db.session.add(tag)
+        # Get face recognition settings unless the caller already has them
+        if settings is None:
+            settings = get_face_settings()
         
+        faces = detect_faces(
+            file_path,
+            settings.min_confidence,
+            backend=get_embedding_backend(),
+            detection_model=settings.detection_algorithm,
+            encoding_model=settings.face_encoding_model
+        )
+        apply_face_detections(photo, faces, settings)
         db.session.commit()
         
-        # If auto categorize is enabled and faces were detected, add to an album
-        if settings.auto_categorize and num_faces > 0:
-            # Check if we need to create person albums
-            from models import Album
-            for i in range(num_faces):
-                tag_name = f"Person_{i+1}"
-                
-                # Look for an existing album for this person
-                album = Album.query.filter_by(
-                    name=tag_name,
-                    room_id=photo.room_id,
-                    is_auto_generated=True
-                ).first()
-                
-                # Create the album if it doesn't exist
-                if not album:
-                    album = Album(
-                        name=tag_name,
-                        room_id=photo.room_id,
-                        is_auto_generated=True
-                    )
-                    db.session.add(album)
-                    db.session.commit()
-                
-                # Update the photo's album if no album is set
-                if not photo.album_id:
-                    photo.album_id = album.id
-                    db.session.commit()
-                    break  # Only need to add to one album
-        
         return True
     
     except Exception as e:
+        db.session.rollback()
         logger.error(f"Error processing photo with face recognition: {str(e)}")
         return False
 
-def retrain_face_recognition_model(room_id):
+@job_handler('face_recognition')
+def run_face_recognition_job(job):
+    """Background job handler that runs face recognition for one photo"""
+    from models import Photo
+    from storage_utils import get_photo_path
+    
+    photo = Photo.query.get(job.photo_id)
+    if not photo:
+        logger.info(f"Skipping face recognition job {job.id}, photo {job.photo_id} was deleted")
+        return
+    
+    file_path = get_photo_path(photo)
+    if not os.path.exists(file_path):
+        raise RuntimeError(f"Photo file not found: {file_path}")
+    
+    if not process_photo_face_recognition(photo.id, file_path):
+        raise RuntimeError(f"Face recognition failed for photo {photo.id}")
+
+def get_confirmed_names(room_id):
+    """Get the names people have tagged by hand in a room"""
+    from models import Photo, PhotoTag
+    
+    rows = db.session.query(PhotoTag.tag_name).join(Photo).filter(
+        Photo.room_id == room_id,
+        PhotoTag.is_manual == True
+    ).distinct()
+    return [tag_name for (tag_name,) in rows]
+
+def retrain_face_recognition_model(room_id, photo_ids=None, confirmed_names=None):
     """
-    Process all manually tagged photos to improve face recognition accuracy
-    This is a placeholder implementation
+    Recompute the confidence of a room's automatic tags from the manual ones
+    Automatic tags whose name someone has also tagged by hand get their detection
+    confidence plus CONFIRMED_BOOST (capped at MAX_CONFIDENCE); all others go back
+    to their detection confidence. Confidence is derived from the stored detection
+    score rather than added to, so running this again changes nothing.
+    Limit it to photo_ids to work through a large room in chunks.
+    Returns the number of tags updated; changes are not committed.
     """
-    from models import Room, Photo, PhotoTag
+    from models import Photo, PhotoTag
     
-    try:
-        # Get the room
-        room = Room.query.get(room_id)
-        if not room:
-            logger.error(f"Room not found: {room_id}")
-            return False
-        
-        # Get all photos in the room with manual tags
-        photos_with_manual_tags = db.session.query(Photo).join(PhotoTag).filter(
-            Photo.room_id == room_id,
-            PhotoTag.is_manual == True
-        ).all()
-        
-        # Log the process
-        logger.info(f"Retraining face recognition model for room {room_id} with {len(photos_with_manual_tags)} manually tagged photos")
-        
-        # In a real implementation, this would update the face recognition model
-        # For now, just update the confidence levels of existing tags
-        count = 0
-        for photo in photos_with_manual_tags:
-            # Get all manual tags for this photo
-            manual_tags = PhotoTag.query.filter_by(
-                photo_id=photo.id,
-                is_manual=True
-            ).all()
-            
-            # For each manual tag, find any automatic tags for the same person across all photos
-            for manual_tag in manual_tags:
-                # Find automatic tags with the same name
-                auto_tags = PhotoTag.query.filter_by(
-                    tag_name=manual_tag.tag_name,
-                    is_manual=False
-                ).all()
-                
-                # Update confidence of automatic tags
-                for auto_tag in auto_tags:
-                    auto_tag.confidence = min(0.95, auto_tag.confidence + 0.1)
-                    count += 1
-        
-        # Commit changes
-        if count > 0:
-            db.session.commit()
-            logger.info(f"Updated confidence for {count} automatic tags")
-        
-        return True
+    if confirmed_names is None:
+        confirmed_names = get_confirmed_names(room_id)
     
-    except Exception as e:
-        logger.error(f"Error retraining face recognition model: {str(e)}")
-        return False
\ No newline at end of file
+    if photo_ids is None:
+        photo_ids = db.session.query(Photo.id).filter(Photo.room_id == room_id).scalar_subquery()
+    elif not photo_ids:
+        return 0
+    
+    boosted = PhotoTag.detection_confidence + CONFIRMED_BOOST
+    confidence = case(
+        (PhotoTag.tag_name.in_(confirmed_names), case((boosted > MAX_CONFIDENCE, MAX_CONFIDENCE), else_=boosted)),
+        else_=PhotoTag.detection_confidence
+    ) if confirmed_names else PhotoTag.detection_confidence
+    
+    result = db.session.execute(
+        update(PhotoTag)
+        .where(
+            PhotoTag.photo_id.in_(photo_ids),
+            PhotoTag.is_manual == False,
+            PhotoTag.detection_confidence.isnot(None)
+        )
+        .values(confidence=confidence)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
@@ -0,0 +1,271 @@
+"""
+Background Job Queue for the Photo Sharing App
+This module keeps jobs in the application database and lets standalone worker
+processes claim them with leases, so slow work such as face recognition runs
+outside the request cycle without an external broker.
+"""
+
+import os
+import json
+import random
+import socket
+import signal
+import logging
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import update, or_, and_
+from app import db
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+# How long a claimed job stays reserved before another worker may take it over
+DEFAULT_LEASE_SECONDS = 300
+
+# Retry delay is BASE * 2^(attempt - 1), capped at MAX
+RETRY_BASE_SECONDS = 10
+RETRY_MAX_SECONDS = 3600
+
+# Registered handlers keyed by job type
+_job_handlers = {}
+
+def job_handler(job_type):
+    """Register a function as the handler for a job type"""
+    def decorator(f):
+        _job_handlers[job_type] = f
+        return f
+    return decorator
+
+def enqueue_job(job_type, photo_id=None, room_id=None, payload=None, max_attempts=5):
+    """
+    Add a job to the queue
+    The job is only added to the session; it becomes visible to workers when the caller commits
+    """
+    from models import BackgroundJob
+
+    job = BackgroundJob(
+        job_type=job_type,
+        photo_id=photo_id,
+        room_id=room_id,
+        payload=json.dumps(payload) if payload else None,
+        status=JOB_QUEUED,
+        max_attempts=max_attempts,
+        run_after=datetime.utcnow()
+    )
+    db.session.add(job)
+    return job
+
+def get_latest_job(job_type, photo_id):
+    """Get the most recent job of a type for a photo"""
+    from models import BackgroundJob
+
+    return BackgroundJob.query.filter_by(
+        job_type=job_type,
+        photo_id=photo_id
+    ).order_by(BackgroundJob.id.desc()).first()
+
+def job_status(job):
+    """Serialize a job's status for JSON responses"""
+    return {
+        'id': job.id,
+        'type': job.job_type,
+        'status': job.status,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'last_error': job.last_error,
+        'run_after': job.run_after.isoformat() if job.run_after else None,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'updated_at': job.updated_at.isoformat() if job.updated_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None
+    }
+
+def retry_delay(attempts):
+    """Exponential backoff with jitter for a job that has failed `attempts` times"""
+    delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * (2 ** max(0, attempts - 1)))
+    return delay * random.uniform(0.8, 1.2)
+
+def _claimable(now):
+    """Condition matching jobs that are due, or running with an expired lease"""
+    from models import BackgroundJob
+
+    return or_(
+        and_(BackgroundJob.status == JOB_QUEUED, BackgroundJob.run_after <= now),
+        and_(BackgroundJob.status == JOB_RUNNING, BackgroundJob.lease_expires_at < now)
+    )
+
+def claim_job(worker_id, lease_seconds=DEFAULT_LEASE_SECONDS, job_types=None):
+    """
+    Claim the next due job for this worker
+    Claims are a conditional UPDATE, so two workers racing for the same row cannot both win
+    """
+    from models import BackgroundJob
+
+    now = datetime.utcnow()
+    query = db.session.query(BackgroundJob.id).filter(_claimable(now))
+    if job_types:
+        query = query.filter(BackgroundJob.job_type.in_(job_types))
+    query = query.order_by(BackgroundJob.run_after, BackgroundJob.id).limit(10)
+
+    # Postgres can skip rows other workers are already claiming
+    if db.engine.dialect.name == 'postgresql':
+        query = query.with_for_update(skip_locked=True)
+
+    candidate_ids = [row.id for row in query.all()]
+
+    for job_id in candidate_ids:
+        result = db.session.execute(
+            update(BackgroundJob)
+            .where(BackgroundJob.id == job_id, _claimable(now))
+            .values(
+                status=JOB_RUNNING,
+                locked_by=worker_id,
+                lease_expires_at=now + timedelta(seconds=lease_seconds),
+                attempts=BackgroundJob.attempts + 1,
+                updated_at=now
+            )
+        )
+        db.session.commit()
+
+        if result.rowcount == 1:
+            job = db.session.get(BackgroundJob, job_id)
+            # A plain attribute, so it keeps naming this worker after commits reload the row
+            job.claimed_by = worker_id
+            return job
+
+    db.session.commit()
+    return None
+
+class LeaseLost(Exception):
+    """Raised by a handler that found another worker took its job over"""
+
+def extend_lease(job, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """
+    Renew a job's lease; long running handlers call this between steps
+    Returns False if the lease expired and another worker claimed the job.
+    """
+    from models import BackgroundJob
+
+    now = datetime.utcnow()
+    result = db.session.execute(
+        update(BackgroundJob)
+        .where(BackgroundJob.id == job.id, BackgroundJob.locked_by == job.claimed_by)
+        .values(lease_expires_at=now + timedelta(seconds=lease_seconds), updated_at=now)
+    )
+    db.session.commit()
+    if result.rowcount != 1:
+        logger.warning(f"Lost lease on job {job.id} to another worker")
+        return False
+    return True
+
+def _finish_job(job, values):
+    """Record a job's outcome if this worker still holds its lease"""
+    from models import BackgroundJob
+
+    values['updated_at'] = datetime.utcnow()
+    values['lease_expires_at'] = None
+    result = db.session.execute(
+        update(BackgroundJob)
+        .where(BackgroundJob.id == job.id, BackgroundJob.locked_by == job.claimed_by)
+        .values(**values)
+    )
+    db.session.commit()
+    if result.rowcount != 1:
+        logger.warning(f"Lost lease on job {job.id} before it finished, leaving its outcome to the new owner")
+
+def run_job(job):
+    """Run a claimed job and record success, a scheduled retry, or permanent failure"""
+    handler = _job_handlers.get(job.job_type)
+    # Read before the handler runs; after a lost lease the row holds the new owner's attempts
+    job_id, job_type, attempts, max_attempts = job.id, job.job_type, job.attempts, job.max_attempts
+
+    try:
+        if handler is None:
+            raise RuntimeError(f"No handler registered for job type '{job_type}'")
+        if attempts > max_attempts:
+            raise RuntimeError(f"Gave up after {job.max_attempts} attempts")
+
+        handler(job)
+
+        _finish_job(job, {
+            'status': JOB_DONE,
+            'last_error': None,
+            'finished_at': datetime.utcnow()
+        })
+        return True
+
+    except LeaseLost:
+        # The new owner records the outcome
+        db.session.rollback()
+        logger.warning(f"Stopped job {job_id} ({job_type}), another worker took it over")
+        return False
+
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error running job {job_id} ({job_type}): {str(e)}")
+
+        if attempts < max_attempts and handler is not None:
+            _finish_job(job, {
+                'status': JOB_QUEUED,
+                'last_error': str(e),
+                'run_after': datetime.utcnow() + timedelta(seconds=retry_delay(attempts))
+            })
+        else:
+            _finish_job(job, {
+                'status': JOB_FAILED,
+                'last_error': str(e),
+                'finished_at': datetime.utcnow()
+            })
+        return False
+
+def make_worker_id():
+    """Identify this worker process in job leases"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def work_loop(app, poll_interval=2.0, once=False, job_types=None, on_idle=None):
+    """
+    Claim and run jobs until stopped
+    SIGTERM/SIGINT finish the current job before exiting. `on_idle` is called
+    with the worker id whenever the queue is empty.
+    """
+    worker_id = make_worker_id()
+    stopping = []
+
+    def request_stop(signum, frame):
+        logger.info(f"Worker {worker_id} stopping after current job")
+        stopping.append(signum)
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    logger.info(f"Worker {worker_id} started")
+
+    with app.app_context():
+        while not stopping:
+            try:
+                job = claim_job(worker_id, job_types=job_types)
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Error claiming job: {str(e)}")
+                job = None
+
+            if job is not None:
+                run_job(job)
+                continue
+
+            if on_idle is not None:
+                try:
+                    on_idle(worker_id)
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Error in idle work: {str(e)}")
+
+            if once:
+                break
+            time.sleep(poll_interval)
+
+    logger.info(f"Worker {worker_id} stopped")
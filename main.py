@@ -1,4 +1,8 @@
-from app import app
+from app import create_app, init_db, configure_logging
+
+configure_logging()
+app = create_app()
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    init_db(app)
+    app.run(host='0.0.0.0', port=5000, debug=True)
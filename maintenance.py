@@ -0,0 +1,385 @@
+"""
+Maintenance Tasks for the Photo Sharing App
+Periodic upkeep registered under a name and an interval: expiring shareable
+links, pruning old analytics events, purging expired sessions and uploads,
+refreshing planner statistics, vacuuming and checking the database.
+
+Each task has a MaintenanceTask row. A worker runs a task only after taking
+its lease with a conditional UPDATE, so however many workers check the
+schedule, a task runs in one of them at a time. The row also keeps when the
+task last ran, how long it took, whether it failed and the metrics it returned.
+Background workers run due tasks whenever their queue is empty; cron can use
+'flask run-maintenance' instead.
+"""
+
+import json
+import time
+import logging
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import update, select, func, or_, text
+from app import db
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# How long a task stays reserved before another worker may take it over
+DEFAULT_LEASE_SECONDS = 600
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_ANALYTICS_RETENTION_DAYS = 365
+# VACUUM SQLite once this share of its pages is free
+DEFAULT_VACUUM_FREE_RATIO = 0.1
+
+TASK_OK = 'ok'
+TASK_FAILED = 'failed'
+
+# Registered tasks keyed by name: (function, default interval)
+_tasks = {}
+
+def maintenance_task(name, interval):
+    """Register a function as a periodic task; it gets the TaskRun and returns a dict of metrics"""
+    def decorator(f):
+        _tasks[name] = (f, interval)
+        return f
+    return decorator
+
+def get_task_names():
+    """Get the names of every registered task"""
+    return list(_tasks)
+
+def get_interval(name):
+    """Get how often a task runs; MAINTENANCE_INTERVALS overrides the default in seconds"""
+    seconds = current_app.config.get('MAINTENANCE_INTERVALS', {}).get(name)
+    return timedelta(seconds=seconds) if seconds is not None else _tasks[name][1]
+
+def get_batch_size():
+    """Get how many rows a pruning task deletes per transaction"""
+    return current_app.config.get('MAINTENANCE_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+
+class TaskRun:
+    """A claimed run of a task; long tasks call extend_lease between batches"""
+
+    def __init__(self, name, worker_id, started_at, lease_seconds):
+        self.name = name
+        self.worker_id = worker_id
+        self.started_at = started_at
+        self.lease_seconds = lease_seconds
+
+    def extend_lease(self):
+        """Renew the lease; returns False if another worker took the task over"""
+        from models import MaintenanceTask
+
+        result = db.session.execute(
+            update(MaintenanceTask)
+            .where(MaintenanceTask.name == self.name, MaintenanceTask.locked_by == self.worker_id)
+            .values(lease_expires_at=datetime.utcnow() + timedelta(seconds=self.lease_seconds))
+        )
+        db.session.commit()
+        return result.rowcount == 1
+
+def _ensure_task_rows(names):
+    """Create the rows of tasks that have never run"""
+    from models import MaintenanceTask
+
+    table = MaintenanceTask.__table__
+    existing = set(db.session.execute(select(table.c.name).where(table.c.name.in_(names))).scalars())
+    missing = [{'name': name, 'run_count': 0, 'failure_count': 0} for name in names if name not in existing]
+    if not missing:
+        return
+
+    dialect = db.engine.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        db.session.execute(insert(table).on_conflict_do_nothing(index_elements=[table.c.name]), missing)
+    else:
+        # Other databases: a worker that loses the race fails here and claims on the next check
+        db.session.execute(table.insert(), missing)
+    db.session.commit()
+
+def _claimable(name, now, force):
+    """Condition matching a task that is due and not leased to a live worker"""
+    from models import MaintenanceTask
+
+    condition = [
+        MaintenanceTask.name == name,
+        or_(MaintenanceTask.lease_expires_at.is_(None), MaintenanceTask.lease_expires_at < now)
+    ]
+    if not force:
+        condition.append(or_(MaintenanceTask.next_run_at.is_(None), MaintenanceTask.next_run_at <= now))
+    return condition
+
+def claim_task(name, worker_id, force=False, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """Take the lease on a task if it is due; returns a TaskRun, or None if it isn't due or runs elsewhere"""
+    from models import MaintenanceTask
+
+    now = datetime.utcnow()
+    result = db.session.execute(
+        update(MaintenanceTask)
+        .where(*_claimable(name, now, force))
+        .values(locked_by=worker_id, lease_expires_at=now + timedelta(seconds=lease_seconds), last_started_at=now)
+    )
+    db.session.commit()
+
+    if result.rowcount != 1:
+        return None
+    return TaskRun(name, worker_id, now, lease_seconds)
+
+def _finish_task(run, duration, result=None, error=None):
+    """Record a run's outcome and schedule the next one, if this worker still holds the lease"""
+    from models import MaintenanceTask
+
+    values = {
+        'locked_by': None,
+        'lease_expires_at': None,
+        'next_run_at': run.started_at + get_interval(run.name),
+        'last_finished_at': datetime.utcnow(),
+        'last_duration': duration,
+        'last_status': TASK_FAILED if error else TASK_OK,
+        'last_error': error,
+        'last_result': None if error else json.dumps(result or {}),
+        'run_count': MaintenanceTask.run_count + 1,
+    }
+    if error:
+        values['failure_count'] = MaintenanceTask.failure_count + 1
+
+    updated = db.session.execute(
+        update(MaintenanceTask)
+        .where(MaintenanceTask.name == run.name, MaintenanceTask.locked_by == run.worker_id)
+        .values(**values)
+    )
+    db.session.commit()
+    if updated.rowcount != 1:
+        logger.warning(f"Lost lease on maintenance task {run.name} before it finished")
+
+def run_task(run):
+    """Run a claimed task and record its metrics; returns the task's result, or None if it failed"""
+    task = _tasks[run.name][0]
+    start = time.perf_counter()
+
+    try:
+        result = task(run) or {}
+    except Exception as e:
+        db.session.rollback()
+        duration = time.perf_counter() - start
+        logger.error(f"Maintenance task {run.name} failed after {duration:.1f}s: {str(e)}")
+        _finish_task(run, duration, error=str(e))
+        return None
+
+    duration = time.perf_counter() - start
+    logger.info(f"Maintenance task {run.name} finished in {duration:.1f}s: {result}")
+    _finish_task(run, duration, result=result)
+    return result
+
+def run_due_tasks(worker_id, names=None, force=False):
+    """
+    Run every task that is due and not running elsewhere, or only the named ones
+    `force` runs them even if they are not due yet. Returns {name: result} for
+    the tasks this worker ran; a failed task's result is None.
+    """
+    from models import MaintenanceTask
+
+    names = list(names or _tasks)
+    unknown = [name for name in names if name not in _tasks]
+    if unknown:
+        raise ValueError(f"Unknown maintenance task {unknown[0]!r}, expected one of {', '.join(_tasks)}")
+
+    _ensure_task_rows(names)
+
+    # One cheap read finds what is due; the claim's UPDATE still decides who runs it
+    if not force:
+        now = datetime.utcnow()
+        due = set(db.session.execute(
+            select(MaintenanceTask.name).where(
+                MaintenanceTask.name.in_(names),
+                or_(MaintenanceTask.next_run_at.is_(None), MaintenanceTask.next_run_at <= now),
+                or_(MaintenanceTask.lease_expires_at.is_(None), MaintenanceTask.lease_expires_at < now)
+            )
+        ).scalars())
+        db.session.commit()
+        names = [name for name in names if name in due]
+
+    results = {}
+    for name in names:
+        run = claim_task(name, worker_id, force=force)
+        if run is not None:
+            results[name] = run_task(run)
+    return results
+
+def task_status(task):
+    """Serialize a task's schedule and last run"""
+    return {
+        'name': task.name,
+        'next_run_at': task.next_run_at.isoformat() if task.next_run_at else None,
+        'running': bool(task.lease_expires_at and task.lease_expires_at > datetime.utcnow()),
+        'locked_by': task.locked_by,
+        'last_started_at': task.last_started_at.isoformat() if task.last_started_at else None,
+        'last_duration': task.last_duration,
+        'last_status': task.last_status,
+        'last_error': task.last_error,
+        'last_result': json.loads(task.last_result) if task.last_result else None,
+        'run_count': task.run_count,
+        'failure_count': task.failure_count
+    }
+
+def _autocommit_connection():
+    """A connection outside any transaction, which VACUUM requires"""
+    return db.engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+
+@maintenance_task('expire-links', timedelta(minutes=5))
+def expire_links(run):
+    """Deactivate every shareable link past its expiry in one UPDATE"""
+    from models import ShareableLink
+
+    result = db.session.execute(
+        update(ShareableLink)
+        .where(ShareableLink.is_active == True, ShareableLink.expires_at < datetime.utcnow())
+        .values(is_active=False)
+    )
+    db.session.commit()
+    return {'expired': result.rowcount}
+
+@maintenance_task('prune-analytics', timedelta(days=1))
+def prune_analytics(run):
+    """
+    Delete raw analytics events older than ANALYTICS_RETENTION_DAYS, in batches
+    The cutoff is a midnight, so every day left keeps all its events and the
+    daily rollup, which keeps the totals of pruned days, can still be rebuilt.
+    """
+    from models import Analytics
+
+    days = current_app.config.get('ANALYTICS_RETENTION_DAYS', DEFAULT_ANALYTICS_RETENTION_DAYS)
+    if not days:
+        return {'deleted': 0}
+
+    cutoff = datetime.combine((datetime.utcnow() - timedelta(days=days)).date(), datetime.min.time())
+    batch_size = get_batch_size()
+    deleted = batches = 0
+
+    while True:
+        ids = select(Analytics.id).where(Analytics.timestamp < cutoff).limit(batch_size)
+        result = db.session.execute(Analytics.__table__.delete().where(Analytics.id.in_(ids.scalar_subquery())))
+        db.session.commit()
+
+        deleted += result.rowcount
+        batches += 1
+        if result.rowcount < batch_size or not run.extend_lease():
+            break
+
+    return {'deleted': deleted, 'batches': batches, 'cutoff': cutoff.isoformat()}
+
+@maintenance_task('purge-sessions', timedelta(hours=1))
+def purge_sessions(run):
+    """Delete expired server-side sessions"""
+    from session_utils import purge_expired_sessions
+
+    return {'purged': purge_expired_sessions(current_app._get_current_object(), get_batch_size())}
+
+@maintenance_task('purge-uploads', timedelta(hours=1))
+def purge_uploads(run):
+    """Delete abandoned upload sessions and the data they received"""
+    from upload_utils import purge_expired_uploads
+
+    return {'purged': purge_expired_uploads()}
+
+@maintenance_task('replay-counters', timedelta(hours=1))
+def replay_counters(run):
+    """Add the counts of web workers that died before flushing them"""
+    from counter_buffer import counter_buffer
+
+    return {'replayed': counter_buffer.recover()}
+
+@maintenance_task('analyze-db', timedelta(days=1))
+def analyze_db(run):
+    """Refresh the statistics the query planner chooses indexes with"""
+    with _autocommit_connection() as connection:
+        connection.execute(text('ANALYZE'))
+    return {}
+
+@maintenance_task('vacuum-db', timedelta(days=7))
+def vacuum_db(run):
+    """
+    Reclaim space left by deleted rows
+    SQLite rewrites the whole file, so it is only vacuumed once
+    MAINTENANCE_VACUUM_FREE_RATIO of its pages are free. Postgres gets a plain
+    VACUUM, which runs alongside reads and writes.
+    """
+    with _autocommit_connection() as connection:
+        if connection.dialect.name != 'sqlite':
+            connection.execute(text('VACUUM'))
+            return {'vacuumed': True}
+
+        page_count = connection.execute(text('PRAGMA page_count')).scalar()
+        free_pages = connection.execute(text('PRAGMA freelist_count')).scalar()
+        threshold = current_app.config.get('MAINTENANCE_VACUUM_FREE_RATIO', DEFAULT_VACUUM_FREE_RATIO)
+        if not page_count or free_pages < page_count * threshold:
+            return {'vacuumed': False, 'pages': page_count, 'free_pages': free_pages}
+
+        connection.execute(text('VACUUM'))
+        # Leave the write-ahead log empty instead of holding a copy of the old file
+        connection.execute(text('PRAGMA wal_checkpoint(TRUNCATE)'))
+        pages_after = connection.execute(text('PRAGMA page_count')).scalar()
+        return {'vacuumed': True, 'pages': page_count, 'free_pages': free_pages, 'pages_after': pages_after}
+
+@maintenance_task('integrity-sweep', timedelta(days=1))
+def integrity_sweep(run):
+    """
+    Check the database and the counts kept in step by session hooks
+    Album stats that drifted are repaired; blob reference counts that
+    disagree with the photos referencing them are only reported, since fixing
+    them races with uploads on Postgres.
+    """
+    from models import Blob, Photo
+    from album_utils import repair_album_stats
+
+    result = {}
+    if db.engine.dialect.name == 'sqlite':
+        with db.engine.connect() as connection:
+            problems = [row[0] for row in connection.execute(text('PRAGMA quick_check'))]
+        result['quick_check'] = 'ok' if problems == ['ok'] else problems[:10]
+        if problems != ['ok']:
+            logger.error(f"SQLite quick_check found problems: {problems[:10]}")
+
+    result['albums_repaired'] = repair_album_stats(only_drifted=True)
+
+    references = select(func.count(Photo.id)).where(Photo.blob_digest == Blob.digest).scalar_subquery()
+    drifted = db.session.execute(select(func.count()).select_from(Blob).where(Blob.ref_count != references)).scalar()
+    db.session.commit()
+    if drifted:
+        logger.warning(f"{drifted} blobs have a reference count that disagrees with their photos")
+    result['blob_refs_drifted'] = drifted
+
+    return result
+
+@maintenance_task('reconcile-storage', timedelta(days=1))
+def reconcile_storage(run):
+    """Quarantine upload files no photo references, continuing the pass the last run left off"""
+    from storage_reconciler import reconcile_storage, get_max_files
+
+    return reconcile_storage(max_files=get_max_files(), on_batch=run.extend_lease)
+
+@maintenance_task('purge-quarantine', timedelta(days=1))
+def purge_quarantine(run):
+    """Delete quarantined upload files past their retention and restore any that are referenced again"""
+    from storage_reconciler import purge_quarantine
+
+    deleted, restored = purge_quarantine()
+    return {'deleted': deleted, 'restored': restored}
+
+@maintenance_task('report-missing-files', timedelta(days=7))
+def report_missing_files(run):
+    """Count photos whose original file is gone; they can't be repaired automatically"""
+    from storage_reconciler import find_missing_files
+
+    count = 0
+    photo_ids = []
+    for photo_id, path in find_missing_files():
+        count += 1
+        if len(photo_ids) < 20:
+            photo_ids.append(photo_id)
+    if count:
+        logger.warning(f"{count} photos have no original file, e.g. photo ids {photo_ids[:10]}")
+    return {'missing': count, 'photo_ids': photo_ids}
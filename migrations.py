@@ -0,0 +1,194 @@
+"""
+Schema Migrations for the Photo Sharing App
+db.create_all() creates missing tables but never changes existing ones. The
+migrations in this module bring an older database up to date. Each one is
+safe to re-run and is recorded in the schema_migration table once applied.
+"""
+
+import json
+import logging
+from sqlalchemy import inspect, text
+from app import db
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH_SIZE = 1000
+
+# Registered migrations in the order they must run
+_migrations = []
+
+def migration(name):
+    """Register a function as a named migration"""
+    def decorator(f):
+        _migrations.append((name, f))
+        return f
+    return decorator
+
+def column_exists(table_name, column_name):
+    """Check if a table already has a column"""
+    columns = inspect(db.engine).get_columns(table_name)
+    return any(column['name'] == column_name for column in columns)
+
+def add_column(table_name, column_name, column_ddl):
+    """Add a column to an existing table unless it is already there"""
+    if column_exists(table_name, column_name):
+        return False
+    with db.engine.begin() as connection:
+        connection.execute(text(f'ALTER TABLE {table_name} ADD COLUMN {column_name} {column_ddl}'))
+    logger.info(f"Added column {table_name}.{column_name}")
+    return True
+
+def create_indexes(model):
+    """
+    Create any indexes declared on a model that the database doesn't have yet
+    Indexes on columns that a later migration adds are left for that migration.
+    """
+    columns = {column['name'] for column in inspect(db.engine).get_columns(model.__tablename__)}
+    for index in model.__table__.indexes:
+        if all(column.name in columns for column in index.columns):
+            index.create(db.engine, checkfirst=True)
+
+def run_migrations():
+    """Apply every migration that hasn't been recorded yet"""
+    from models import SchemaMigration
+
+    SchemaMigration.__table__.create(db.engine, checkfirst=True)
+    applied = {row.name for row in SchemaMigration.query.all()}
+
+    for name, apply in _migrations:
+        if name in applied:
+            continue
+
+        logger.info(f"Applying migration {name}")
+        apply()
+
+        db.session.add(SchemaMigration(name=name))
+        db.session.commit()
+
+@migration('0001_analytics_photo_id')
+def analytics_photo_id():
+    """Add Analytics.photo_id and fill it from the event_data JSON of photo events"""
+    from models import Analytics, Photo
+
+    add_column('analytics', 'photo_id', 'INTEGER REFERENCES photo(id) ON DELETE SET NULL')
+    create_indexes(Analytics)
+
+    table = Analytics.__table__
+    last_id = 0
+    updated = 0
+
+    while True:
+        rows = db.session.query(Analytics.id, Analytics.event_data).filter(
+            Analytics.id > last_id,
+            Analytics.photo_id.is_(None),
+            Analytics.event_type.in_(['photo_view', 'photo_download'])
+        ).order_by(Analytics.id).limit(BACKFILL_BATCH_SIZE).all()
+
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        photo_ids = {}
+        for row in rows:
+            try:
+                photo_id = json.loads(row.event_data or '{}').get('photo_id')
+            except ValueError:
+                continue
+            if isinstance(photo_id, int):
+                photo_ids[row.id] = photo_id
+
+        # Leave events for photos that no longer exist unlinked
+        existing = {
+            photo_id for (photo_id,) in db.session.query(Photo.id).filter(
+                Photo.id.in_(set(photo_ids.values()))
+            )
+        }
+        params = [
+            {'event_id': event_id, 'new_photo_id': photo_id}
+            for event_id, photo_id in photo_ids.items()
+            if photo_id in existing
+        ]
+
+        if params:
+            db.session.execute(
+                table.update().where(table.c.id == db.bindparam('event_id')).values(photo_id=db.bindparam('new_photo_id')),
+                params
+            )
+        db.session.commit()
+        updated += len(params)
+
+    logger.info(f"Linked {updated} analytics events to their photos")
+
+@migration('0002_hot_query_indexes')
+def hot_query_indexes():
+    """Create the indexes used by the room, photo, album, analytics and dashboard queries"""
+    from models import Photo, Room, RoomMember, PhotoTag, ShareableLink, Analytics, Album
+
+    for model in (Photo, Room, RoomMember, PhotoTag, ShareableLink, Analytics, Album):
+        create_indexes(model)
+
+@migration('0003_album_stats')
+def album_stats():
+    """Add Album.cover_photo_id and Album.photo_count and fill them in"""
+    from album_utils import repair_album_stats
+
+    add_column('album', 'cover_photo_id', 'INTEGER REFERENCES photo(id) ON DELETE SET NULL')
+    add_column('album', 'photo_count', 'INTEGER NOT NULL DEFAULT 0')
+    repair_album_stats()
+
+@migration('0004_photo_tag_embedding')
+def photo_tag_embedding():
+    """Add PhotoTag.embedding for detected faces"""
+    binary_type = db.LargeBinary().compile(dialect=db.engine.dialect)
+    add_column('photo_tag', 'embedding', binary_type)
+
+@migration('0005_retrain_columns')
+def retrain_columns():
+    """Add PhotoTag.detection_confidence and BatchRun.kind"""
+    from models import PhotoTag
+
+    add_column('photo_tag', 'detection_confidence', 'FLOAT')
+    add_column('batch_run', 'kind', "VARCHAR(30) NOT NULL DEFAULT 'face_recognition'")
+
+    # Existing automatic tags keep their current confidence as the detection score
+    table = PhotoTag.__table__
+    with db.engine.begin() as connection:
+        connection.execute(
+            table.update()
+            .where(table.c.is_manual == False, table.c.detection_confidence.is_(None))
+            .values(detection_confidence=table.c.confidence)
+        )
+
+@migration('0006_photo_phash')
+def photo_phash():
+    """Add Photo.phash and Photo.duplicate_of_id; run 'flask backfill-phash' to hash existing photos"""
+    from models import Photo
+
+    add_column('photo', 'phash', 'BIGINT')
+    add_column('photo', 'duplicate_of_id', 'INTEGER REFERENCES photo(id) ON DELETE SET NULL')
+    create_indexes(Photo)
+
+@migration('0007_blob_storage')
+def blob_storage():
+    """Add Photo.blob_digest; run 'flask migrate-storage' to move existing uploads into the blob store"""
+    from models import Photo, Blob
+
+    Blob.__table__.create(db.engine, checkfirst=True)
+    add_column('photo', 'blob_digest', 'VARCHAR(64) REFERENCES blob(digest)')
+    create_indexes(Photo)
+
+@migration('0008_maintenance_indexes')
+def maintenance_indexes():
+    """Index Analytics.timestamp for retention pruning and expiring shareable links for the expiry sweep"""
+    from models import Analytics, ShareableLink
+
+    create_indexes(Analytics)
+    create_indexes(ShareableLink)
+
+@migration('0009_analytics_rollup_backfill')
+def analytics_rollup_backfill():
+    """Fill the daily analytics rollup from the raw events recorded before it existed"""
+    from analytics_rollup import rebuild_rollup
+
+    rebuild_rollup()
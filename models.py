@@ -25,20 +25,42 @@ class Photo(db.Model):
     room_id = db.Column(db.Integer, db.ForeignKey('room.id'), nullable=False)
     description = db.Column(db.Text, nullable=True)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
-    album_id = db.Column(db.Integer, db.ForeignKey('album.id'), nullable=True)
+    # active_history loads the old value when it is replaced, for album_utils to decrement that album
+    album_id = db.column_property(db.Column(db.Integer, db.ForeignKey('album.id'), nullable=True), active_history=True)
     download_count = db.Column(db.Integer, default=0)
+    phash = db.Column(db.BigInteger, nullable=True)  # 64-bit perceptual hash, see duplicate_utils
+    duplicate_of_id = db.Column(db.Integer, db.ForeignKey('photo.id', ondelete='SET NULL'), nullable=True)
+    # SHA-256 of the content, see storage_utils; the old value is loaded when replaced, to drop that blob's reference
+    blob_digest = db.column_property(db.Column(db.String(64), db.ForeignKey('blob.digest'), nullable=True, index=True), active_history=True)
     
     tags = db.relationship('PhotoTag', backref='photo', lazy=True, cascade="all, delete-orphan")
+    jobs = db.relationship('BackgroundJob', backref='photo', lazy=True, cascade="all, delete-orphan")
+    duplicate_of = db.relationship('Photo', remote_side=[id], foreign_keys=[duplicate_of_id])
+    
+    __table_args__ = (
+        db.Index('ix_photo_room_uploaded', 'room_id', 'uploaded_at'),
+        db.Index('ix_photo_album_uploaded', 'album_id', 'uploaded_at'),
+        db.Index('ix_photo_room_duplicate', 'room_id', 'duplicate_of_id'),
+    )
     
     def __repr__(self):
         return f'<Photo {self.original_filename}>'
 
+class Blob(db.Model):
+    digest = db.Column(db.String(64), primary_key=True)  # Hex SHA-256 of the content
+    size = db.Column(db.BigInteger, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Photos referencing this blob
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<Blob {self.digest} refs={self.ref_count}>'
+
 class Room(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
-    creator_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    access_code = db.Column(db.String(20), nullable=True)
+    creator_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    access_code = db.Column(db.String(20), nullable=True, index=True)
     is_public = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     face_recognition_enabled = db.Column(db.Boolean, default=True)
@@ -48,6 +70,11 @@ class Room(db.Model):
     shareable_links = db.relationship('ShareableLink', backref='room', lazy=True, cascade="all, delete-orphan")
     albums = db.relationship('Album', backref='room', lazy=True, cascade="all, delete-orphan")
     analytics = db.relationship('Analytics', backref='room', lazy=True, cascade="all, delete-orphan")
+    analytics_rollups = db.relationship('AnalyticsDailyRollup', backref='room', lazy=True, cascade="all, delete-orphan")
+    jobs = db.relationship('BackgroundJob', backref='room', lazy=True, cascade="all, delete-orphan")
+    batch_runs = db.relationship('BatchRun', backref='room', lazy=True, cascade="all, delete-orphan")
+    
+    __table_args__ = (db.Index('ix_room_public_created', 'is_public', 'created_at'),)
     
     def __repr__(self):
         return f'<Room {self.name}>'
@@ -55,7 +82,7 @@ class Room(db.Model):
 class RoomMember(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     room_id = db.Column(db.Integer, db.ForeignKey('room.id'), nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     joined_at = db.Column(db.DateTime, default=datetime.utcnow)
     role = db.Column(db.String(20), default='member')  # 'member', 'admin'
     
@@ -66,11 +93,15 @@ class RoomMember(db.Model):
 
 class PhotoTag(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    photo_id = db.Column(db.Integer, db.ForeignKey('photo.id'), nullable=False)
+    photo_id = db.Column(db.Integer, db.ForeignKey('photo.id'), nullable=False, index=True)
     tag_name = db.Column(db.String(100), nullable=False)
     confidence = db.Column(db.Float, nullable=True)
+    detection_confidence = db.Column(db.Float, nullable=True)  # Detector score before retraining adjusts confidence
     is_manual = db.Column(db.Boolean, default=False)
     box_coordinates = db.Column(db.Text, nullable=True)  # JSON string with x, y, width, height
+    embedding = db.Column(db.LargeBinary, nullable=True)  # 128 little-endian float32 values, see face_index
+    
+    __table_args__ = (db.Index('ix_photo_tag_name_manual', 'tag_name', 'is_manual'),)
     
     def __repr__(self):
         return f'<PhotoTag {self.tag_name} for photo_id={self.photo_id}>'
@@ -90,6 +121,11 @@ class ShareableLink(db.Model):
     is_active = db.Column(db.Boolean, default=True)
     access_count = db.Column(db.Integer, default=0)
     
+    __table_args__ = (
+        db.Index('ix_shareable_link_room_active', 'room_id', 'is_active'),
+        db.Index('ix_shareable_link_active_expires', 'is_active', 'expires_at'),
+    )
+    
     def __init__(self, room_id, created_by, expires_in_days=None):
         self.room_id = room_id
         self.created_by = created_by
@@ -111,14 +147,32 @@ class Analytics(db.Model):
     room_id = db.Column(db.Integer, db.ForeignKey('room.id'), nullable=False)
     event_type = db.Column(db.String(50), nullable=False)  # 'room_view', 'photo_download', 'link_access'
     event_data = db.Column(db.Text, nullable=True)  # JSON string with additional data
+    photo_id = db.Column(db.Integer, db.ForeignKey('photo.id', ondelete='SET NULL'), nullable=True, index=True)  # Set for photo events
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)  # Can be null for guest access
     ip_address = db.Column(db.String(50), nullable=True)
     user_agent = db.Column(db.String(255), nullable=True)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)  # Indexed for retention pruning
+    
+    __table_args__ = (
+        db.Index('ix_analytics_room_event_time', 'room_id', 'event_type', 'timestamp'),
+        db.Index('ix_analytics_room_event_photo', 'room_id', 'event_type', 'photo_id'),
+    )
     
     def __repr__(self):
         return f'<Analytics {self.event_type} for room_id={self.room_id}>'
 
+class AnalyticsDailyRollup(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    room_id = db.Column(db.Integer, db.ForeignKey('room.id'), nullable=False)
+    event_type = db.Column(db.String(50), nullable=False)
+    day = db.Column(db.Date, nullable=False)  # UTC date of the events
+    count = db.Column(db.Integer, nullable=False, default=0)
+    
+    __table_args__ = (db.UniqueConstraint('room_id', 'event_type', 'day', name='unique_analytics_rollup'),)
+    
+    def __repr__(self):
+        return f'<AnalyticsDailyRollup {self.event_type} {self.day} for room_id={self.room_id}>'
+
 class FaceRecognitionSettings(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     min_confidence = db.Column(db.Float, default=0.6)
@@ -137,8 +191,131 @@ class Album(db.Model):
     room_id = db.Column(db.Integer, db.ForeignKey('room.id'), nullable=False)
     is_auto_generated = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Maintained by album_utils whenever photos enter or leave the album
+    cover_photo_id = db.Column(db.Integer, db.ForeignKey('photo.id', use_alter=True, ondelete='SET NULL'), nullable=True)
+    photo_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
+    photos = db.relationship('Photo', backref='album', lazy=True, foreign_keys='Photo.album_id')
     
-    photos = db.relationship('Photo', backref='album', lazy=True)
+    __table_args__ = (db.Index('ix_album_room_name', 'room_id', 'name'),)
     
     def __repr__(self):
         return f'<Album {self.name} for room_id={self.room_id}>'
+
+class BackgroundJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    job_type = db.Column(db.String(50), nullable=False)  # 'face_recognition'
+    photo_id = db.Column(db.Integer, db.ForeignKey('photo.id'), nullable=True, index=True)
+    room_id = db.Column(db.Integer, db.ForeignKey('room.id'), nullable=True)
+    payload = db.Column(db.Text, nullable=True)  # JSON string with job arguments
+    status = db.Column(db.String(20), nullable=False, default='queued')  # 'queued', 'running', 'done', 'failed'
+    attempts = db.Column(db.Integer, default=0)
+    max_attempts = db.Column(db.Integer, default=5)
+    run_after = db.Column(db.DateTime, default=datetime.utcnow)
+    locked_by = db.Column(db.String(100), nullable=True)  # Worker holding the lease
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    __table_args__ = (db.Index('ix_background_job_claim', 'status', 'run_after'),)
+    
+    def __repr__(self):
+        return f'<BackgroundJob {self.job_type} id={self.id} status={self.status}>'
+    
+    def get_payload(self):
+        if self.payload:
+            return json.loads(self.payload)
+        return {}
+
+class BatchRun(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    room_id = db.Column(db.Integer, db.ForeignKey('room.id'), nullable=False, index=True)
+    kind = db.Column(db.String(30), nullable=False, default='face_recognition', server_default='face_recognition')  # 'face_recognition' or 'retrain'
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # 'pending', 'running', 'done', 'failed'
+    total = db.Column(db.Integer, default=0)
+    done_count = db.Column(db.Integer, default=0)
+    failed_count = db.Column(db.Integer, default=0)
+    cursor = db.Column(db.Integer, default=0)  # Highest photo id already processed
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    def __repr__(self):
+        return f'<BatchRun id={self.id} room_id={self.room_id} status={self.status}>'
+    
+    def is_active(self):
+        return self.status in ('pending', 'running')
+
+class UploadSession(db.Model):
+    id = db.Column(db.String(32), primary_key=True)  # Random hex token, see upload_utils
+    room_id = db.Column(db.Integer, db.ForeignKey('room.id', ondelete='CASCADE'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    original_filename = db.Column(db.String(255), nullable=False)
+    description = db.Column(db.Text, nullable=True)
+    total_size = db.Column(db.BigInteger, nullable=False)
+    received = db.Column(db.BigInteger, nullable=False, default=0)  # Bytes written so far, the offset of the next chunk
+    status = db.Column(db.String(20), nullable=False, default='open')  # 'open', 'complete', 'failed'
+    photo_id = db.Column(db.Integer, db.ForeignKey('photo.id', ondelete='SET NULL'), nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    
+    def __repr__(self):
+        return f'<UploadSession {self.id} {self.received}/{self.total_size} status={self.status}>'
+
+class ServerSession(db.Model):
+    id = db.Column(db.String(64), primary_key=True)  # Random token, the cookie carries it signed, see session_utils
+    data = db.Column(db.Text, nullable=False)  # Session contents as tagged JSON
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    
+    def __repr__(self):
+        return f'<ServerSession expires_at={self.expires_at}>'
+
+class CounterFlush(db.Model):
+    segment = db.Column(db.String(64), primary_key=True)  # Journal segment whose counts were added, see counter_buffer
+    flushed_at = db.Column(db.DateTime, nullable=False, index=True)
+    
+    def __repr__(self):
+        return f'<CounterFlush {self.segment}>'
+
+class MaintenanceTask(db.Model):
+    name = db.Column(db.String(50), primary_key=True)  # Registered task name, see maintenance
+    next_run_at = db.Column(db.DateTime, nullable=True)
+    locked_by = db.Column(db.String(100), nullable=True)  # Worker holding the lease
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+    last_started_at = db.Column(db.DateTime, nullable=True)
+    last_finished_at = db.Column(db.DateTime, nullable=True)
+    last_duration = db.Column(db.Float, nullable=True)  # Seconds
+    last_status = db.Column(db.String(20), nullable=True)  # 'ok', 'failed'
+    last_error = db.Column(db.Text, nullable=True)
+    last_result = db.Column(db.Text, nullable=True)  # JSON metrics returned by the task
+    run_count = db.Column(db.Integer, nullable=False, default=0)
+    failure_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<MaintenanceTask {self.name} status={self.last_status}>'
+
+class StorageScan(db.Model):
+    name = db.Column(db.String(50), primary_key=True)  # Tree being reconciled, see storage_reconciler
+    cursor = db.Column(db.Text, nullable=True)  # Last file checked in the current pass, None between passes
+    pass_started_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=True)
+    completed_at = db.Column(db.DateTime, nullable=True)  # End of the last full pass
+    files_checked = db.Column(db.Integer, nullable=False, default=0)  # In the current pass
+    orphans_quarantined = db.Column(db.Integer, nullable=False, default=0)  # In the current pass
+    
+    def __repr__(self):
+        return f'<StorageScan {self.name} cursor={self.cursor}>'
+
+class SchemaMigration(db.Model):
+    name = db.Column(db.String(100), primary_key=True)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<SchemaMigration {self.name}>'
@@ -0,0 +1,62 @@
+"""
+Pagination Utilities for the Photo Sharing App
+This module pages through photo feeds newest first using keyset (cursor)
+pagination on (uploaded_at, id). Each page is a single indexed range read of
+page_size rows, however deep into the feed the reader has scrolled.
+"""
+
+import base64
+import binascii
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import tuple_
+from sqlalchemy.orm import selectinload
+
+DEFAULT_PAGE_SIZE = 60
+
+class InvalidCursor(ValueError):
+    """Raised when a cursor from the query string can't be decoded"""
+
+def get_page_size():
+    """Get the configured number of photos per page"""
+    return current_app.config.get('PHOTO_PAGE_SIZE', DEFAULT_PAGE_SIZE)
+
+def encode_cursor(photo):
+    """Build an opaque cursor pointing just after a photo"""
+    raw = f"{photo.uploaded_at.isoformat()}|{photo.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Turn a cursor back into (uploaded_at, id)"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        uploaded_at, photo_id = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+        return datetime.fromisoformat(uploaded_at), int(photo_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from e
+
+def paginate_photos(query, after=None, page_size=None):
+    """
+    Get one page of a Photo query, newest first
+    Returns (photos, next_cursor); next_cursor is None on the last page
+    """
+    from models import Photo
+
+    page_size = page_size or get_page_size()
+
+    if after:
+        uploaded_at, photo_id = decode_cursor(after)
+        query = query.filter(tuple_(Photo.uploaded_at, Photo.id) < tuple_(uploaded_at, photo_id))
+
+    # Fetch one extra row to learn whether another page follows
+    photos = query.options(selectinload(Photo.tags)).order_by(
+        Photo.uploaded_at.desc(),
+        Photo.id.desc()
+    ).limit(page_size + 1).all()
+
+    next_cursor = None
+    if len(photos) > page_size:
+        photos = photos[:page_size]
+        next_cursor = encode_cursor(photos[-1])
+
+    return photos, next_cursor
@@ -0,0 +1,248 @@
+"""
+Permission Utilities for the Photo Sharing App
+Resolves who may see a room. The current user, each Room, its access settings
+and each (room, user) membership are looked up once per request and kept in
+flask.g, so a view gets the Room its access check loaded; room settings and memberships are also kept across requests in a
+bounded, expiring LRU cache so a repeated access check costs no query.
+
+A session hook drops cached entries when a RoomMember is added, changed or
+removed, or when a room's creator, is_public or access_code changes. The
+hook only reaches this process's cache; other processes see the change once
+their entries expire after PERMISSION_CACHE_TTL seconds.
+"""
+
+import time
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+from flask import current_app, g, session, abort, has_app_context
+from sqlalchemy import event, inspect
+from app import db
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SIZE = 10000
+DEFAULT_CACHE_TTL = 30  # seconds
+
+# What an access check needs to know about a room
+RoomAccess = namedtuple('RoomAccess', ['creator_id', 'is_public', 'access_code'])
+
+# Room attributes whose change affects access
+ACCESS_ATTRIBUTES = ('creator_id', 'is_public', 'access_code')
+
+_MISSING = object()
+
+class TTLCache:
+    """Least recently used cache with a size bound whose entries also expire after ttl seconds"""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=_MISSING):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def _shared_cache():
+    """Get this process's cross-request cache, sized from the app config on first use"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = TTLCache(
+                    current_app.config.get('PERMISSION_CACHE_SIZE', DEFAULT_CACHE_SIZE),
+                    current_app.config.get('PERMISSION_CACHE_TTL', DEFAULT_CACHE_TTL)
+                )
+    return _cache
+
+def _request_cache():
+    """Get the per-request memo kept in flask.g"""
+    if 'permission_cache' not in g:
+        g.permission_cache = {}
+    return g.permission_cache
+
+def _lookup(key, load):
+    """Get a value from the request memo, then the shared cache, then the database"""
+    memo = _request_cache()
+    if key in memo:
+        return memo[key]
+
+    shared = _shared_cache()
+    value = shared.get(key)
+    if value is _MISSING:
+        value = load()
+        shared.set(key, value)
+
+    memo[key] = value
+    return value
+
+def get_current_user():
+    """Get the logged in User, loaded at most once per request"""
+    from models import User
+
+    if 'current_user' not in g:
+        user_id = session.get('user_id')
+        g.current_user = db.session.get(User, user_id) if user_id else None
+    return g.current_user
+
+def get_room(room_id):
+    """Get a Room, loaded at most once per request, or None if there is no such room"""
+    from models import Room
+
+    rooms = g.setdefault('rooms', {})
+    if room_id not in rooms:
+        rooms[room_id] = db.session.get(Room, room_id)
+    return rooms[room_id]
+
+def get_room_or_404(room_id):
+    """Get a Room like get_room, aborting with 404 if there is no such room"""
+    room = get_room(room_id)
+    if room is None:
+        abort(404)
+    return room
+
+def get_room_access(room_id):
+    """Get a room's RoomAccess, or None if there is no such room"""
+    def load():
+        room = get_room(room_id)
+        return RoomAccess(room.creator_id, room.is_public, room.access_code) if room else None
+
+    return _lookup(('room', room_id), load)
+
+def get_member_role(room_id, user_id):
+    """Get a user's role in a room, or None if they are not a member"""
+    from models import RoomMember
+
+    if not user_id:
+        return None
+
+    def load():
+        return db.session.query(RoomMember.role).filter(
+            RoomMember.room_id == room_id,
+            RoomMember.user_id == user_id
+        ).scalar()
+
+    return _lookup(('member', room_id, user_id), load)
+
+def can_access_room(room_id):
+    """Check if the current visitor can access the room"""
+    room = get_room_access(room_id)
+    if room is None:
+        return False
+
+    # Public rooms are accessible to everyone
+    if room.is_public:
+        return True
+
+    # Admin/creator and room members have access
+    user_id = session.get('user_id')
+    if user_id and (user_id == room.creator_id or get_member_role(room_id, user_id) is not None):
+        return True
+
+    # Check if the visitor entered the room's current access code
+    code = session.get('room_access_codes', {}).get(str(room_id))
+    return code is not None and (room.access_code is None or code == room.access_code)
+
+def is_room_admin(room_id):
+    """Check if the current user created the room or is one of its admins"""
+    room = get_room_access(room_id)
+    user_id = session.get('user_id')
+    if room is None or not user_id:
+        return False
+    return user_id == room.creator_id or get_member_role(room_id, user_id) == 'admin'
+
+def invalidate_room(room_id):
+    """Forget cached access settings of a room"""
+    _discard(('room', room_id))
+
+def invalidate_membership(room_id, user_id):
+    """Forget a cached membership"""
+    _discard(('member', room_id, user_id))
+
+def clear_permission_cache():
+    """Forget everything cached in this process"""
+    if _cache is not None:
+        _cache.clear()
+
+def _discard(key):
+    if _cache is not None:
+        _cache.discard(key)
+    if has_app_context():
+        if 'permission_cache' in g:
+            g.permission_cache.pop(key, None)
+        # A room created or deleted since it was looked up
+        if key[0] == 'room' and 'rooms' in g:
+            g.rooms.pop(key[1], None)
+
+def _changed_keys(session):
+    """Get the cache keys of rooms and memberships changed in a flush"""
+    from models import Room, RoomMember
+
+    keys = set()
+    for obj in list(session.new) + list(session.deleted) + list(session.dirty):
+        if isinstance(obj, RoomMember):
+            # A membership moved to another room or user also leaves its old key behind
+            state = inspect(obj)
+            room_ids = state.attrs.room_id.history.sum()
+            user_ids = state.attrs.user_id.history.sum()
+            keys.update(('member', room_id, user_id) for room_id in room_ids for user_id in user_ids)
+        elif isinstance(obj, Room):
+            state = inspect(obj)
+            if obj in session.new or obj in session.deleted or any(
+                state.attrs[attr].history.has_changes() for attr in ACCESS_ATTRIBUTES
+            ):
+                keys.add(('room', obj.id))
+    return keys
+
+@event.listens_for(db.session, 'after_flush')
+def _track_permission_changes(session, flush_context):
+    """Drop cached entries for what this flush changed, and again once it commits"""
+    keys = _changed_keys(session)
+    if not keys:
+        return
+
+    for key in keys:
+        _discard(key)
+    session.info.setdefault('stale_permissions', set()).update(keys)
+
+@event.listens_for(db.session, 'after_commit')
+def _expire_committed_permissions(session):
+    """A request that read the old row between flush and commit may have cached it again"""
+    for key in session.info.pop('stale_permissions', ()):
+        _discard(key)
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_rolled_back_permissions(session):
+    session.info.pop('stale_permissions', None)
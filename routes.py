@@ -2,84 +2,96 @@
 Routes for the Photo Sharing Application
 """
 
-import os
 import uuid
 import json
 import logging
-from datetime import datetime, timedelta
-from flask import render_template, request, redirect, url_for, flash, session, jsonify, abort, send_file
+from datetime import datetime
+from flask import render_template, request, redirect, url_for, flash, session, jsonify, abort, Response, stream_with_context
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
-from sqlalchemy import func
-from app import app, db, csrf_protected, login_required
-from models import User, Photo, Room, RoomMember, PhotoTag, ShareableLink, Analytics, FaceRecognitionSettings, Album
+from sqlalchemy import func, or_
+from sqlalchemy.orm import joinedload
+from app import db, csrf_protected, login_required
+from analytics_buffer import analytics_buffer
+from counter_buffer import counter_buffer
+from analytics_rollup import get_event_totals, get_daily_series
+from models import User, Photo, Room, RoomMember, PhotoTag, ShareableLink, Analytics, Album
+from thumbnail_utils import is_valid_size, ensure_derivative, ORIGINAL_SIZE
+from serving_utils import send_photo_file, photo_etag, get_sendfile_mode
+from storage_utils import get_photo_path, get_photo_mimetype
+from upload_utils import (
+    UploadError, DuplicateRejected, add_photo_batch, create_upload_session,
+    write_chunk, complete_upload, get_chunk_size, get_max_upload_size
+)
+from job_queue import get_latest_job, job_status
+from batch_processing import start_batch_run, get_latest_batch_run, batch_progress, FACE_RECOGNITION, RETRAIN
+from pagination_utils import paginate_photos, InvalidCursor
+from export_utils import stream_zip, room_export, album_export
+from permission_utils import get_current_user, get_room, get_room_or_404, get_room_access, can_access_room, is_room_admin, get_member_role
+from session_utils import regenerate_session
 
 # Setup logging
 logger = logging.getLogger(__name__)
 
-# Helper function to check if a file has an allowed extension
-def is_allowed_file(filename):
-    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+class RouteTable:
+    """
+    Routes collected at import and added to each app by create_app
+    Unlike a blueprint it keeps the plain endpoint names templates use in url_for.
+    """
 
-# Helper function to get the current logged in user
-def get_current_user():
-    if 'user_id' in session:
-        return User.query.get(session['user_id'])
-    return None
+    def __init__(self):
+        self.rules = []
+
+    def route(self, rule, **options):
+        def decorator(f):
+            self.rules.append((rule, options.pop('endpoint', f.__name__), f, options))
+            return f
+        return decorator
+
+    def init_app(self, app):
+        for rule, endpoint, view_func, options in self.rules:
+            app.add_url_rule(rule, endpoint, view_func, **options)
+
+views = RouteTable()
 
 # Helper function to track analytics
 def track_analytics(room_id, event_type, event_data=None, photo_id=None):
+    """Queue an analytics event; it is written to the database in the next batch"""
     try:
-        analytics = Analytics(
-            room_id=room_id,
-            event_type=event_type,
-            event_data=json.dumps(event_data) if event_data else None,
-            user_id=session.get('user_id'),
-            ip_address=request.remote_addr,
-            user_agent=request.user_agent.string
-        )
-        db.session.add(analytics)
-        db.session.commit()
+        analytics_buffer.add({
+            'room_id': room_id,
+            'event_type': event_type,
+            'event_data': json.dumps(event_data) if event_data else None,
+            'photo_id': photo_id,
+            'user_id': session.get('user_id'),
+            'ip_address': (request.remote_addr or '')[:50],
+            'user_agent': request.user_agent.string[:255],
+            'timestamp': datetime.utcnow()
+        })
     except Exception as e:
         logger.error(f"Error tracking analytics: {str(e)}")
 
-# Helper function to check if the current user can access a room
-def can_access_room(room_id):
-    """Check if the current user can access the room"""
-    # Get the room
-    room = Room.query.get(room_id)
-    if not room:
-        return False
-    
-    # Admin/creator always has access
-    current_user = get_current_user()
-    if current_user and (current_user.id == room.creator_id):
-        return True
-    
-    # Room members have access
-    if current_user:
-        member = RoomMember.query.filter_by(room_id=room_id, user_id=current_user.id).first()
-        if member:
-            return True
-    
-    # Public rooms are accessible to everyone
-    if room.is_public:
-        return True
-    
-    # Check if user has access via access code
-    if 'room_access_codes' in session and str(room_id) in session['room_access_codes']:
-        return True
-    
-    return False
+# Helper function to serialize a photo for the JSON photo feeds
+def photo_to_dict(photo):
+    return {
+        'id': photo.id,
+        'original_filename': photo.original_filename,
+        'description': photo.description,
+        'uploaded_at': photo.uploaded_at.isoformat(),
+        'uploaded_display': photo.uploaded_at.strftime('%b %d, %Y'),
+        'view_url': url_for('view_photo', photo_id=photo.id),
+        'thumbnail_url': url_for('photo_thumbnail', photo_id=photo.id, size='grid'),
+        'download_url': url_for('download_photo', photo_id=photo.id),
+        'tags': [tag.tag_name for tag in photo.tags]
+    }
 
 # Home page route
-@app.route('/')
+@views.route('/')
 def index():
     return render_template('index.html')
 
 # User registration
-@app.route('/register', methods=['GET', 'POST'])
+@views.route('/register', methods=['GET', 'POST'])
 @csrf_protected
 def register():
     if request.method == 'POST':
@@ -123,7 +135,7 @@ def register():
     return render_template('register.html')
 
 # User login
-@app.route('/login', methods=['GET', 'POST'])
+@views.route('/login', methods=['GET', 'POST'])
 @csrf_protected
 def login():
     if request.method == 'POST':
@@ -133,6 +145,7 @@ def login():
         user = User.query.filter_by(username=username).first()
         
         if user and check_password_hash(user.password_hash, password):
+            regenerate_session()
             session['user_id'] = user.id
             session['username'] = user.username
             flash('Login successful!', 'success')
@@ -143,14 +156,15 @@ def login():
     return render_template('login.html')
 
 # User logout
-@app.route('/logout')
+@views.route('/logout')
 def logout():
+    regenerate_session()
     session.clear()
     flash('You have been logged out', 'info')
     return redirect(url_for('index'))
 
 # Create a new room
-@app.route('/room/create', methods=['GET', 'POST'])
+@views.route('/room/create', methods=['GET', 'POST'])
 @login_required
 @csrf_protected
 def create_room():
@@ -197,9 +211,9 @@ def create_room():
     return render_template('create_room.html')
 
 # View room and its photos
-@app.route('/room/<int:room_id>')
+@views.route('/room/<int:room_id>')
 def room(room_id):
-    room = Room.query.get_or_404(room_id)
+    room = get_room_or_404(room_id)
     
     # Check if user can access this room
     if not can_access_room(room_id):
@@ -209,8 +223,19 @@ def room(room_id):
     # Track room view analytics
     track_analytics(room_id, 'room_view')
     
-    # Get all photos in the room
-    photos = Photo.query.filter_by(room_id=room_id).order_by(Photo.uploaded_at.desc()).all()
+    # Get the first page of photos in the room, newest first
+    try:
+        photos, next_cursor = paginate_photos(Photo.query.filter_by(room_id=room_id), request.args.get('after'))
+    except InvalidCursor:
+        abort(400)
+    photo_count = Photo.query.filter_by(room_id=room_id).count()
+    
+    # Get the tags used anywhere in the room for the filter buttons
+    tag_names = [
+        tag_name for (tag_name,) in db.session.query(PhotoTag.tag_name).join(Photo).filter(
+            Photo.room_id == room_id
+        ).distinct().order_by(PhotoTag.tag_name)
+    ]
     
     # Get all available albums in the room
     albums = Album.query.filter_by(room_id=room_id).all()
@@ -221,24 +246,49 @@ def room(room_id):
     is_admin = False
     
     if current_user:
-        member = RoomMember.query.filter_by(room_id=room_id, user_id=current_user.id).first()
-        is_member = member is not None
-        is_admin = member.role == 'admin' if member else False
+        role = get_member_role(room_id, current_user.id)
+        is_member = role is not None
+        is_admin = role == 'admin'
     
     return render_template(
         'room.html',
         room=room,
         photos=photos,
+        photo_count=photo_count,
+        next_cursor=next_cursor,
+        tag_names=tag_names,
         albums=albums,
         is_member=is_member,
         is_admin=is_admin
     )
 
+# Near-duplicate photos in a room
+@views.route('/room/<int:room_id>/duplicates')
+def room_duplicates(room_id):
+    room = get_room_or_404(room_id)
+    
+    # Check if user can access this room
+    if not can_access_room(room_id):
+        flash('You do not have access to this room', 'danger')
+        return redirect(url_for('join_room'))
+    
+    # Page through flagged photos newest first, with the photos they duplicate
+    query = Photo.query.filter(
+        Photo.room_id == room_id,
+        Photo.duplicate_of_id.isnot(None)
+    ).options(joinedload(Photo.duplicate_of))
+    try:
+        photos, next_cursor = paginate_photos(query, request.args.get('after'))
+    except InvalidCursor:
+        abort(400)
+    
+    return render_template('duplicates.html', room=room, photos=photos, next_cursor=next_cursor)
+
 # Enter room access code
-@app.route('/room/<int:room_id>/access', methods=['GET', 'POST'])
+@views.route('/room/<int:room_id>/access', methods=['GET', 'POST'])
 @csrf_protected
 def room_access(room_id):
-    room = Room.query.get_or_404(room_id)
+    room = get_room_or_404(room_id)
     
     # If room is public or user already has access, redirect to room
     if room.is_public or can_access_room(room_id):
@@ -249,6 +299,7 @@ def room_access(room_id):
         
         if access_code == room.access_code:
             # Store access code in session
+            regenerate_session()
             if 'room_access_codes' not in session:
                 session['room_access_codes'] = {}
             
@@ -262,10 +313,10 @@ def room_access(room_id):
     return render_template('room_access.html', room=room)
 
 # Upload photo to a room
-@app.route('/room/<int:room_id>/upload', methods=['GET', 'POST'])
+@views.route('/room/<int:room_id>/upload', methods=['GET', 'POST'])
 @csrf_protected
 def upload_photo(room_id):
-    room = Room.query.get_or_404(room_id)
+    room = get_room_or_404(room_id)
     
     # Check if user can access this room
     if not can_access_room(room_id):
@@ -289,65 +340,31 @@ def upload_photo(room_id):
             flash('No file selected', 'danger')
             return redirect(request.url)
         
-        # Create upload folder for this room if it doesn't exist
-        room_upload_folder = os.path.join(app.config['UPLOAD_FOLDER'], str(room_id))
-        if not os.path.exists(room_upload_folder):
-            os.makedirs(room_upload_folder)
-        
         # Get description from form if available
         description = request.form.get('description', '')
         
-        # Track successful uploads
-        successful_uploads = []
-        failed_uploads = []
+        # Store every file and add their photos in one transaction, a savepoint per file
+        uploads, failures = add_photo_batch(
+            room,
+            files,
+            description,
+            session.get('user_id', 1)  # Default to user 1 if no user logged in
+        )
         
-        # Process each file
-        for file in files:
-            if file and is_allowed_file(file.filename):
-                try:
-                    # Generate a safe filename
-                    original_filename = secure_filename(file.filename)
-                    filename = f"{uuid.uuid4().hex}_{original_filename}"
-                    
-                    # Save the file
-                    file_path = os.path.join(room_upload_folder, filename)
-                    file.save(file_path)
-                    
-                    # Create new photo record
-                    new_photo = Photo(
-                        filename=filename,
-                        original_filename=original_filename,
-                        user_id=session.get('user_id', 1),  # Default to user 1 if no user logged in
-                        room_id=room_id,
-                        description=description
-                    )
-                    
-                    db.session.add(new_photo)
-                    db.session.commit()
-                    
-                    # Process with face recognition if enabled
-                    if room.face_recognition_enabled:
-                        from face_recognition_utils import process_photo_face_recognition
-                        process_photo_face_recognition(new_photo.id, file_path)
-                    
-                    successful_uploads.append({
-                        'filename': original_filename,
-                        'id': new_photo.id,
-                        'url': url_for('view_photo', photo_id=new_photo.id)
-                    })
-                
-                except Exception as e:
-                    db.session.rollback()
-                    logger.error(f"Error uploading photo {file.filename}: {str(e)}")
-                    failed_uploads.append({
-                        'filename': file.filename,
-                        'error': str(e)
-                    })
-            else:
-                failed_uploads.append({
-                    'filename': file.filename,
-                    'error': 'File type not allowed'
-                })
+        successful_uploads = [{
+            'filename': upload.filename,
+            'id': upload.photo_id,
+            'url': url_for('view_photo', photo_id=upload.photo_id),
+            'duplicate_of': upload.duplicate_of
+        } for upload in uploads]
+        flagged_duplicates = sum(1 for upload in uploads if upload.duplicate_of)
+        
+        failed_uploads = []
+        for failure in failures:
+            error = {'filename': failure.filename, 'error': failure.error}
+            if failure.duplicate_of:
+                error['duplicate_of'] = failure.duplicate_of
+            failed_uploads.append(error)
         
         # Return appropriate response
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -356,6 +373,7 @@ def upload_photo(room_id):
                 'total': len(files),
                 'successful': len(successful_uploads),
                 'failed': len(failed_uploads),
+                'duplicates': flagged_duplicates,
                 'uploads': successful_uploads,
                 'errors': failed_uploads
             })
@@ -366,15 +384,130 @@ def upload_photo(room_id):
                 flash(f'Uploaded {len(successful_uploads)} photos successfully. {len(failed_uploads)} photos failed.', 'info')
             else:
                 flash(f'Successfully uploaded {len(successful_uploads)} photos!', 'success')
+            if flagged_duplicates:
+                flash(f'{flagged_duplicates} of them look like duplicates of photos already in this room.', 'warning')
             return redirect(url_for('room', room_id=room_id))
         else:
             flash('No photos were uploaded. Please check file types and try again.', 'danger')
             return redirect(request.url)
     
-    return render_template('upload_photo.html', room=room)
+    return render_template('upload_photo.html', room=room, max_upload_size=get_max_upload_size(), chunk_size=get_chunk_size())
+
+# Helper function to describe an upload session for the chunked upload API
+def upload_to_dict(upload):
+    return {
+        'upload_id': upload.id,
+        'filename': upload.original_filename,
+        'size': upload.total_size,
+        'offset': upload.received,
+        'status': upload.status,
+        'chunk_size': get_chunk_size(),
+        'chunk_url': url_for('api_upload_chunk', upload_id=upload.id),
+        'complete_url': url_for('api_complete_upload', upload_id=upload.id),
+        'photo_id': upload.photo_id,
+        'error': upload.last_error
+    }
+
+# Helper function to get an upload session the current visitor may write to
+def get_upload_session_or_404(upload_id):
+    from models import UploadSession
+    
+    upload = UploadSession.query.get_or_404(upload_id)
+    if not can_access_room(upload.room_id):
+        abort(403)
+    if upload.user_id and session.get('user_id') and upload.user_id != session['user_id']:
+        abort(403)
+    return upload
+
+# API endpoint to start a chunked upload session
+@views.route('/api/room/<int:room_id>/uploads', methods=['POST'])
+@csrf_protected
+def api_create_upload(room_id):
+    room = get_room_or_404(room_id)
+    
+    if not can_access_room(room_id):
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        upload = create_upload_session(
+            room,
+            session.get('user_id', 1),  # Default to user 1 if no user logged in
+            data.get('filename'),
+            data.get('size'),
+            data.get('description') or None
+        )
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+    
+    return jsonify(upload_to_dict(upload)), 201
+
+# API endpoint for the progress of an upload session, used to resume it
+@views.route('/api/uploads/<upload_id>')
+def api_upload_status(upload_id):
+    upload = get_upload_session_or_404(upload_id)
+    return jsonify(upload_to_dict(upload))
+
+# API endpoint to write one chunk of an upload session
+# Accepts a raw body at ?offset= (or a Content-Range header), or Dropzone's
+# multipart chunks with their dzchunkbyteoffset field
+@views.route('/api/uploads/<upload_id>', methods=['PUT'])
+@csrf_protected
+def api_upload_chunk(upload_id):
+    upload = get_upload_session_or_404(upload_id)
+    
+    if request.mimetype == 'multipart/form-data':
+        chunk = request.files.get('photo')
+        if chunk is None:
+            return jsonify({'error': 'No file part'}), 400
+        stream = chunk.stream
+        offset = request.form.get('dzchunkbyteoffset', 0)
+    else:
+        stream = request.stream
+        offset = request.args.get('offset')
+        content_range = request.headers.get('Content-Range', '')
+        if offset is None and content_range.startswith('bytes '):
+            offset = content_range[len('bytes '):].split('-', 1)[0]
+    
+    try:
+        write_chunk(upload, int(offset or 0), stream)
+    except ValueError:
+        return jsonify({'error': 'Invalid offset', 'offset': upload.received}), 400
+    except UploadError as e:
+        return jsonify({'error': str(e), 'offset': upload.received}), e.status
+    
+    return jsonify(upload_to_dict(upload))
+
+# API endpoint to finish an upload session and create its photo
+@views.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+@csrf_protected
+def api_complete_upload(upload_id):
+    upload = get_upload_session_or_404(upload_id)
+    room = get_room_or_404(upload.room_id)
+    
+    try:
+        photo, duplicate = complete_upload(upload, room)
+    except UploadError as e:
+        return jsonify({'error': str(e), 'offset': upload.received}), e.status
+    except DuplicateRejected as e:
+        return jsonify({'error': str(e), 'duplicate_of': e.duplicate.id}), 409
+    except Exception as e:
+        logger.error(f"Error completing upload {upload_id}: {str(e)}")
+        return jsonify({'error': 'Upload could not be saved'}), 500
+    
+    if photo is None:
+        return jsonify({'error': 'Photo was deleted'}), 410
+    
+    result = upload_to_dict(upload)
+    result.update({
+        'id': photo.id,
+        'url': url_for('view_photo', photo_id=photo.id),
+        'duplicate_of': duplicate.id if duplicate else photo.duplicate_of_id
+    })
+    return jsonify(result)
 
 # View a single photo
-@app.route('/photo/<int:photo_id>')
+@views.route('/photo/<int:photo_id>')
 def view_photo(photo_id):
     photo = Photo.query.get_or_404(photo_id)
     
@@ -384,18 +517,55 @@ def view_photo(photo_id):
         return redirect(url_for('join_room'))
     
     # Track photo view analytics
-    track_analytics(photo.room_id, 'photo_view', {'photo_id': photo_id})
+    track_analytics(photo.room_id, 'photo_view', {'photo_id': photo_id}, photo_id=photo_id)
     
     # Get all tags for this photo
     tags = PhotoTag.query.filter_by(photo_id=photo_id).all()
     
     # Get the room
-    room = Room.query.get(photo.room_id)
+    room = get_room(photo.room_id)
     
     return render_template('view_photo.html', photo=photo, room=room, tags=tags)
 
+# Serve a resized derivative of a photo
+@views.route('/photo/<int:photo_id>/thumb/<size>')
+def photo_thumbnail(photo_id, size):
+    photo = Photo.query.get_or_404(photo_id)
+    
+    # Check if user can access the room this photo belongs to
+    if not can_access_room(photo.room_id):
+        abort(403)
+    
+    if not is_valid_size(size):
+        abort(404)
+    
+    # Missing derivatives are built on first request
+    file_path = ensure_derivative(photo, size)
+    if not file_path:
+        abort(404)
+    
+    # The original stands in for a derivative that couldn't be built; don't let caches pin it
+    fallback = size != ORIGINAL_SIZE and file_path == get_photo_path(photo)
+    return send_photo_file(
+        file_path,
+        etag=photo_etag(photo, size, file_path),
+        mimetype=get_photo_mimetype(photo),
+        immutable=not fallback
+    )
+
+# Helper function to check if a file response starts a new download
+# In sendfile mode the proxy answers Range requests, so the requested range is checked instead
+def is_new_download(response):
+    if response.status_code == 304:
+        return False
+    if response.status_code == 206:
+        return response.content_range.start == 0
+    if get_sendfile_mode() and request.range:
+        return request.range.ranges[0][0] == 0
+    return True
+
 # Download a photo
-@app.route('/photo/<int:photo_id>/download')
+@views.route('/photo/<int:photo_id>/download')
 def download_photo(photo_id):
     photo = Photo.query.get_or_404(photo_id)
     
@@ -404,24 +574,83 @@ def download_photo(photo_id):
         flash('You do not have access to this photo', 'danger')
         return redirect(url_for('join_room'))
     
-    # Update download count
-    photo.download_count += 1
-    db.session.commit()
-    
-    # Track download analytics
-    track_analytics(photo.room_id, 'photo_download', {'photo_id': photo_id})
-    
-    # Get file path
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], str(photo.room_id), photo.filename)
-    
-    return send_file(
+    file_path = get_photo_path(photo)
+    response = send_photo_file(
         file_path,
-        as_attachment=True,
+        etag=photo_etag(photo, ORIGINAL_SIZE, file_path),
+        mimetype=get_photo_mimetype(photo),
         download_name=photo.original_filename
     )
+    
+    # Count a download once: not for cache revalidations or resumed ranges
+    if is_new_download(response):
+        counter_buffer.increment('photo_download', photo.id)
+        
+        # Track download analytics
+        track_analytics(photo.room_id, 'photo_download', {'photo_id': photo_id}, photo_id=photo_id)
+    
+    return response
+
+# Helper function to stream a ZIP export as a download
+def zip_response(entries, name):
+    filename = f"{secure_filename(name) or 'photos'}.zip"
+    return Response(
+        stream_with_context(stream_zip(entries)),
+        mimetype='application/zip',
+        headers={
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            # Let proxies pass chunks through as they are generated
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+# Download every photo in a room as one ZIP archive
+@views.route('/room/<int:room_id>/download.zip')
+def download_room_zip(room_id):
+    room = get_room_or_404(room_id)
+    
+    if not can_access_room(room_id):
+        flash('You do not have access to this room', 'danger')
+        return redirect(url_for('join_room'))
+    
+    # One event for the whole export rather than one per photo
+    photo_count = Photo.query.filter_by(room_id=room_id).count()
+    track_analytics(room_id, 'zip_export', {'photos': photo_count})
+    
+    return zip_response(room_export(room_id), room.name)
+
+# Download every photo in an album as one ZIP archive
+@views.route('/album/<int:album_id>/download.zip')
+def download_album_zip(album_id):
+    album = Album.query.get_or_404(album_id)
+    
+    if not can_access_room(album.room_id):
+        flash('You do not have access to this album', 'danger')
+        return redirect(url_for('join_room'))
+    
+    track_analytics(album.room_id, 'zip_export', {'album_id': album_id, 'photos': album.photo_count})
+    
+    return zip_response(album_export(album_id), album.name)
+
+# API endpoint for the face recognition job status of a photo
+@views.route('/api/photo/<int:photo_id>/face-recognition-status')
+def api_photo_face_recognition_status(photo_id):
+    photo = Photo.query.get_or_404(photo_id)
+    
+    # Check if user can access the room this photo belongs to
+    if not can_access_room(photo.room_id):
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    job = get_latest_job('face_recognition', photo_id)
+    if not job:
+        return jsonify({'photo_id': photo_id, 'status': 'none'})
+    
+    status = job_status(job)
+    status['photo_id'] = photo_id
+    return jsonify(status)
 
 # Join a room with access code
-@app.route('/join-room', methods=['GET', 'POST'])
+@views.route('/join-room', methods=['GET', 'POST'])
 @csrf_protected
 def join_room():
     if request.method == 'POST':
@@ -432,6 +661,7 @@ def join_room():
         
         if room:
             # Store access code in session
+            regenerate_session()
             if 'room_access_codes' not in session:
                 session['room_access_codes'] = {}
             
@@ -466,17 +696,14 @@ def join_room():
     return render_template('join_room.html', public_rooms=public_rooms)
 
 # Create shareable link for a room
-@app.route('/room/<int:room_id>/share', methods=['GET', 'POST'])
+@views.route('/room/<int:room_id>/share', methods=['GET', 'POST'])
 @login_required
 @csrf_protected
 def share_room(room_id):
-    room = Room.query.get_or_404(room_id)
+    room = get_room_or_404(room_id)
     
     # Check if user is the creator or an admin
-    current_user = get_current_user()
-    member = RoomMember.query.filter_by(room_id=room_id, user_id=current_user.id).first()
-    
-    if not (current_user.id == room.creator_id or (member and member.role == 'admin')):
+    if not is_room_admin(room_id):
         flash('You do not have permission to share this room', 'danger')
         return redirect(url_for('room', room_id=room_id))
     
@@ -489,7 +716,7 @@ def share_room(room_id):
             # Create the shareable link
             shareable_link = ShareableLink(
                 room_id=room_id,
-                created_by=current_user.id,
+                created_by=session['user_id'],
                 expires_in_days=expires_in_days
             )
             
@@ -504,26 +731,18 @@ def share_room(room_id):
             logger.error(f"Error creating shareable link: {str(e)}")
             flash('An error occurred while creating the shareable link', 'danger')
     
-    # Get all active shareable links for this room
-    active_links = ShareableLink.query.filter_by(
-        room_id=room_id,
-        is_active=True
+    # Get the room's links that are active and not expired; the expire-links
+    # maintenance task deactivates expired ones
+    valid_links = ShareableLink.query.filter(
+        ShareableLink.room_id == room_id,
+        ShareableLink.is_active == True,
+        or_(ShareableLink.expires_at.is_(None), ShareableLink.expires_at > datetime.utcnow())
     ).order_by(ShareableLink.created_at.desc()).all()
     
-    # Remove expired links from the active list
-    valid_links = []
-    for link in active_links:
-        if not link.is_expired():
-            valid_links.append(link)
-        elif link.is_active:
-            # Deactivate expired links
-            link.is_active = False
-            db.session.commit()
-    
     return render_template('share_room.html', room=room, links=valid_links)
 
 # Access room via shareable link
-@app.route('/s/<token>')
+@views.route('/s/<token>')
 def access_shared_link(token):
     # Find the link
     link = ShareableLink.query.filter_by(token=token).first_or_404()
@@ -534,24 +753,24 @@ def access_shared_link(token):
         return redirect(url_for('index'))
     
     # Increment access count
-    link.access_count += 1
-    db.session.commit()
+    counter_buffer.increment('link_access', link.id)
     
     # Track link access analytics
     track_analytics(link.room_id, 'link_access', {'link_id': link.id})
     
     # Grant access to the room via session
+    regenerate_session()
     if 'room_access_codes' not in session:
         session['room_access_codes'] = {}
     
-    room = Room.query.get(link.room_id)
+    room = get_room(link.room_id)
     if room and room.access_code:
         session['room_access_codes'][str(link.room_id)] = room.access_code
     
     return redirect(url_for('room', room_id=link.room_id))
 
 # Deactivate a shareable link
-@app.route('/link/<int:link_id>/deactivate')
+@views.route('/link/<int:link_id>/deactivate')
 @login_required
 def deactivate_link(link_id):
     link = ShareableLink.query.get_or_404(link_id)
@@ -570,95 +789,45 @@ def deactivate_link(link_id):
     return redirect(url_for('share_room', room_id=link.room_id))
 
 # User dashboard
-@app.route('/dashboard')
+@views.route('/dashboard')
 @login_required
 def dashboard():
     current_user = get_current_user()
     
     # Get all rooms where user is member or creator
-    user_rooms = Room.query.join(RoomMember).filter(
-        (Room.creator_id == current_user.id) | 
-        (RoomMember.user_id == current_user.id)
-    ).distinct().all()
-    
-    # Get total photos
-    total_photos = Photo.query.join(Room).join(RoomMember).filter(
-        (Room.creator_id == current_user.id) | 
-        (RoomMember.user_id == current_user.id)
-    ).count()
-    
-    # Get analytics data
-    # Views per room
-    room_views = {}
-    room_downloads = {}
-    
-    for room in user_rooms:
-        # Count view events
-        views = Analytics.query.filter_by(
-            room_id=room.id,
-            event_type='room_view'
-        ).count()
-        
-        room_views[room.id] = views
-        
-        # Count download events
-        downloads = Analytics.query.filter_by(
-            room_id=room.id,
-            event_type='photo_download'
-        ).count()
-        
-        room_downloads[room.id] = downloads
+    # (two indexed lookups; an OR across the join can't use either index)
+    created_room_ids = db.session.query(Room.id).filter(Room.creator_id == current_user.id)
+    member_room_ids = db.session.query(RoomMember.room_id).filter(RoomMember.user_id == current_user.id)
+    room_ids = sorted({room_id for (room_id,) in created_room_ids.union(member_room_ids)})
+    user_rooms = Room.query.filter(Room.id.in_(room_ids)).all() if room_ids else []
+    
+    # Count photos per room in one query
+    photo_counts = dict(db.session.query(Photo.room_id, func.count(Photo.id)).filter(
+        Photo.room_id.in_(room_ids)
+    ).group_by(Photo.room_id).all()) if room_ids else {}
+    total_photos = sum(photo_counts.values())
+    
+    # Get analytics data from the daily rollup
+    totals = get_event_totals(room_ids, ['room_view', 'photo_download'])
+    
+    # Views and downloads per room
+    room_views = {room.id: totals.get((room.id, 'room_view'), 0) for room in user_rooms}
+    room_downloads = {room.id: totals.get((room.id, 'photo_download'), 0) for room in user_rooms}
     
     # Total views and downloads
     total_views = sum(room_views.values())
     total_downloads = sum(room_downloads.values())
     
     # Get activity data for last 7 days
-    end_date = datetime.now()
-    start_date = end_date - timedelta(days=7)
-    
-    # Generate date labels
-    date_labels = []
-    current_date = start_date
-    while current_date <= end_date:
-        date_labels.append(current_date.strftime('%m/%d'))
-        current_date += timedelta(days=1)
-    
-    # Collect view and download counts per day
-    view_counts = []
-    download_counts = []
-    
-    for i in range(len(date_labels)):
-        day_start = start_date + timedelta(days=i)
-        day_end = day_start + timedelta(days=1)
-        
-        # Get all room IDs where user is member or creator
-        room_ids = [room.id for room in user_rooms]
-        
-        # Count view events for this day
-        day_views = Analytics.query.filter(
-            Analytics.room_id.in_(room_ids),
-            Analytics.event_type == 'room_view',
-            Analytics.timestamp >= day_start,
-            Analytics.timestamp < day_end
-        ).count()
-        
-        view_counts.append(day_views)
-        
-        # Count download events for this day
-        day_downloads = Analytics.query.filter(
-            Analytics.room_id.in_(room_ids),
-            Analytics.event_type == 'photo_download',
-            Analytics.timestamp >= day_start,
-            Analytics.timestamp < day_end
-        ).count()
-        
-        download_counts.append(day_downloads)
+    date_labels, series = get_daily_series(room_ids, ['room_view', 'photo_download'], days=7)
+    view_counts = series['room_view']
+    download_counts = series['photo_download']
     
     return render_template(
         'dashboard.html',
         rooms=user_rooms,
         total_photos=total_photos,
+        photo_counts=photo_counts,
         total_views=total_views,
         total_downloads=total_downloads,
         room_views=room_views,
@@ -669,41 +838,43 @@ def dashboard():
     )
 
 # Room analytics
-@app.route('/room/<int:room_id>/analytics')
+@views.route('/room/<int:room_id>/analytics')
 @login_required
 def room_analytics(room_id):
-    room = Room.query.get_or_404(room_id)
+    room = get_room_or_404(room_id)
     
     # Check if user is the creator or an admin
-    current_user = get_current_user()
-    member = RoomMember.query.filter_by(room_id=room_id, user_id=current_user.id).first()
-    
-    if not (current_user.id == room.creator_id or (member and member.role == 'admin')):
+    if not is_room_admin(room_id):
         flash('You do not have permission to view analytics for this room', 'danger')
         return redirect(url_for('room', room_id=room_id))
     
     # Get basic stats
     photo_count = Photo.query.filter_by(room_id=room_id).count()
-    view_count = Analytics.query.filter_by(room_id=room_id, event_type='room_view').count()
-    download_count = Analytics.query.filter_by(room_id=room_id, event_type='photo_download').count()
-    link_access_count = Analytics.query.filter_by(room_id=room_id, event_type='link_access').count()
+    totals = get_event_totals([room_id], ['room_view', 'photo_download', 'link_access'])
+    view_count = totals.get((room_id, 'room_view'), 0)
+    download_count = totals.get((room_id, 'photo_download'), 0)
+    link_access_count = totals.get((room_id, 'link_access'), 0)
+    
+    # Most viewed photos, counted on the indexed photo_id
+    view_counts_by_photo = db.session.query(
+        Analytics.photo_id,
+        func.count(Analytics.id).label('view_count')
+    ).filter(
+        Analytics.room_id == room_id,
+        Analytics.event_type == 'photo_view',
+        Analytics.photo_id.isnot(None)
+    ).group_by(
+        Analytics.photo_id
+    ).subquery()
     
-    # Most viewed photos
     most_viewed_photo_stats = db.session.query(
         Photo,
-        func.count(Analytics.id).label('view_count')
+        view_counts_by_photo.c.view_count
     ).join(
-        Analytics,
-        db.and_(
-            Analytics.event_type == 'photo_view',
-            Analytics.event_data.like(f'%"photo_id": {Photo.id}%')
-        )
-    ).filter(
-        Photo.room_id == room_id
-    ).group_by(
-        Photo.id
+        view_counts_by_photo,
+        view_counts_by_photo.c.photo_id == Photo.id
     ).order_by(
-        func.count(Analytics.id).desc()
+        view_counts_by_photo.c.view_count.desc()
     ).limit(5).all()
     
     # Most downloaded photos
@@ -722,43 +893,9 @@ def room_analytics(room_id):
     ).all()
     
     # Time series data for last 30 days
-    end_date = datetime.now()
-    start_date = end_date - timedelta(days=30)
-    
-    # Generate date labels
-    date_labels = []
-    current_date = start_date
-    while current_date <= end_date:
-        date_labels.append(current_date.strftime('%m/%d'))
-        current_date += timedelta(days=1)
-    
-    # Collect view and download counts per day
-    view_counts = []
-    download_counts = []
-    
-    for i in range(len(date_labels)):
-        day_start = start_date + timedelta(days=i)
-        day_end = day_start + timedelta(days=1)
-        
-        # Count view events for this day
-        day_views = Analytics.query.filter(
-            Analytics.room_id == room_id,
-            Analytics.event_type == 'room_view',
-            Analytics.timestamp >= day_start,
-            Analytics.timestamp < day_end
-        ).count()
-        
-        view_counts.append(day_views)
-        
-        # Count download events for this day
-        day_downloads = Analytics.query.filter(
-            Analytics.room_id == room_id,
-            Analytics.event_type == 'photo_download',
-            Analytics.timestamp >= day_start,
-            Analytics.timestamp < day_end
-        ).count()
-        
-        download_counts.append(day_downloads)
+    date_labels, series = get_daily_series([room_id], ['room_view', 'photo_download'], days=30)
+    view_counts = series['room_view']
+    download_counts = series['photo_download']
     
     return render_template(
         'analytics.html',
@@ -775,8 +912,14 @@ def room_analytics(room_id):
         download_counts=download_counts
     )
 
+# API endpoint for analytics buffer counters of this worker
+@views.route('/api/analytics/buffer-stats')
+@login_required
+def api_analytics_buffer_stats():
+    return jsonify(analytics_buffer.stats())
+
 # Face recognition settings
-@app.route('/face-recognition-settings', methods=['GET', 'POST'])
+@views.route('/face-recognition-settings', methods=['GET', 'POST'])
 @login_required
 @csrf_protected
 def face_recognition_settings():
@@ -788,21 +931,9 @@ def face_recognition_settings():
         recognition_tolerance = float(request.form.get('recognition_tolerance', 0.6))
         
         try:
-            # Get or create settings
-            settings = FaceRecognitionSettings.query.first()
-            if not settings:
-                settings = FaceRecognitionSettings()
-                db.session.add(settings)
-            
-            # Update settings
-            settings.min_confidence = min_confidence
-            settings.detection_algorithm = detection_algorithm
-            settings.face_encoding_model = face_encoding_model
-            settings.auto_categorize = auto_categorize
-            settings.recognition_tolerance = recognition_tolerance
-            settings.last_updated = datetime.utcnow()
-            
-            db.session.commit()
+            # Save the settings; this process uses them from now on
+            from face_recognition_utils import save_face_settings
+            save_face_settings(min_confidence, detection_algorithm, face_encoding_model, auto_categorize, recognition_tolerance)
             flash('Face recognition settings updated successfully!', 'success')
         
         except Exception as e:
@@ -817,14 +948,26 @@ def face_recognition_settings():
     # Get user's rooms for reprocessing
     current_user = get_current_user()
     user_rooms = Room.query.filter_by(creator_id=current_user.id).all()
+    face_enabled_rooms = [room for room in user_rooms if room.face_recognition_enabled]
+    
+    # Count photos per room in one query
+    photo_counts = dict(db.session.query(Photo.room_id, func.count(Photo.id)).filter(
+        Photo.room_id.in_([room.id for room in face_enabled_rooms])
+    ).group_by(Photo.room_id).all())
     
-    return render_template('face_recognition_settings.html', settings=settings, rooms=user_rooms)
+    return render_template(
+        'face_recognition_settings.html',
+        settings=settings,
+        rooms=user_rooms,
+        face_enabled_rooms=face_enabled_rooms,
+        photo_counts=photo_counts
+    )
 
 # Toggle face recognition for a room
-@app.route('/room/<int:room_id>/toggle-face-recognition')
+@views.route('/room/<int:room_id>/toggle-face-recognition')
 @login_required
 def toggle_face_recognition(room_id):
-    room = Room.query.get_or_404(room_id)
+    room = get_room_or_404(room_id)
     
     # Check if user is the creator or an admin
     current_user = get_current_user()
@@ -842,11 +985,11 @@ def toggle_face_recognition(room_id):
     return redirect(url_for('room', room_id=room_id))
 
 # Create a new album in a room
-@app.route('/room/<int:room_id>/album/create', methods=['GET', 'POST'])
+@views.route('/room/<int:room_id>/album/create', methods=['GET', 'POST'])
 @login_required
 @csrf_protected
 def create_album(room_id):
-    room = Room.query.get_or_404(room_id)
+    room = get_room_or_404(room_id)
     
     # Check if user can access this room
     if not can_access_room(room_id):
@@ -881,7 +1024,7 @@ def create_album(room_id):
     return render_template('create_album.html', room=room)
 
 # Move photo to album
-@app.route('/photo/<int:photo_id>/move-to-album', methods=['POST'])
+@views.route('/photo/<int:photo_id>/move-to-album', methods=['POST'])
 @login_required
 @csrf_protected
 def move_to_album(photo_id):
@@ -914,7 +1057,7 @@ def move_to_album(photo_id):
     return redirect(url_for('view_photo', photo_id=photo_id))
 
 # View album
-@app.route('/album/<int:album_id>')
+@views.route('/album/<int:album_id>')
 def view_album(album_id):
     album = Album.query.get_or_404(album_id)
     
@@ -923,68 +1066,80 @@ def view_album(album_id):
         flash('You do not have access to this album', 'danger')
         return redirect(url_for('join_room'))
     
-    # Get all photos in the album
-    photos = Photo.query.filter_by(album_id=album_id).order_by(Photo.uploaded_at.desc()).all()
+    # Get the first page of photos in the album, newest first
+    try:
+        photos, next_cursor = paginate_photos(Photo.query.filter_by(album_id=album_id), request.args.get('after'))
+    except InvalidCursor:
+        abort(400)
     
     # Get the room
-    room = Room.query.get(album.room_id)
+    room = get_room(album.room_id)
     
-    return render_template('view_album.html', album=album, room=room, photos=photos)
+    return render_template(
+        'view_album.html',
+        album=album,
+        room=room,
+        photos=photos,
+        next_cursor=next_cursor
+    )
+
+# API endpoint for paging through a room's photos
+@views.route('/api/room/<int:room_id>/photos')
+def api_room_photos(room_id):
+    if get_room_access(room_id) is None:
+        abort(404)
+    
+    if not can_access_room(room_id):
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    try:
+        photos, next_cursor = paginate_photos(Photo.query.filter_by(room_id=room_id), request.args.get('after'))
+    except InvalidCursor:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    
+    return jsonify({
+        'photos': [photo_to_dict(photo) for photo in photos],
+        'next_cursor': next_cursor,
+        'next_url': url_for('api_room_photos', room_id=room_id, after=next_cursor) if next_cursor else None
+    })
+
+# API endpoint for paging through an album's photos
+@views.route('/api/album/<int:album_id>/photos')
+def api_album_photos(album_id):
+    album = Album.query.get_or_404(album_id)
+    
+    if not can_access_room(album.room_id):
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    try:
+        photos, next_cursor = paginate_photos(Photo.query.filter_by(album_id=album_id), request.args.get('after'))
+    except InvalidCursor:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    
+    return jsonify({
+        'photos': [photo_to_dict(photo) for photo in photos],
+        'next_cursor': next_cursor,
+        'next_url': url_for('api_album_photos', album_id=album_id, after=next_cursor) if next_cursor else None
+    })
 
 # API endpoint for room analytics
-@app.route('/api/room/<int:room_id>/analytics')
+@views.route('/api/room/<int:room_id>/analytics')
 @login_required
 def api_room_analytics(room_id):
-    room = Room.query.get_or_404(room_id)
+    if get_room_access(room_id) is None:
+        abort(404)
     
     # Check if user is the creator or an admin
-    current_user = get_current_user()
-    member = RoomMember.query.filter_by(room_id=room_id, user_id=current_user.id).first()
-    
-    if not (current_user.id == room.creator_id or (member and member.role == 'admin')):
+    if not is_room_admin(room_id):
         return jsonify({'error': 'Unauthorized'}), 403
     
     # Get time range from query parameters
-    days = request.args.get('days', 30, type=int)
-    
-    # Calculate date range
-    end_date = datetime.now()
-    start_date = end_date - timedelta(days=days)
-    
-    # Generate date labels
-    date_labels = []
-    current_date = start_date
-    while current_date <= end_date:
-        date_labels.append(current_date.strftime('%m/%d'))
-        current_date += timedelta(days=1)
-    
-    # Collect view and download counts per day
-    view_counts = []
-    download_counts = []
-    
-    for i in range(len(date_labels)):
-        day_start = start_date + timedelta(days=i)
-        day_end = day_start + timedelta(days=1)
-        
-        # Count view events for this day
-        day_views = Analytics.query.filter(
-            Analytics.room_id == room_id,
-            Analytics.event_type == 'room_view',
-            Analytics.timestamp >= day_start,
-            Analytics.timestamp < day_end
-        ).count()
-        
-        view_counts.append(day_views)
-        
-        # Count download events for this day
-        day_downloads = Analytics.query.filter(
-            Analytics.room_id == room_id,
-            Analytics.event_type == 'photo_download',
-            Analytics.timestamp >= day_start,
-            Analytics.timestamp < day_end
-        ).count()
-        
-        download_counts.append(day_downloads)
+    days = max(1, min(request.args.get('days', 30, type=int), 365))
+    
+    # Get per-day counts from the daily rollup
+    date_labels, series = get_daily_series([room_id], ['room_view', 'photo_download'], days=days)
+    view_counts = series['room_view']
+    download_counts = series['photo_download']
     
     return jsonify({
         'date_labels': date_labels,
@@ -993,7 +1148,7 @@ def api_room_analytics(room_id):
     })
 
 # Tag a photo 
-@app.route('/photo/<int:photo_id>/tag', methods=['POST'])
+@views.route('/photo/<int:photo_id>/tag', methods=['POST'])
 @login_required
 @csrf_protected
 def tag_photo(photo_id):
@@ -1066,7 +1221,7 @@ def tag_photo(photo_id):
     return redirect(url_for('view_photo', photo_id=photo_id))
 
 # Remove a tag from a photo
-@app.route('/photo/<int:photo_id>/tag/<int:tag_id>/remove')
+@views.route('/photo/<int:photo_id>/tag/<int:tag_id>/remove')
 @login_required
 def remove_tag(photo_id, tag_id):
     photo = Photo.query.get_or_404(photo_id)
@@ -1094,10 +1249,10 @@ def remove_tag(photo_id, tag_id):
     return redirect(url_for('view_photo', photo_id=photo_id))
 
 # Process all photos in a room with face recognition
-@app.route('/room/<int:room_id>/process-all-photos')
+@views.route('/room/<int:room_id>/process-all-photos')
 @login_required
 def process_all_photos(room_id):
-    room = Room.query.get_or_404(room_id)
+    room = get_room_or_404(room_id)
     
     # Check if user is the creator or an admin
     current_user = get_current_user()
@@ -1105,24 +1260,58 @@ def process_all_photos(room_id):
         flash('You do not have permission to perform this action', 'danger')
         return redirect(url_for('room', room_id=room_id))
     
-    # Get all photos in the room
-    photos = Photo.query.filter_by(room_id=room_id).all()
+    # Queue the room for background processing instead of running it in this request
+    run, started = start_batch_run(room_id, current_user.id)
     
-    # Process each photo
-    from face_recognition_utils import process_photo_face_recognition
-    processed_count = 0
+    if started:
+        flash(f'Processing {run.total} photos with face recognition in the background', 'success')
+    else:
+        flash('Face recognition is already running for this room', 'info')
+    return redirect(url_for('face_recognition_settings'))
+
+# Retrain face recognition for a room from its manual tags
+@views.route('/room/<int:room_id>/retrain-face-recognition')
+@login_required
+def retrain_face_recognition(room_id):
+    room = get_room_or_404(room_id)
     
-    for photo in photos:
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], str(room_id), photo.filename)
-        if os.path.exists(file_path):
-            if process_photo_face_recognition(photo.id, file_path):
-                processed_count += 1
+    # Check if user is the creator
+    current_user = get_current_user()
+    if current_user.id != room.creator_id:
+        flash('You do not have permission to perform this action', 'danger')
+        return redirect(url_for('room', room_id=room_id))
     
-    flash(f'Processed {processed_count} photos with face recognition', 'success')
-    return redirect(url_for('room', room_id=room_id))
+    run, started = start_batch_run(room_id, current_user.id, kind=RETRAIN)
+    
+    if started:
+        flash(f'Retraining face recognition for {run.total} photos in the background', 'success')
+    else:
+        flash('Retraining is already running for this room', 'info')
+    return redirect(url_for('face_recognition_settings'))
+
+# API endpoint for batch face recognition progress
+@views.route('/api/room/<int:room_id>/face-recognition-progress')
+@login_required
+def api_face_recognition_progress(room_id):
+    room = get_room_or_404(room_id)
+    
+    # Check if user is the creator
+    current_user = get_current_user()
+    if current_user.id != room.creator_id:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    kind = request.args.get('kind', FACE_RECOGNITION)
+    if kind not in (FACE_RECOGNITION, RETRAIN):
+        return jsonify({'error': 'Unknown kind'}), 400
+    
+    run = get_latest_batch_run(room_id, kind)
+    if not run:
+        return jsonify({'room_id': room_id, 'kind': kind, 'status': 'none'})
+    
+    return jsonify(batch_progress(run))
 
 # API endpoint for face recognition settings
-@app.route('/api/face_recognition_settings')
+@views.route('/api/face_recognition_settings')
 @login_required
 def api_face_recognition_settings():
     # Get current settings
@@ -0,0 +1,101 @@
+"""
+Serving Utilities for the Photo Sharing App
+The bytes behind a photo URL never change: originals are content-addressed and
+derivatives are built from them. Responses therefore carry a strong ETag and
+an immutable, far-future Cache-Control header, conditional requests get a 304,
+and Range requests get partial content. The exception is a derivative that
+couldn't be built yet: the original stands in for it under the derivative's
+URL, so it is only cached briefly. Setting SENDFILE_MODE hands the file
+transfer to the reverse proxy:
+
+    'x-sendfile'  X-Sendfile with the absolute path (Apache mod_xsendfile, lighttpd)
+    'x-accel'     X-Accel-Redirect to X_ACCEL_PREFIX + the path under UPLOAD_FOLDER (nginx)
+
+With the nginx mode, X_ACCEL_PREFIX has to be an internal location aliased to
+UPLOAD_FOLDER, for example:
+
+    location /protected-uploads/ { internal; alias /srv/app/static/uploads/; }
+"""
+
+import os
+import logging
+from urllib.parse import quote
+from flask import current_app, request
+from werkzeug.utils import send_file
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+SENDFILE_MODES = ('x-sendfile', 'x-accel')
+DEFAULT_X_ACCEL_PREFIX = '/protected-uploads/'
+
+# One year, the longest max-age caches are expected to honour
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+# For an original served in place of a derivative, until the derivative exists
+FALLBACK_MAX_AGE = 5 * 60
+
+def get_sendfile_mode():
+    """Get the configured proxy offload mode, or None to send files from Python"""
+    mode = current_app.config.get('SENDFILE_MODE')
+    return mode if mode in SENDFILE_MODES else None
+
+def photo_etag(photo, size, file_path):
+    """
+    Get the strong ETag of a served photo file, or None to fall back to file stats
+    Content-addressed originals are tagged by digest, derivatives by digest and size name.
+    """
+    from storage_utils import get_blob_path
+
+    if not photo.blob_digest:
+        return None
+    # A derivative that couldn't be built is served as the original
+    if file_path == get_blob_path(photo.blob_digest):
+        return photo.blob_digest
+    return f"{photo.blob_digest}-{size}"
+
+def _x_accel_location(path):
+    """Map a file under UPLOAD_FOLDER to its internal nginx location"""
+    upload_folder = os.path.join(current_app.root_path, current_app.config['UPLOAD_FOLDER'])
+    relative = os.path.relpath(path, upload_folder).replace(os.sep, '/')
+    prefix = current_app.config.get('X_ACCEL_PREFIX', DEFAULT_X_ACCEL_PREFIX)
+    return prefix.rstrip('/') + '/' + quote(relative)
+
+def send_photo_file(file_path, etag=None, mimetype=None, download_name=None, immutable=True):
+    """
+    Send a photo file with caching headers, conditional and Range handling
+    `download_name` sends it as an attachment. Without an etag one is derived
+    from the file's mtime and size. `immutable=False` is for files whose URL
+    may serve other bytes later; they get a short max-age instead.
+    """
+    path = os.path.join(current_app.root_path, file_path)
+    mode = get_sendfile_mode()
+
+    response = send_file(
+        path,
+        request.environ,
+        mimetype=mimetype,
+        as_attachment=download_name is not None,
+        download_name=download_name,
+        # The proxy handles Range when it sends the file itself
+        conditional=mode is None,
+        etag=etag or True,
+        max_age=IMMUTABLE_MAX_AGE if immutable else FALLBACK_MAX_AGE,
+        use_x_sendfile=mode is not None,
+        response_class=current_app.response_class
+    )
+
+    # Photos can be in private rooms, so only the browser may cache them
+    response.cache_control.public = None
+    response.cache_control.private = True
+    response.cache_control.immutable = immutable
+
+    if mode is not None:
+        response = response.make_conditional(request.environ)
+        if response.status_code == 304:
+            response.headers.pop('X-Sendfile', None)
+        elif mode == 'x-accel':
+            response.headers.pop('X-Sendfile', None)
+            response.headers.pop('Content-Length', None)
+            response.headers['X-Accel-Redirect'] = _x_accel_location(path)
+
+    return response
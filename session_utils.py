@@ -0,0 +1,266 @@
+"""
+Session Utilities for the Photo Sharing App
+Keeps session contents on the server so the cookie only carries a signed,
+random session id. A guest who has unlocked hundreds of rooms still sends a
+cookie of under 100 bytes, and requests under /static never touch the store.
+
+SESSION_BACKEND picks where sessions live:
+
+    'database'  a server_session table, in the app database or in
+                SESSION_DATABASE_URI (e.g. sqlite:///instance/sessions.db)
+    'cookie'    Flask's signed cookie, as before
+
+Rows expire PERMANENT_SESSION_LIFETIME after their last write or touch and
+are deleted in batches by 'flask purge-sessions'.
+"""
+
+import secrets
+import logging
+from datetime import datetime, timedelta
+from flask import session
+from flask.sessions import SessionInterface, SecureCookieSession, session_json_serializer
+from itsdangerous import Signer, BadSignature
+from sqlalchemy import create_engine, select
+from app import db
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+SESSION_BACKENDS = ('database', 'cookie')
+DEFAULT_SESSION_BACKEND = 'database'
+
+# An unchanged session's expiry is pushed back at most this often
+DEFAULT_TOUCH_INTERVAL = timedelta(hours=1)
+
+DEFAULT_PURGE_BATCH_SIZE = 1000
+
+class ServerSideSession(SecureCookieSession):
+    """Session contents loaded from the store, remembering how they were stored"""
+
+    def __init__(self, initial=None, sid=None, stored=None, expires_at=None):
+        super().__init__(initial)
+        self.sid = sid
+        self.stored = stored
+        self.expires_at = expires_at
+        self.replaced_sid = None
+
+    def regenerate(self):
+        """
+        Move the contents to a new id, so an id planted in the browser before
+        a login or room unlock never becomes a privileged session
+        The old row is deleted when the session is saved.
+        """
+        if self.stored is not None and self.replaced_sid is None:
+            self.replaced_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.stored = None
+        self.modified = True
+
+def regenerate_session():
+    """Give the current server-side session a new id; cookie sessions carry no id to fix"""
+    if isinstance(session, ServerSideSession):
+        session.regenerate()
+
+class DatabaseSessionStore:
+    """Session rows in the server_session table of the app database or a database of their own"""
+
+    def __init__(self, database_uri=None, config=None):
+        # Creating an engine doesn't connect, so this is safe before forking
+        self._engine = None
+        if database_uri:
+            from database_utils import get_engine_options, configure_engine
+
+            self._engine = create_engine(database_uri, **get_engine_options(config or {}, database_uri))
+            configure_engine(self._engine, config or {})
+
+    @property
+    def engine(self):
+        return self._engine if self._engine is not None else db.engine
+
+    def create_table(self):
+        """Create the session table in a database of its own; the app database gets it from create_all"""
+        if self._engine is not None:
+            self.table.create(self._engine, checkfirst=True)
+
+    def dispose(self):
+        """Drop pooled connections of a database of its own, e.g. after a fork"""
+        if self._engine is not None:
+            self._engine.dispose(close=False)
+
+    @property
+    def table(self):
+        from models import ServerSession
+
+        return ServerSession.__table__
+
+    def load(self, sid, now):
+        """Get (data, expires_at) of a live session, or None"""
+        table = self.table
+        with self.engine.connect() as connection:
+            return connection.execute(
+                select(table.c.data, table.c.expires_at).where(table.c.id == sid, table.c.expires_at > now)
+            ).first()
+
+    def save(self, sid, data, expires_at):
+        """Write a session's contents and expiry"""
+        table = self.table
+        with self.engine.begin() as connection:
+            dialect = connection.dialect.name
+            if dialect in ('sqlite', 'postgresql'):
+                if dialect == 'sqlite':
+                    from sqlalchemy.dialects.sqlite import insert
+                else:
+                    from sqlalchemy.dialects.postgresql import insert
+
+                statement = insert(table).values(id=sid, data=data, expires_at=expires_at)
+                connection.execute(statement.on_conflict_do_update(
+                    index_elements=[table.c.id],
+                    set_={'data': statement.excluded.data, 'expires_at': statement.excluded.expires_at}
+                ))
+                return
+
+            # Other databases: update, then insert if there was nothing to update
+            result = connection.execute(
+                table.update().where(table.c.id == sid).values(data=data, expires_at=expires_at)
+            )
+            if result.rowcount == 0:
+                connection.execute(table.insert().values(id=sid, data=data, expires_at=expires_at))
+
+    def touch(self, sid, expires_at):
+        """Push back the expiry of an unchanged session"""
+        table = self.table
+        with self.engine.begin() as connection:
+            connection.execute(table.update().where(table.c.id == sid).values(expires_at=expires_at))
+
+    def delete(self, sid):
+        table = self.table
+        with self.engine.begin() as connection:
+            connection.execute(table.delete().where(table.c.id == sid))
+
+    def purge(self, now, batch_size=DEFAULT_PURGE_BATCH_SIZE):
+        """Delete expired sessions a batch per transaction; returns the number deleted"""
+        table = self.table
+        purged = 0
+        while True:
+            with self.engine.begin() as connection:
+                expired = select(table.c.id).where(table.c.expires_at <= now).limit(batch_size)
+                deleted = connection.execute(table.delete().where(table.c.id.in_(expired))).rowcount
+            purged += deleted
+            if deleted < batch_size:
+                return purged
+
+class ServerSideSessionInterface(SessionInterface):
+    """
+    Flask session interface that keeps sessions in a store and a signed id in the cookie
+    Contents are compared with what was loaded, so changes to nested values such
+    as session['room_access_codes'][room_id] are saved too.
+    """
+
+    salt = 'server-session'
+    serializer = session_json_serializer
+
+    def __init__(self, store):
+        self.store = store
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt=self.salt)
+
+    def _new_session(self):
+        return ServerSideSession(sid=secrets.token_urlsafe(32))
+
+    def _touch_interval(self, app):
+        return app.config.get('SESSION_TOUCH_INTERVAL', DEFAULT_TOUCH_INTERVAL)
+
+    def open_session(self, app, request):
+        # Static files never read the session, so don't look it up for them
+        if app.static_url_path and request.path.startswith(app.static_url_path + '/'):
+            return self.make_null_session(app)
+
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if not cookie:
+            return self._new_session()
+
+        try:
+            sid = self._signer(app).unsign(cookie).decode()
+        except BadSignature:
+            return self._new_session()
+
+        try:
+            row = self.store.load(sid, datetime.utcnow())
+        except Exception as e:
+            logger.error(f"Error loading session: {str(e)}")
+            return self._new_session()
+
+        if row is None:
+            return self._new_session()
+        return ServerSideSession(self.serializer.loads(row.data), sid=sid, stored=row.data, expires_at=row.expires_at)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if getattr(session, 'replaced_sid', None) is not None:
+            self.store.delete(session.replaced_sid)
+
+        # An emptied session is removed from the store and the browser
+        if not session:
+            if session.stored is not None:
+                self.store.delete(session.sid)
+            if session.modified or session.stored is not None:
+                response.delete_cookie(name, domain=domain, path=path, secure=secure, samesite=samesite, httponly=httponly)
+                response.vary.add('Cookie')
+            return
+
+        now = datetime.utcnow()
+        expires_at = now + app.permanent_session_lifetime
+        data = self.serializer.dumps(dict(session))
+
+        if data != session.stored:
+            self.store.save(session.sid, data, expires_at)
+        elif session.expires_at - now < app.permanent_session_lifetime - self._touch_interval(app):
+            self.store.touch(session.sid, expires_at)
+        else:
+            expires_at = session.expires_at
+
+        # The cookie is only sent when the id is new or has to be renewed
+        if session.stored is None or (session.permanent and expires_at != session.expires_at):
+            response.set_cookie(
+                name,
+                self._signer(app).sign(session.sid).decode(),
+                expires=self.get_expiration_time(app, session),
+                httponly=httponly,
+                domain=domain,
+                path=path,
+                secure=secure,
+                samesite=samesite
+            )
+            response.vary.add('Cookie')
+
+def init_session_store(app):
+    """Install the session interface chosen by SESSION_BACKEND"""
+    backend = app.config.get('SESSION_BACKEND', DEFAULT_SESSION_BACKEND)
+    if backend not in SESSION_BACKENDS:
+        raise ValueError(f"Unknown SESSION_BACKEND {backend!r}, expected one of {', '.join(SESSION_BACKENDS)}")
+
+    if backend == 'database':
+        app.session_interface = ServerSideSessionInterface(DatabaseSessionStore(app.config.get('SESSION_DATABASE_URI'), app.config))
+
+def purge_expired_sessions(app, batch_size=DEFAULT_PURGE_BATCH_SIZE, now=None):
+    """
+    Delete expired server-side sessions in batches
+    Returns the number deleted, or 0 when sessions are kept in cookies
+    """
+    interface = app.session_interface
+    if not isinstance(interface, ServerSideSessionInterface):
+        return 0
+
+    purged = interface.store.purge(now or datetime.utcnow(), batch_size)
+    logger.info(f"Purged {purged} expired sessions")
+    return purged
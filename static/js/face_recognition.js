@@ -134,7 +134,7 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // Add confirmation prompt for reprocessing
     function initReprocessButtons() {
-        document.querySelectorAll('a[href*="process_all_photos"]').forEach(button => {
+        document.querySelectorAll('a[href*="process-all-photos"]').forEach(button => {
             button.addEventListener('click', function(e) {
                 if (!confirm('This will reprocess all photos in the room using current face recognition settings. This may take some time. Continue?')) {
                     e.preventDefault();
@@ -187,6 +187,66 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
     
+    // Format a number of seconds as a short duration
+    function formatDuration(seconds) {
+        if (seconds < 60) return `${seconds}s`;
+        const minutes = Math.floor(seconds / 60);
+        if (minutes < 60) return `${minutes}m ${seconds % 60}s`;
+        return `${Math.floor(minutes / 60)}h ${minutes % 60}m`;
+    }
+    
+    // Poll batch reprocessing progress for each room
+    function initBatchProgress() {
+        document.querySelectorAll('.batch-progress[data-progress-url]').forEach(container => {
+            const url = container.getAttribute('data-progress-url');
+            const label = container.getAttribute('data-progress-label');
+            const bar = container.querySelector('.progress-bar');
+            const text = container.querySelector('.batch-progress-text');
+            
+            function poll() {
+                fetch(url)
+                    .then(response => {
+                        if (!response.ok) {
+                            throw new Error('Network response was not ok');
+                        }
+                        return response.json();
+                    })
+                    .then(progress => {
+                        if (progress.status === 'none') return;
+                        
+                        container.classList.remove('d-none');
+                        bar.style.width = `${progress.percent}%`;
+                        
+                        let message = `${progress.done + progress.failed} / ${progress.total} photos`;
+                        if (label) message = `${label}: ${message}`;
+                        if (progress.status === 'pending') {
+                            message += ' - waiting for a worker';
+                        } else if (progress.status === 'running') {
+                            if (progress.rate) message += ` - ${progress.rate} photos/s`;
+                            if (progress.eta_seconds !== null) message += ` - about ${formatDuration(progress.eta_seconds)} left`;
+                        } else if (progress.status === 'failed') {
+                            message += ' - stopped, start again to resume';
+                            bar.classList.add('bg-danger');
+                        } else {
+                            message += ' - complete';
+                            bar.classList.add('bg-success');
+                        }
+                        if (progress.failed) message += ` (${progress.failed} failed)`;
+                        text.textContent = message;
+                        
+                        if (progress.status === 'pending' || progress.status === 'running') {
+                            setTimeout(poll, 2000);
+                        }
+                    })
+                    .catch(error => {
+                        console.error('Error fetching reprocessing progress:', error);
+                    });
+            }
+            
+            poll();
+        });
+    }
+    
     // Initialize the face recognition settings page
     function initFaceRecognitionSettings() {
         initRangeInputs();
@@ -194,6 +254,7 @@ document.addEventListener('DOMContentLoaded', function() {
         initTooltips();
         initReprocessButtons();
         createSettingsPreview();
+        initBatchProgress();
         
         // Fetch current settings from API if the form exists
         if (document.querySelector('form[action*="face_recognition_settings"]')) {
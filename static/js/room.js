@@ -16,33 +16,80 @@ document.addEventListener('DOMContentLoaded', function() {
     }
     
     // Initialize dropzone for photo uploads if available and if on upload page
-    if (typeof Dropzone !== 'undefined' && document.querySelector('.dropzone')) {
-        // Extract CSRF token
+    const dropzoneElement = document.querySelector('.dropzone[data-upload-url]');
+    if (typeof Dropzone !== 'undefined' && dropzoneElement) {
+        initChunkedDropzone(dropzoneElement);
+    }
+    
+    // Upload each file through an upload session: Dropzone sends the chunks,
+    // the session is created when a file is accepted and completed after its last chunk
+    function initChunkedDropzone(element) {
         const csrfToken = document.querySelector('input[name="csrf_token"]').value;
-        const roomId = window.location.pathname.split('/')[2]; // Extract from URL
+        const createUrl = element.getAttribute('data-upload-url');
+        const roomUrl = element.getAttribute('data-room-url');
+        const jsonHeaders = {
+            'Content-Type': 'application/json',
+            'X-CSRF-TOKEN': csrfToken,
+            'X-Requested-With': 'XMLHttpRequest'
+        };
+        
+        // POST JSON and resolve with the parsed body, rejecting with its error message
+        function postJson(url, body) {
+            return fetch(url, {
+                method: 'POST',
+                headers: jsonHeaders,
+                credentials: 'same-origin',
+                body: JSON.stringify(body || {})
+            }).then(response => response.json().catch(() => ({})).then(data => {
+                if (!response.ok) {
+                    throw new Error(data.error || `Upload failed (${response.status})`);
+                }
+                return data;
+            }));
+        }
         
         Dropzone.autoDiscover = false;
         
-        const myDropzone = new Dropzone(".dropzone", {
-            url: `/room/${roomId}/upload`,
+        const myDropzone = new Dropzone(element, {
+            url: function(files) {
+                return files[0].uploadSession.chunk_url;
+            },
+            method: 'put',
             paramName: "photo",
-            maxFilesize: 10, // MB
-            acceptedFiles: "image/*",
+            maxFilesize: parseInt(element.getAttribute('data-max-filesize'), 10) / (1024 * 1024), // MB
+            acceptedFiles: "image/*,.heic,.heif,.dng",
             addRemoveLinks: true,
+            parallelUploads: 3,
+            chunking: true,
+            forceChunking: true,
+            chunkSize: parseInt(element.getAttribute('data-chunk-size'), 10),
+            parallelChunkUploads: false,
+            retryChunks: true,
+            retryChunksLimit: 5,
             headers: {
                 'X-CSRF-TOKEN': csrfToken
             },
-            init: function() {
-                this.on("sending", function(file, xhr, formData) {
-                    formData.append("csrf_token", csrfToken);
-                    
-                    // Get description from form if available
-                    const description = document.getElementById('photo-description');
-                    if (description) {
-                        formData.append("description", description.value);
-                    }
-                });
+            accept: function(file, done) {
+                // Get description from form if available
+                const description = document.getElementById('description') || document.getElementById('photo-description');
                 
+                postJson(createUrl, {
+                    filename: file.name,
+                    size: file.size,
+                    description: description ? description.value : ''
+                }).then(uploadSession => {
+                    file.uploadSession = uploadSession;
+                    done();
+                }).catch(error => done(error.message));
+            },
+            chunksUploaded: function(file, done) {
+                // Dropzone calls this with its options as `this`, so a failed file goes through the instance
+                postJson(file.uploadSession.complete_url).then(result => {
+                    file.uploadResult = result;
+                    done();
+                }).catch(error => myDropzone._errorProcessing([file], error.message));
+            },
+            init: function() {
                 this.on("success", function(file, response) {
                     file.previewElement.classList.add("dz-success");
                 });
@@ -53,18 +100,41 @@ document.addEventListener('DOMContentLoaded', function() {
                     // Display the error message
                     let errorDisplay = file.previewElement.querySelector(".dz-error-message");
                     if (errorDisplay) {
-                        errorDisplay.textContent = errorMessage;
+                        errorDisplay.textContent = typeof errorMessage === 'string' ? errorMessage : errorMessage.error;
                     }
                 });
                 
                 this.on("queuecomplete", function() {
-                    // Redirect to room page or show success message
-                    setTimeout(() => {
-                        window.location.href = `/room/${roomId}`;
-                    }, 1500);
+                    // Redirect to room page after all uploads are complete
+                    const successfulUploads = this.getFilesWithStatus(Dropzone.SUCCESS);
+                    if (successfulUploads.length > 0 && roomUrl) {
+                        setTimeout(() => {
+                            window.location.href = roomUrl;
+                        }, 1500);
+                    }
                 });
             }
         });
+        
+        return myDropzone;
+    }
+    
+    // Show only the photo cards that have one of the active tags
+    function applyTagFilters() {
+        const activeFilters = Array.from(document.querySelectorAll('.tag-filter.active'))
+            .map(el => el.getAttribute('data-tag'));
+        
+        document.querySelectorAll('.photo-card').forEach(card => {
+            if (activeFilters.length === 0) {
+                // If no active filters, show all photos
+                card.style.display = '';
+                return;
+            }
+            
+            const cardTags = (card.getAttribute('data-tags') || '').split(' ').filter(t => t.trim());
+            const hasTag = activeFilters.some(tag => cardTags.includes(tag));
+            card.style.display = hasTag ? '' : 'none';
+        });
     }
     
     // Enable filtering photos by tag
@@ -74,37 +144,136 @@ document.addEventListener('DOMContentLoaded', function() {
         
         tagFilters.forEach(filter => {
             filter.addEventListener('click', function() {
-                const tagName = this.getAttribute('data-tag');
-                if (!tagName) return;
-                
                 // Toggle active state on filter button
                 this.classList.toggle('active');
-                
-                // Get all active filters
-                const activeFilters = Array.from(document.querySelectorAll('.tag-filter.active'))
-                    .map(el => el.getAttribute('data-tag'));
-                
-                // Filter photos based on active tags
-                const photoCards = document.querySelectorAll('.photo-card');
-                
-                if (activeFilters.length === 0) {
-                    // If no active filters, show all photos
-                    photoCards.forEach(card => {
-                        card.style.display = '';
-                    });
-                } else {
-                    // Filter photos
-                    photoCards.forEach(card => {
-                        const photoTags = Array.from(card.querySelectorAll('.badge'))
-                            .map(badge => badge.textContent.trim());
-                        
-                        // Check if photo has at least one of the active tags
-                        const hasTag = activeFilters.some(tag => photoTags.includes(tag));
-                        card.style.display = hasTag ? '' : 'none';
-                    });
-                }
+                applyTagFilters();
             });
         });
+        
+        const clearFiltersBtn = document.querySelector('.clear-filters');
+        if (clearFiltersBtn) {
+            clearFiltersBtn.addEventListener('click', function() {
+                tagFilters.forEach(filter => filter.classList.remove('active'));
+                applyTagFilters();
+            });
+        }
+    }
+    
+    // Build a photo card matching the server-rendered grid
+    function createPhotoCard(photo) {
+        const card = document.createElement('div');
+        card.className = 'photo-card card border-0 shadow-sm';
+        card.setAttribute('data-tags', photo.tags.join(' '));
+        
+        const link = document.createElement('a');
+        link.href = photo.view_url;
+        link.className = 'card-img-top photo-img-link';
+        
+        const img = document.createElement('img');
+        img.src = photo.thumbnail_url;
+        img.className = 'card-img-top photo-img';
+        img.loading = 'lazy';
+        img.alt = photo.original_filename;
+        link.appendChild(img);
+        card.appendChild(link);
+        
+        const body = document.createElement('div');
+        body.className = 'card-body p-3';
+        
+        const header = document.createElement('div');
+        header.className = 'd-flex justify-content-between align-items-center mb-2';
+        const date = document.createElement('small');
+        date.className = 'text-muted';
+        date.textContent = photo.uploaded_display;
+        const download = document.createElement('a');
+        download.href = photo.download_url;
+        download.className = 'btn btn-sm btn-outline-primary';
+        download.innerHTML = '<i data-feather="download" style="width: 14px; height: 14px;"></i>';
+        const actions = document.createElement('div');
+        actions.appendChild(download);
+        header.appendChild(date);
+        header.appendChild(actions);
+        body.appendChild(header);
+        
+        if (photo.description) {
+            const description = document.createElement('p');
+            description.className = 'card-text small mb-2';
+            description.textContent = photo.description.length > 50
+                ? photo.description.substring(0, 47) + '...'
+                : photo.description;
+            body.appendChild(description);
+        }
+        
+        const tags = document.createElement('div');
+        tags.className = 'photo-tags';
+        photo.tags.forEach(tagName => {
+            const tag = document.createElement('span');
+            tag.className = 'photo-tag';
+            tag.textContent = tagName;
+            tags.appendChild(tag);
+        });
+        body.appendChild(tags);
+        card.appendChild(body);
+        
+        return card;
+    }
+    
+    // Load the next page of photos when the "Load More" button scrolls into view
+    function initPhotoFeed() {
+        const loadMore = document.querySelector('.load-more-photos');
+        const grid = document.querySelector('.photo-grid');
+        if (!loadMore || !grid) return;
+        
+        let loading = false;
+        let observer = null;
+        
+        function loadNextPage() {
+            const feedUrl = loadMore.getAttribute('data-feed-url');
+            if (loading || !feedUrl) return;
+            loading = true;
+            
+            fetch(feedUrl, { headers: { 'Accept': 'application/json' } })
+                .then(response => {
+                    if (!response.ok) throw new Error(`HTTP ${response.status}`);
+                    return response.json();
+                })
+                .then(data => {
+                    data.photos.forEach(photo => grid.appendChild(createPhotoCard(photo)));
+                    if (typeof feather !== 'undefined') feather.replace();
+                    applyTagFilters();
+                    
+                    if (data.next_url) {
+                        loadMore.setAttribute('data-feed-url', data.next_url);
+                        // Re-observe so a button still on screen loads the next page too
+                        if (observer) {
+                            observer.unobserve(loadMore);
+                            observer.observe(loadMore);
+                        }
+                    } else {
+                        if (observer) observer.disconnect();
+                        loadMore.parentNode.removeChild(loadMore);
+                    }
+                })
+                .catch(err => {
+                    console.error('Error loading photos:', err);
+                })
+                .finally(() => {
+                    loading = false;
+                });
+        }
+        
+        // The button still works as a plain link when scripts are off
+        loadMore.addEventListener('click', function(e) {
+            e.preventDefault();
+            loadNextPage();
+        });
+        
+        if ('IntersectionObserver' in window) {
+            observer = new IntersectionObserver(entries => {
+                if (entries.some(entry => entry.isIntersecting)) loadNextPage();
+            }, { rootMargin: '600px 0px' });
+            observer.observe(loadMore);
+        }
     }
     
     // Enable photo tagging functionality
@@ -287,6 +456,7 @@ document.addEventListener('DOMContentLoaded', function() {
     // Initialize the room page
     function initRoomPage() {
         initPhotoFiltering();
+        initPhotoFeed();
         initPhotoTagging();
         initAlbumSelection();
         initRoomTabs();
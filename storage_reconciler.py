@@ -0,0 +1,349 @@
+"""
+Storage Reconciler for the Photo Sharing App
+Finds files under UPLOAD_FOLDER that no photo references any more, such as
+the per-room folders of legacy uploads whose photos were deleted, blobs and
+derivatives whose last photo was deleted or whose upload failed, and
+temporary files of uploads that never finished. Nothing else deletes blob
+files, since an upload of the same content may reuse one before it commits.
+
+The tree is walked with os.scandir in sorted order and checked in batches:
+the digests, legacy file names and upload ids of a batch are looked up with
+one IN query each, and whatever the database doesn't know is an orphan.
+Only one directory listing and one batch are held in memory, and the last
+path checked is saved after every batch, so a pass over millions of files
+can be spread over many runs.
+
+Orphans are first moved to <UPLOAD_FOLDER>/quarantine/<date>/ and only
+deleted STORAGE_QUARANTINE_DAYS later; a quarantined file that a photo
+references again by then is put back. Files younger than
+STORAGE_ORPHAN_MIN_AGE are never touched, since an upload writes its file
+before it commits its photo.
+"""
+
+import os
+import re
+import shutil
+import logging
+from datetime import datetime, timedelta
+from itertools import islice
+from flask import current_app
+from sqlalchemy import select, exists
+from app import db
+from storage_utils import BLOB_DIR, TMP_DIR, get_blob_path, get_legacy_path
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+QUARANTINE_DIR = 'quarantine'
+SCAN_NAME = 'uploads'
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_MAX_FILES = 200000  # per maintenance run
+DEFAULT_ORPHAN_MIN_AGE = 3600  # seconds
+DEFAULT_QUARANTINE_DAYS = 7
+
+DIGEST_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+UPLOAD_TMP_PATTERN = re.compile(r'^upload_([0-9a-f]+)\.tmp$')
+
+# What a file in the upload tree belongs to
+BLOB = 'blob'              # a blob or one of its derivatives, keyed by digest
+LEGACY = 'legacy'          # a legacy upload or its thumbnail, keyed by (room_id, filename)
+UPLOAD_TMP = 'upload_tmp'  # data of an upload session, keyed by its id
+TMP = 'tmp'                # a temporary file of an upload in progress
+
+def get_upload_root():
+    return current_app.config['UPLOAD_FOLDER']
+
+def get_orphan_min_age():
+    """Get how many seconds a file must be unchanged before it may be treated as an orphan"""
+    return current_app.config.get('STORAGE_ORPHAN_MIN_AGE', DEFAULT_ORPHAN_MIN_AGE)
+
+def get_quarantine_days():
+    """Get how long orphans stay in quarantine before they are deleted"""
+    return current_app.config.get('STORAGE_QUARANTINE_DAYS', DEFAULT_QUARANTINE_DAYS)
+
+def get_batch_size():
+    """Get how many files are looked up per query"""
+    return current_app.config.get('STORAGE_RECONCILE_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+
+def get_max_files():
+    """Get how many files a maintenance run checks before leaving the rest of the pass to the next one"""
+    return current_app.config.get('STORAGE_RECONCILE_MAX_FILES', DEFAULT_MAX_FILES)
+
+def walk_files(root, after=(), exclude=()):
+    """
+    Yield the path of every file under root as a tuple of names, in sorted order
+    Only paths after `after` are yielded, and subtrees that sort entirely
+    before it are skipped without being listed. Top-level names in `exclude`
+    are left out.
+    """
+    def walk(prefix):
+        try:
+            with os.scandir(os.path.join(root, *prefix)) as scan:
+                entries = sorted(scan, key=lambda entry: entry.name)
+        except (FileNotFoundError, NotADirectoryError):
+            return
+
+        for entry in entries:
+            path = prefix + (entry.name,)
+            if (not prefix and entry.name in exclude) or path < after[:len(path)]:
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                yield from walk(path)
+            elif entry.is_file(follow_symlinks=False) and path > after:
+                yield path
+
+    return walk(())
+
+def classify(path):
+    """Get (kind, key) for a path in the upload tree, or None for files the app didn't write"""
+    if len(path) == 4 and path[0] == BLOB_DIR and DIGEST_PATTERN.match(path[3]) and path[1:3] == (path[3][:2], path[3][2:4]):
+        return BLOB, path[3]
+    if len(path) == 3 and path[:2] == (BLOB_DIR, TMP_DIR):
+        match = UPLOAD_TMP_PATTERN.match(path[2])
+        return (UPLOAD_TMP, match.group(1)) if match else (TMP, path[2])
+
+    from thumbnail_utils import DERIVED_DIR, THUMBNAIL_DIR
+    if len(path) == 5 and path[0] == DERIVED_DIR and DIGEST_PATTERN.match(path[4]):
+        return BLOB, path[4]
+
+    # Legacy uploads: <room_id>/<filename> and <room_id>/thumbs/<size>/<filename>
+    if path[0].isdigit() and (len(path) == 2 or (len(path) == 4 and path[1] == THUMBNAIL_DIR)):
+        return LEGACY, (int(path[0]), path[-1])
+    return None
+
+def find_referenced(keys):
+    """Get the subset of (kind, key) pairs the database still needs; one query per kind and room"""
+    from models import Photo, UploadSession
+
+    referenced = set()
+
+    digests = {key for kind, key in keys if kind == BLOB}
+    if digests:
+        rows = db.session.execute(select(Photo.blob_digest).where(Photo.blob_digest.in_(digests)).distinct())
+        referenced.update((BLOB, digest) for digest in rows.scalars())
+
+    filenames_by_room = {}
+    for kind, key in keys:
+        if kind == LEGACY:
+            filenames_by_room.setdefault(key[0], set()).add(key[1])
+    for room_id, filenames in filenames_by_room.items():
+        rows = db.session.execute(select(Photo.filename).where(
+            Photo.room_id == room_id,
+            Photo.blob_digest.is_(None),
+            Photo.filename.in_(filenames)
+        ))
+        referenced.update((LEGACY, (room_id, filename)) for filename in rows.scalars())
+
+    upload_ids = {key for kind, key in keys if kind == UPLOAD_TMP}
+    if upload_ids:
+        rows = db.session.execute(select(UploadSession.id).where(UploadSession.id.in_(upload_ids), UploadSession.status == 'open'))
+        referenced.update((UPLOAD_TMP, upload_id) for upload_id in rows.scalars())
+
+    db.session.commit()
+    return referenced
+
+def find_orphans(root, paths, now):
+    """Get the paths of a batch that nothing references and that have not changed for STORAGE_ORPHAN_MIN_AGE"""
+    classified = [(path, classify(path)) for path in paths]
+    referenced = find_referenced({key for path, key in classified if key is not None})
+    cutoff = now.timestamp() - get_orphan_min_age()
+
+    orphans = []
+    for path, key in classified:
+        if key is None or key in referenced:
+            continue
+        try:
+            if os.stat(os.path.join(root, *path)).st_mtime < cutoff:
+                orphans.append(path)
+        except FileNotFoundError:
+            pass
+    return orphans
+
+def _move(source, dest):
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    os.replace(source, dest)
+
+def _quarantine_path(root, day, path):
+    return os.path.join(root, QUARANTINE_DIR, day, *path)
+
+def _forget_orphaned_blobs(digests):
+    """Delete Blob rows no photo references, left by the same crash that left their files"""
+    from models import Blob, Photo
+
+    if not digests:
+        return
+    db.session.execute(Blob.__table__.delete().where(
+        Blob.digest.in_(digests),
+        Blob.ref_count <= 0,
+        ~exists().where(Photo.blob_digest == Blob.digest)
+    ))
+    db.session.commit()
+
+def quarantine_orphans(root, orphans, now):
+    """
+    Move orphans into today's quarantine folder; returns how many were moved
+    A file that became referenced while it was being moved is put straight back.
+    """
+    day = now.strftime('%Y-%m-%d')
+    moved = []
+    for path in orphans:
+        try:
+            _move(os.path.join(root, *path), _quarantine_path(root, day, path))
+            moved.append(path)
+        except FileNotFoundError:
+            pass
+
+    keys = {path: classify(path) for path in moved}
+    referenced = find_referenced(set(keys.values()))
+    for path in moved:
+        if keys[path] in referenced:
+            _restore(root, day, path)
+    moved = [path for path in moved if keys[path] not in referenced]
+
+    _forget_orphaned_blobs({keys[path][1] for path in moved if keys[path][0] == BLOB and len(path) == 4})
+    for path in moved:
+        logger.info(f"Quarantined orphaned upload file {'/'.join(path)}")
+    return len(moved)
+
+def _restore(root, day, path):
+    """Put a quarantined file back unless its content was stored again meanwhile"""
+    source = _quarantine_path(root, day, path)
+    dest = os.path.join(root, *path)
+    if os.path.exists(dest):
+        os.remove(source)
+    else:
+        _move(source, dest)
+    logger.info(f"Restored {'/'.join(path)} from quarantine")
+
+def _get_scan():
+    from models import StorageScan
+
+    scan = db.session.get(StorageScan, SCAN_NAME)
+    if scan is None:
+        scan = StorageScan(name=SCAN_NAME, files_checked=0, orphans_quarantined=0)
+        db.session.add(scan)
+    return scan
+
+def reconcile_storage(max_files=None, batch_size=None, dry_run=False, on_orphan=None, on_batch=None, now=None):
+    """
+    Check up to `max_files` files of the upload tree, carrying on where the last call stopped
+    Orphans are quarantined, or with dry_run only passed to `on_orphan` and
+    the saved position left alone. `on_batch` is called after every batch,
+    e.g. to renew a lease; it can return False to stop early.
+    Returns a dict of metrics; 'completed' says whether this call finished a full pass.
+    """
+    now = now or datetime.utcnow()
+    batch_size = batch_size or get_batch_size()
+    root = get_upload_root()
+
+    scan = _get_scan()
+    if scan.cursor is None:
+        scan.pass_started_at = now
+        scan.files_checked = scan.orphans_quarantined = 0
+    after = tuple(scan.cursor.split('/')) if scan.cursor else ()
+    db.session.commit()
+
+    files = walk_files(root, after, exclude=(QUARANTINE_DIR,))
+    checked = found = quarantined = 0
+    completed = False
+
+    while max_files is None or checked < max_files:
+        limit = batch_size if max_files is None else min(batch_size, max_files - checked)
+        batch = list(islice(files, limit))
+        if not batch:
+            completed = True
+            break
+
+        orphans = find_orphans(root, batch, now)
+        checked += len(batch)
+        found += len(orphans)
+        for path in orphans:
+            if on_orphan is not None:
+                on_orphan('/'.join(path))
+
+        if not dry_run:
+            quarantined += quarantine_orphans(root, orphans, now)
+            scan = _get_scan()
+            scan.cursor = '/'.join(batch[-1])
+            scan.updated_at = datetime.utcnow()
+            scan.files_checked += len(batch)
+            scan.orphans_quarantined += len(orphans)
+            db.session.commit()
+
+        if len(batch) < limit:
+            completed = True
+            break
+        if on_batch is not None and on_batch() is False:
+            break
+
+    if completed and not dry_run:
+        scan = _get_scan()
+        scan.cursor = None
+        scan.completed_at = datetime.utcnow()
+        db.session.commit()
+        logger.info(f"Storage reconciliation pass finished: {scan.files_checked} files checked, {scan.orphans_quarantined} orphans quarantined")
+
+    return {'checked': checked, 'orphans': found, 'quarantined': quarantined, 'completed': completed}
+
+def purge_quarantine(batch_size=None, now=None):
+    """
+    Delete quarantined files older than STORAGE_QUARANTINE_DAYS
+    Any quarantined file a photo references again is restored instead, however
+    recently it was quarantined. Returns (deleted, restored).
+    """
+    now = now or datetime.utcnow()
+    batch_size = batch_size or get_batch_size()
+    root = get_upload_root()
+    quarantine_root = os.path.join(root, QUARANTINE_DIR)
+    expired_before = (now - timedelta(days=get_quarantine_days())).strftime('%Y-%m-%d')
+
+    deleted = restored = 0
+    files = walk_files(quarantine_root)
+    while True:
+        batch = list(islice(files, batch_size))
+        if not batch:
+            break
+
+        keys = {path: classify(path[1:]) for path in batch if len(path) > 1}
+        referenced = find_referenced({key for key in keys.values() if key is not None})
+
+        for path in batch:
+            if keys.get(path) is not None and keys[path] in referenced:
+                _restore(root, path[0], path[1:])
+                restored += 1
+            elif path[0] < expired_before:
+                try:
+                    os.remove(os.path.join(quarantine_root, *path))
+                    deleted += 1
+                except FileNotFoundError:
+                    pass
+
+    # Drop the folders of days that are now empty
+    if os.path.isdir(quarantine_root):
+        for entry in os.scandir(quarantine_root):
+            if entry.is_dir(follow_symlinks=False) and entry.name < expired_before and next(walk_files(entry.path), None) is None:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    logger.info(f"Purged {deleted} quarantined upload files, restored {restored}")
+    return deleted, restored
+
+def find_missing_files(batch_size=None):
+    """Yield (photo_id, path) for every photo whose original file is gone, reading photos in id batches"""
+    from models import Photo
+
+    batch_size = batch_size or get_batch_size()
+    last_id = 0
+    while True:
+        rows = db.session.query(Photo.id, Photo.room_id, Photo.filename, Photo.blob_digest).filter(
+            Photo.id > last_id
+        ).order_by(Photo.id).limit(batch_size).all()
+        db.session.commit()
+        if not rows:
+            return
+
+        for row in rows:
+            path = get_blob_path(row.blob_digest) if row.blob_digest else get_legacy_path(row.room_id, row.filename)
+            if not os.path.exists(path):
+                yield row.id, path
+        last_id = rows[-1].id
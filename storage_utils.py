@@ -0,0 +1,287 @@
+"""
+Storage Utilities for the Photo Sharing App
+Uploaded files are stored once per distinct content, under their SHA-256
+digest in a fan-out directory layout:
+
+    <UPLOAD_FOLDER>/blobs/ab/cd/abcd...  (the full 64 character digest)
+
+Photos reference a Blob row by digest. A session hook counts the references
+and deletes the row of a blob that loses its last photo. Its files are left
+to storage_reconciler, which only quarantines files older than
+STORAGE_ORPHAN_MIN_AGE: an upload of the same content may already have
+reused the file without having committed its photo yet.
+Photos uploaded before content addressing keep their per-room file until
+'flask migrate-storage' moves them into the blob store.
+"""
+
+import os
+import uuid
+import hashlib
+import logging
+import mimetypes
+from collections import Counter, namedtuple
+from flask import current_app
+from sqlalchemy import event, inspect, select
+from app import db
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+BLOB_DIR = 'blobs'
+# Temporary files live inside the blob store so os.replace never crosses filesystems
+TMP_DIR = 'tmp'
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+StoredBlob = namedtuple('StoredBlob', ['digest', 'size', 'created'])
+
+def fan_out(digest):
+    """Split a digest into the two directory levels and file name it is stored under"""
+    return digest[:2], digest[2:4], digest
+
+def get_blob_path(digest):
+    """Get the path of a stored blob"""
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], BLOB_DIR, *fan_out(digest))
+
+def get_legacy_path(room_id, filename):
+    """Get the path of a photo uploaded before content addressing"""
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], str(room_id), filename)
+
+def get_photo_path(photo):
+    """Get the path of a photo's original file"""
+    if photo.blob_digest:
+        return get_blob_path(photo.blob_digest)
+    return get_legacy_path(photo.room_id, photo.filename)
+
+def get_photo_mimetype(photo):
+    """Guess a photo's content type from the name it was uploaded with"""
+    return mimetypes.guess_type(photo.original_filename)[0] or 'application/octet-stream'
+
+def get_tmp_path(name=None):
+    """Get a path for a temporary file that can later be moved into the blob store"""
+    tmp_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], BLOB_DIR, TMP_DIR)
+    os.makedirs(tmp_dir, exist_ok=True)
+    return os.path.join(tmp_dir, f"{name or uuid.uuid4().hex}.tmp")
+
+def hash_file(path):
+    """Get (hex SHA-256, size) of a file, reading it in fixed-size chunks"""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+def _commit_tmp_file(tmp_path, digest):
+    """Move a hashed temporary file to its blob path; returns False if the blob already existed"""
+    dest_path = get_blob_path(digest)
+    try:
+        # Mark an existing blob as in use, so the storage reconciler leaves it alone while the photo is committed
+        os.utime(dest_path)
+    except FileNotFoundError:
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        os.replace(tmp_path, dest_path)
+        return True
+
+    os.remove(tmp_path)
+    return False
+
+def store_stream(stream):
+    """
+    Write a stream to the blob store, hashing it as it is written
+    Returns a StoredBlob; `created` is False when identical content was already stored.
+    """
+    tmp_path = get_tmp_path()
+    digest = hashlib.sha256()
+    size = 0
+
+    try:
+        with open(tmp_path, 'wb') as tmp_file:
+            while True:
+                chunk = stream.read(HASH_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                tmp_file.write(chunk)
+                size += len(chunk)
+
+        digest = digest.hexdigest()
+        return StoredBlob(digest, size, _commit_tmp_file(tmp_path, digest))
+
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def store_tmp_file(tmp_path, digest, size):
+    """Move an already hashed temporary file into the blob store"""
+    return StoredBlob(digest, size, _commit_tmp_file(tmp_path, digest))
+
+def store_upload(file):
+    """Store an uploaded werkzeug FileStorage in the blob store"""
+    return store_stream(file.stream)
+
+def ensure_blob(digest, size):
+    """Create the Blob row for stored content unless it exists; its references are counted on flush"""
+    from models import Blob
+
+    table = Blob.__table__
+    connection = db.session.connection()
+
+    dialect = connection.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+
+        connection.execute(
+            insert(table).values(digest=digest, size=size, ref_count=0).on_conflict_do_nothing(index_elements=[table.c.digest])
+        )
+        return
+
+    # Other databases: insert only if missing
+    exists = connection.execute(select(table.c.digest).where(table.c.digest == digest)).first()
+    if not exists:
+        connection.execute(table.insert().values(digest=digest, size=size, ref_count=0))
+
+def get_known_phash(digest):
+    """Get the perceptual hash already computed for identical content, if any"""
+    from models import Photo
+
+    return db.session.query(Photo.phash).filter(
+        Photo.blob_digest == digest,
+        Photo.phash.isnot(None)
+    ).limit(1).scalar()
+
+def _blob_digest_change(photo):
+    """Get (old_digest, new_digest) for a photo in the current flush"""
+    history = inspect(photo).attrs.blob_digest.history
+    old = history.deleted[0] if history.deleted else (history.unchanged[0] if history.unchanged else None)
+    new = history.added[0] if history.added else old
+    return old, new
+
+def update_blob_references(connection, ref_deltas):
+    """
+    Apply reference count deltas and delete the rows of blobs nobody references
+    Returns the digests whose rows were deleted
+    """
+    from models import Blob
+
+    table = Blob.__table__
+
+    # One UPDATE per distinct delta, usually just +1 or -1
+    by_delta = {}
+    for digest, delta in ref_deltas.items():
+        if delta:
+            by_delta.setdefault(delta, []).append(digest)
+
+    for delta, digests in by_delta.items():
+        connection.execute(
+            table.update()
+            .where(table.c.digest.in_(digests))
+            .values(ref_count=table.c.ref_count + delta)
+        )
+
+    released = [digest for digest, delta in ref_deltas.items() if delta < 0]
+    if not released:
+        return []
+
+    orphaned = list(connection.execute(
+        select(table.c.digest).where(table.c.digest.in_(released), table.c.ref_count <= 0)
+    ).scalars())
+    if orphaned:
+        connection.execute(table.delete().where(table.c.digest.in_(orphaned), table.c.ref_count <= 0))
+    return orphaned
+
+@event.listens_for(db.session, 'after_flush')
+def _track_blob_references(session, flush_context):
+    """Count the blob references added and dropped by Photo inserts, updates and deletes"""
+    from models import Photo
+
+    ref_deltas = Counter()
+
+    for photo in session.new:
+        if isinstance(photo, Photo) and photo.blob_digest:
+            ref_deltas[photo.blob_digest] += 1
+
+    for photo in session.deleted:
+        if isinstance(photo, Photo):
+            old, _ = _blob_digest_change(photo)
+            if old:
+                ref_deltas[old] -= 1
+
+    for photo in session.dirty:
+        if not isinstance(photo, Photo) or photo in session.deleted:
+            continue
+        old, new = _blob_digest_change(photo)
+        if old != new:
+            if old:
+                ref_deltas[old] -= 1
+            if new:
+                ref_deltas[new] += 1
+
+    if not ref_deltas:
+        return
+
+    update_blob_references(session.connection(), ref_deltas)
+
+def migrate_legacy_photos(batch_size=200):
+    """
+    Move photos uploaded before content addressing into the blob store
+    Each legacy file is hard linked (or copied) to its blob path and unlinked only
+    after the batch commits, so an interrupted run can simply be started again.
+    Returns (migrated, missing) photo counts.
+    """
+    import shutil
+    from models import Photo
+    from thumbnail_utils import DERIVATIVE_SIZES, get_legacy_derivative_path
+
+    last_id = 0
+    migrated = missing = 0
+
+    while True:
+        photos = Photo.query.filter(
+            Photo.id > last_id,
+            Photo.blob_digest.is_(None)
+        ).order_by(Photo.id).limit(batch_size).all()
+        if not photos:
+            break
+        last_id = photos[-1].id
+
+        legacy_paths = []
+        for photo in photos:
+            legacy_path = get_legacy_path(photo.room_id, photo.filename)
+            if not os.path.exists(legacy_path):
+                logger.warning(f"Photo {photo.id} has no file at {legacy_path}, leaving it as is")
+                missing += 1
+                continue
+
+            digest, size = hash_file(legacy_path)
+
+            dest_path = get_blob_path(digest)
+            if not os.path.exists(dest_path):
+                tmp_path = get_tmp_path()
+                try:
+                    os.link(legacy_path, tmp_path)
+                except OSError:
+                    shutil.copyfile(legacy_path, tmp_path)
+                _commit_tmp_file(tmp_path, digest)
+
+            ensure_blob(digest, size)
+            photo.blob_digest = digest
+            legacy_paths.append(legacy_path)
+            legacy_paths.extend(get_legacy_derivative_path(photo.room_id, photo.filename, size_name) for size_name in DERIVATIVE_SIZES)
+            migrated += 1
+
+        db.session.commit()
+
+        for path in legacy_paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    logger.info(f"Moved {migrated} photos into the blob store, {missing} had no file")
+    return migrated, missing
@@ -0,0 +1,64 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, init_db, db
+
+@pytest.fixture
+def app(tmp_path):
+    """An app on a fresh SQLite database, with an app context pushed"""
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'test.db'}",
+        'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+        'TESTING': True,
+    })
+    init_db(app)
+    with app.app_context():
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+
+def add_room():
+    from models import User, Room
+
+    user = User(username='owner', email='owner@example.com', password_hash='-')
+    db.session.add(user)
+    db.session.flush()
+    room = Room(name='room', creator_id=user.id, is_public=True)
+    db.session.add(room)
+    db.session.commit()
+    return room
+
+@pytest.fixture
+def room(app):
+    return add_room()
+
+@pytest.fixture
+def make_app(tmp_path):
+    """Build apps side by side, each on its own database with one room, without pushing a context"""
+    apps = []
+
+    def make_app(name):
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / f'{name}.db'}",
+            'UPLOAD_FOLDER': str(tmp_path / name / 'uploads'),
+            'COUNTER_JOURNAL_DIR': str(tmp_path / name / 'counters'),
+            'TESTING': True,
+        })
+        init_db(app)
+        with app.app_context():
+            add_room()
+            db.session.remove()
+        apps.append(app)
+        return app
+
+    yield make_app
+
+    for app in apps:
+        app.extensions['analytics_buffer'].shutdown()
+        app.extensions['counter_buffer'].shutdown()
+        with app.app_context():
+            db.engine.dispose()
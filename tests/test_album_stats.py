@@ -0,0 +1,52 @@
+"""
+Album photo counts and covers follow photos moved between albums, including
+photos whose attributes a commit has expired.
+"""
+
+from app import db
+
+def make_album(room, name):
+    from models import Album
+
+    album = Album(name=name, room_id=room.id)
+    db.session.add(album)
+    db.session.commit()
+    return album.id
+
+def album_stats(album_id):
+    from models import Album
+
+    db.session.expire_all()
+    album = db.session.get(Album, album_id)
+    return album.photo_count, album.cover_photo_id
+
+def test_moving_expired_photo_updates_both_albums(app, room):
+    from models import Photo
+
+    first, second = make_album(room, 'first'), make_album(room, 'second')
+    photo = Photo(filename='a.jpg', original_filename='a.jpg', user_id=room.creator_id, room_id=room.id, album_id=first)
+    db.session.add(photo)
+    db.session.commit()
+    assert album_stats(first) == (1, photo.id)
+
+    # The commit expired the photo, so its old album_id isn't loaded when it is replaced
+    photo = db.session.get(Photo, photo.id)
+    db.session.expire(photo)
+    photo.album_id = second
+    db.session.commit()
+
+    assert album_stats(first) == (0, None)
+    assert album_stats(second) == (1, photo.id)
+
+def test_deleting_expired_photo_updates_its_album(app, room):
+    from models import Photo
+
+    album_id = make_album(room, 'album')
+    photo = Photo(filename='a.jpg', original_filename='a.jpg', user_id=room.creator_id, room_id=room.id, album_id=album_id)
+    db.session.add(photo)
+    db.session.commit()
+
+    db.session.delete(db.session.get(Photo, photo.id))
+    db.session.commit()
+
+    assert album_stats(album_id) == (0, None)
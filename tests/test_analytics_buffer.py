@@ -0,0 +1,29 @@
+"""
+Each app buffers its own analytics events, so an event is written to the
+database of the app that recorded it even when several apps share a process.
+"""
+
+from datetime import datetime
+
+from app import db
+from analytics_buffer import analytics_buffer
+
+def count_events(app):
+    from models import Analytics
+
+    with app.app_context():
+        count = Analytics.query.filter_by(event_type='view').count()
+        db.session.remove()
+        return count
+
+def test_events_go_to_the_app_that_recorded_them(make_app):
+    first = make_app('first')
+    second = make_app('second')
+    assert first.extensions['analytics_buffer'] is not second.extensions['analytics_buffer']
+
+    with first.app_context():
+        analytics_buffer.add({'room_id': 1, 'event_type': 'view', 'timestamp': datetime.utcnow()})
+        analytics_buffer.flush()
+
+    assert count_events(first) == 1
+    assert count_events(second) == 0
@@ -0,0 +1,25 @@
+"""
+Blob reference counts follow photos pointed at other content, including
+photos whose attributes a commit has expired.
+"""
+
+from app import db
+
+def test_changing_expired_photo_digest_moves_its_reference(app, room):
+    from models import Blob, Photo
+
+    old, new = 'a' * 64, 'b' * 64
+    db.session.add_all([Blob(digest=old, size=1, ref_count=0), Blob(digest=new, size=1, ref_count=0)])
+    db.session.commit()
+    photo = Photo(filename=old, original_filename='a.jpg', user_id=room.creator_id, room_id=room.id, blob_digest=old)
+    db.session.add(photo)
+    db.session.commit()
+
+    # The commit expired the photo, so its old digest isn't loaded when it is replaced
+    photo.blob_digest = new
+    db.session.commit()
+
+    db.session.expire_all()
+    assert db.session.get(Blob, new).ref_count == 1
+    # The old blob lost its last reference, so its row is gone
+    assert db.session.get(Blob, old) is None
@@ -0,0 +1,44 @@
+"""
+Each app buffers its own counter increments in a journal directory of its
+own, so a count is added to the database of the app that recorded it even
+when several apps share a process.
+"""
+
+import os
+
+from app import db
+from counter_buffer import counter_buffer
+
+def add_photo(app):
+    from models import Photo
+
+    with app.app_context():
+        photo = Photo(filename='1.jpg', original_filename='1.jpg', user_id=1, room_id=1)
+        db.session.add(photo)
+        db.session.commit()
+        photo_id = photo.id
+        db.session.remove()
+        return photo_id
+
+def download_count(app, photo_id):
+    from models import Photo
+
+    with app.app_context():
+        count = db.session.get(Photo, photo_id).download_count or 0
+        db.session.remove()
+        return count
+
+def test_counts_go_to_the_app_that_recorded_them(make_app):
+    first = make_app('first')
+    second = make_app('second')
+    photo_id = add_photo(first)
+    assert add_photo(second) == photo_id
+
+    with first.app_context():
+        counter_buffer.increment('photo_download', photo_id)
+        counter_buffer.increment('photo_download', photo_id)
+        assert counter_buffer.journal_dir.startswith(os.path.dirname(first.config['UPLOAD_FOLDER']))
+        counter_buffer.flush()
+
+    assert download_count(first, photo_id) == 2
+    assert download_count(second, photo_id) == 0
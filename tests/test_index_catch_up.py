@@ -0,0 +1,65 @@
+"""
+The in-memory duplicate and face indexes must pick up rows that commit out of
+id order, as they can on Postgres: a transaction holding id N commits after
+one holding N + 1 has already been read.
+"""
+
+import numpy as np
+import pytest
+
+from app import db
+import duplicate_utils
+import face_index
+
+@pytest.fixture(autouse=True)
+def fresh_indexes(app):
+    duplicate_utils.reset_indexes()
+    face_index.clear_face_indexes()
+    face_index._last_seen_tag_id = None
+    face_index._pending_tag_ids.clear()
+
+def add_photo(room, photo_id, phash=None):
+    from models import Photo
+
+    db.session.add(Photo(id=photo_id, filename=f'{photo_id}.jpg', original_filename=f'{photo_id}.jpg',
+                         user_id=room.creator_id, room_id=room.id, phash=phash))
+    db.session.commit()
+
+def test_duplicate_committed_below_seen_id_is_found(app, room):
+    add_photo(room, 10, phash=0)
+    add_photo(room, 12, phash=0x0FFFFFFF)
+    assert duplicate_utils.find_duplicate(room.id, 0x0FFFFFFF).id == 12
+
+    # Id 11 was handed out before 12 but commits after 12 was read
+    add_photo(room, 11, phash=0x7FFF0000)
+    assert duplicate_utils.find_duplicate(room.id, 0x7FFF0000).id == 11
+    assert 11 not in duplicate_utils._pending_photo_ids
+
+def test_duplicate_index_holds_each_photo_once(app, room):
+    add_photo(room, 1, phash=5)
+    duplicate_utils.find_duplicate(room.id, 5)
+    add_photo(room, 2, phash=5)
+    duplicate_utils.find_duplicate(room.id, 5)
+    duplicate_utils.find_duplicate(room.id, 5)
+
+    index = duplicate_utils._indexes[room.id]
+    assert sorted(index._photo_ids[:index.size]) == [1, 2]
+
+def test_face_committed_below_seen_id_is_matched(app, room):
+    from models import PhotoTag
+
+    add_photo(room, 1)
+    rng = np.random.RandomState(0)
+    embeddings = {tag_id: rng.rand(face_index.EMBEDDING_SIZE).astype(np.float32) for tag_id in (1, 2, 3)}
+
+    for tag_id in (1, 3):
+        db.session.add(PhotoTag(id=tag_id, photo_id=1, tag_name='a', embedding=face_index.encode_embedding(embeddings[tag_id])))
+    db.session.commit()
+    face_index.get_face_index(room.id)
+
+    db.session.add(PhotoTag(id=2, photo_id=1, tag_name='b', embedding=face_index.encode_embedding(embeddings[2])))
+    db.session.commit()
+
+    index = face_index.get_face_index(room.id)
+    assert index.candidates(embeddings[2], 0.01)[0][0] == 2
+    assert sorted(index._tag_ids[:index.size]) == [1, 2, 3]
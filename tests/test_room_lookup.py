@@ -0,0 +1,34 @@
+"""
+A view gets the Room its access check loaded, so a photo page on a cold
+permission cache reads the room once.
+"""
+
+import re
+
+from sqlalchemy import event
+
+from app import db
+from permission_utils import clear_permission_cache
+
+def test_photo_view_loads_room_once(app, room):
+    from models import Photo
+
+    photo = Photo(filename='1.jpg', original_filename='1.jpg', user_id=room.creator_id, room_id=room.id)
+    db.session.add(photo)
+    db.session.commit()
+    photo_id = photo.id
+    db.session.remove()
+    clear_permission_cache()
+
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        response = app.test_client().get(f'/photo/{photo_id}')
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+    assert response.status_code == 200
+    assert sum(bool(re.search(r'\bFROM room\b', statement)) for statement in statements) == 1
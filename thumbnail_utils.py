@@ -0,0 +1,122 @@
+"""
+Thumbnail Utilities for the Photo Sharing App
+This module builds and caches resized derivatives (grid thumbnail, medium
+preview) of uploaded photos so pages never have to ship the full original.
+"""
+
+import os
+import uuid
+import logging
+from flask import current_app
+from storage_utils import fan_out, get_blob_path, get_photo_path
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Longest edge in pixels for each derivative; 'original' is served as uploaded
+DERIVATIVE_SIZES = {
+    'grid': 400,
+    'medium': 1200,
+}
+
+ORIGINAL_SIZE = 'original'
+
+# Derivatives of content-addressed blobs are shared by every photo with the same content
+DERIVED_DIR = 'derived'
+# Name of the cache directory created next to the originals in each legacy room folder
+THUMBNAIL_DIR = 'thumbs'
+
+def is_valid_size(size):
+    """Check if a derivative size name is known"""
+    return size == ORIGINAL_SIZE or size in DERIVATIVE_SIZES
+
+def get_blob_derivative_path(digest, size):
+    """
+    Get the cache path of a blob's derivative
+    Layout: <UPLOAD_FOLDER>/derived/<size>/ab/cd/<digest>
+    """
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], DERIVED_DIR, size, *fan_out(digest))
+
+def get_legacy_derivative_path(room_id, filename, size):
+    """
+    Get the cache path of a derivative of a photo not yet in the blob store
+    Layout: <UPLOAD_FOLDER>/<room_id>/thumbs/<size>/<filename>
+    """
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], str(room_id), THUMBNAIL_DIR, size, filename)
+
+def get_derivative_path(photo, size):
+    """Get the cache path of a photo's derivative"""
+    if size == ORIGINAL_SIZE:
+        return get_photo_path(photo)
+    if photo.blob_digest:
+        return get_blob_derivative_path(photo.blob_digest, size)
+    return get_legacy_derivative_path(photo.room_id, photo.filename, size)
+
+def generate_derivative(source_path, dest_path, max_dimension):
+    """
+    Resize an image so its longest edge is at most max_dimension and write it to dest_path
+    The file is written to a temporary name first so concurrent readers never see a partial image
+    """
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        logger.warning("Pillow is not installed, thumbnails are disabled")
+        return False
+
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+    tmp_path = f"{dest_path}.{uuid.uuid4().hex}.tmp"
+
+    try:
+        with Image.open(source_path) as image:
+            image_format = image.format
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((max_dimension, max_dimension))
+
+            if image_format == 'JPEG':
+                if image.mode not in ('RGB', 'L'):
+                    image = image.convert('RGB')
+                image.save(tmp_path, format='JPEG', quality=85, optimize=True, progressive=True)
+            else:
+                image.save(tmp_path, format=image_format)
+
+        os.replace(tmp_path, dest_path)
+        return True
+
+    except Exception as e:
+        logger.error(f"Error generating derivative {dest_path}: {str(e)}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+
+def ensure_derivative(photo, size):
+    """
+    Get the path of a photo's derivative, building it first if it is not cached yet
+    Falls back to the original if the derivative cannot be built
+    """
+    source_path = get_photo_path(photo)
+    if size == ORIGINAL_SIZE:
+        return source_path
+
+    dest_path = get_derivative_path(photo, size)
+    if os.path.exists(dest_path):
+        return dest_path
+
+    if not os.path.exists(source_path):
+        return None
+
+    if generate_derivative(source_path, dest_path, DERIVATIVE_SIZES[size]):
+        return dest_path
+    return source_path
+
+def generate_blob_derivatives(digest):
+    """Build every derivative size of stored content before any photo references it; cached ones are reused"""
+    source_path = get_blob_path(digest)
+    for size, max_dimension in DERIVATIVE_SIZES.items():
+        dest_path = get_blob_derivative_path(digest, size)
+        if not os.path.exists(dest_path):
+            generate_derivative(source_path, dest_path, max_dimension)
+
+def generate_derivatives(photo):
+    """Build every derivative size for a freshly uploaded photo; cached ones are reused"""
+    for size in DERIVATIVE_SIZES:
+        ensure_derivative(photo, size)
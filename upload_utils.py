@@ -0,0 +1,452 @@
+"""
+Upload Utilities for the Photo Sharing App
+Large photos are uploaded in sessions: the client creates a session with the
+file's name and size, PUTs chunks at increasing offsets and then completes it.
+Chunks are streamed straight into a temporary file in the blob store, so a
+worker holds at most one read buffer however large the file is, and a client
+that loses its connection asks for the session's offset and carries on.
+
+Files sent together in one form are stored as a batch: validating, writing,
+hashing and resizing run on a bounded pool of threads, then every photo is
+created in a single transaction with a savepoint per file.
+"""
+
+import os
+import hashlib
+import logging
+import secrets
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import current_app
+from werkzeug.utils import secure_filename
+from app import db
+from storage_utils import (
+    HASH_CHUNK_SIZE, get_tmp_path, hash_file, store_tmp_file, store_upload, ensure_blob,
+    get_blob_path, get_known_phash
+)
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Chunks must stay below MAX_CONTENT_LENGTH, which still applies to every request
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+DEFAULT_MAX_UPLOAD_SIZE = 1024 * 1024 * 1024
+DEFAULT_SESSION_TTL = timedelta(hours=24)
+# Threads storing the files of one batch upload
+DEFAULT_UPLOAD_WORKERS = 4
+
+# Accepted file extensions and the image type their content must start with
+EXTENSION_TYPES = {
+    'jpg': 'jpeg',
+    'jpeg': 'jpeg',
+    'png': 'png',
+    'gif': 'gif',
+    'heic': 'heif',
+    'heif': 'heif',
+    'dng': 'tiff',
+}
+
+HEIF_BRANDS = {b'heic', b'heix', b'hevc', b'hevx', b'heim', b'heis', b'mif1', b'msf1'}
+
+# Bytes needed to recognize every type above
+SNIFF_SIZE = 16
+
+# One file of a batch after the thread pool has handled it; `error` is set if it was refused
+PreparedFile = namedtuple('PreparedFile', ['filename', 'original_filename', 'stored', 'phash', 'error'])
+# Outcome of one file of a batch; `duplicate_of` is the id of the photo it duplicates, if any
+BatchUpload = namedtuple('BatchUpload', ['filename', 'photo_id', 'duplicate_of'])
+BatchFailure = namedtuple('BatchFailure', ['filename', 'error', 'duplicate_of'])
+
+# In-progress SHA-256 state by upload id, for chunks that arrive at the process
+# that handled the previous one; other uploads are hashed from disk on completion
+MAX_CACHED_HASHERS = 256
+_hashers = OrderedDict()
+_hashers_lock = threading.Lock()
+
+class UploadError(Exception):
+    """An upload request that can't be accepted, with the HTTP status to answer with"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+class DuplicateRejected(Exception):
+    """A near-duplicate upload refused by the 'reject' duplicate action"""
+
+    def __init__(self, duplicate):
+        super().__init__(f'Near-duplicate of {duplicate.original_filename}')
+        self.duplicate = duplicate
+
+def get_chunk_size():
+    """Get the chunk size clients are told to use"""
+    return current_app.config.get('UPLOAD_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+
+def get_max_upload_size():
+    """Get the largest file an upload session accepts"""
+    return current_app.config.get('MAX_UPLOAD_SIZE', DEFAULT_MAX_UPLOAD_SIZE)
+
+def get_session_ttl():
+    """Get how long an upload session stays resumable after its last chunk"""
+    return current_app.config.get('UPLOAD_SESSION_TTL', DEFAULT_SESSION_TTL)
+
+def get_upload_workers():
+    """Get how many threads store the files of one batch upload"""
+    return current_app.config.get('UPLOAD_WORKERS', DEFAULT_UPLOAD_WORKERS)
+
+def get_extension(filename):
+    """Get the lowercase extension of a file name, or '' if it has none"""
+    return filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+
+def is_allowed_extension(filename):
+    """Check if a file name has an accepted extension"""
+    return get_extension(filename) in EXTENSION_TYPES
+
+def sniff_image_type(header):
+    """Get the image type from a file's first bytes, or None if it is not one we accept"""
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if header[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if header[4:8] == b'ftyp' and header[8:12] in HEIF_BRANDS:
+        return 'heif'
+    if header[:4] in (b'II*\x00', b'MM\x00*'):
+        return 'tiff'
+    return None
+
+def _read_at_least(stream, size):
+    """Read from a stream until `size` bytes or the end, since a read may return less"""
+    data = b''
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+def _take_hasher(upload_id, offset):
+    """Get the hash state for a chunk at `offset`, or None if it has to be rebuilt from disk"""
+    with _hashers_lock:
+        entry = _hashers.pop(upload_id, None)
+    if entry and entry[0] == offset:
+        return entry[1]
+    if offset == 0:
+        return hashlib.sha256()
+    return None
+
+def _keep_hasher(upload_id, offset, hasher):
+    with _hashers_lock:
+        _hashers[upload_id] = (offset, hasher)
+        while len(_hashers) > MAX_CACHED_HASHERS:
+            _hashers.popitem(last=False)
+
+def get_upload_tmp_path(upload):
+    """Get the temporary file an upload session's chunks are written to"""
+    return get_tmp_path(f"upload_{upload.id}")
+
+def create_upload_session(room, user_id, filename, total_size, description=None):
+    """Start an upload session for one file"""
+    from models import UploadSession
+
+    original_filename = secure_filename(filename or '')
+    if not is_allowed_extension(original_filename):
+        raise UploadError('File type not allowed', 415)
+
+    if not isinstance(total_size, int) or total_size <= 0:
+        raise UploadError('File size must be a positive number of bytes')
+    if total_size > get_max_upload_size():
+        raise UploadError('File is too large', 413)
+
+    now = datetime.utcnow()
+    upload = UploadSession(
+        id=secrets.token_hex(16),
+        room_id=room.id,
+        user_id=user_id,
+        original_filename=original_filename,
+        description=description,
+        total_size=total_size,
+        received=0,
+        status='open',
+        created_at=now,
+        updated_at=now,
+        expires_at=now + get_session_ttl()
+    )
+    db.session.add(upload)
+    db.session.commit()
+    return upload
+
+def _fail_upload(upload, message):
+    """Mark an upload session failed and remove what it received"""
+    upload.status = 'failed'
+    upload.last_error = message
+    upload.updated_at = datetime.utcnow()
+    db.session.commit()
+
+    with _hashers_lock:
+        _hashers.pop(upload.id, None)
+    tmp_path = get_upload_tmp_path(upload)
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+def write_chunk(upload, offset, stream):
+    """
+    Write a chunk starting at `offset` from a stream
+    The offset may repeat data already received (a retried chunk) but may not
+    leave a gap. The first chunk must start with the magic bytes of the type
+    the file's extension promises.
+    """
+    if upload.status != 'open':
+        raise UploadError(f'Upload is {upload.status}', 409)
+    if offset < 0 or offset > upload.received:
+        raise UploadError(f'Expected a chunk at offset {upload.received}', 409)
+
+    tmp_path = get_upload_tmp_path(upload)
+    if offset > 0 and not os.path.exists(tmp_path):
+        # The received data is gone, e.g. purged; the client has to start over
+        upload.received = 0
+        db.session.commit()
+        raise UploadError('Upload data was lost, start again at offset 0', 409)
+
+    hasher = _take_hasher(upload.id, offset)
+    position = offset
+
+    with open(tmp_path, 'r+b' if os.path.exists(tmp_path) else 'wb') as tmp_file:
+        tmp_file.seek(offset)
+
+        if offset == 0:
+            header = _read_at_least(stream, SNIFF_SIZE)
+            expected = EXTENSION_TYPES[get_extension(upload.original_filename)]
+            if sniff_image_type(header) != expected:
+                tmp_file.close()
+                _fail_upload(upload, 'File content does not match its type')
+                raise UploadError('File content does not match its type', 415)
+            chunks = [header]
+        else:
+            chunks = []
+
+        while True:
+            chunk = chunks.pop() if chunks else stream.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            if position + len(chunk) > upload.total_size:
+                raise UploadError('Chunk runs past the declared file size', 413)
+
+            tmp_file.write(chunk)
+            if hasher is not None:
+                hasher.update(chunk)
+            position += len(chunk)
+
+    if hasher is not None and position >= upload.received:
+        _keep_hasher(upload.id, position, hasher)
+
+    now = datetime.utcnow()
+    upload.received = max(upload.received, position)
+    upload.updated_at = now
+    upload.expires_at = now + get_session_ttl()
+    db.session.commit()
+
+def add_photo(room, stored, original_filename, description, user_id, phash=None):
+    """
+    Create the Photo for content already in the blob store
+    Raises DuplicateRejected before writing anything if the room rejects
+    near-duplicates; otherwise flushes the photo and leaves the commit to the caller.
+    Pass `phash` if it was already computed for this content.
+    Returns (photo, duplicate_or_None).
+    """
+    from models import Photo
+    from duplicate_utils import compute_phash, find_duplicate, get_duplicate_action, copy_face_tags
+    from thumbnail_utils import generate_derivatives
+    from job_queue import enqueue_job, get_latest_job
+
+    # Look for a near-duplicate already in the room; content seen before keeps its hash
+    if phash is None and not stored.created:
+        phash = get_known_phash(stored.digest)
+    if phash is None:
+        phash = compute_phash(get_blob_path(stored.digest))
+    duplicate = find_duplicate(room.id, phash)
+
+    if duplicate and get_duplicate_action() == 'reject':
+        raise DuplicateRejected(duplicate)
+
+    ensure_blob(stored.digest, stored.size)
+    photo = Photo(
+        filename=stored.digest,
+        blob_digest=stored.digest,
+        original_filename=original_filename,
+        user_id=user_id,
+        room_id=room.id,
+        description=description,
+        phash=phash,
+        duplicate_of_id=duplicate.id if duplicate else None
+    )
+    db.session.add(photo)
+    db.session.flush()
+
+    # Build grid and preview derivatives up front; identical content reuses them
+    generate_derivatives(photo)
+
+    # Queue face recognition for the background worker if enabled
+    if room.face_recognition_enabled:
+        # A duplicate of an already processed photo reuses its faces
+        original_job = get_latest_job('face_recognition', duplicate.id) if duplicate else None
+        if original_job and original_job.status == 'done':
+            copy_face_tags(duplicate, photo)
+        else:
+            enqueue_job('face_recognition', photo_id=photo.id, room_id=room.id)
+
+    return photo, duplicate
+
+def _prepare_file(app, file):
+    """Validate one file of a batch and store it with its hash and derivatives; runs on a pool thread"""
+    from duplicate_utils import compute_phash
+    from thumbnail_utils import generate_blob_derivatives
+
+    original_filename = secure_filename(file.filename)
+    if not is_allowed_extension(file.filename):
+        return PreparedFile(file.filename, original_filename, None, None, 'File type not allowed')
+
+    with app.app_context():
+        stored = None
+        try:
+            header = _read_at_least(file.stream, SNIFF_SIZE)
+            if sniff_image_type(header) != EXTENSION_TYPES[get_extension(original_filename)]:
+                return PreparedFile(file.filename, original_filename, None, None, 'File content does not match its type')
+            file.stream.seek(0)
+
+            # Save the file once per distinct content, hashing it as it is written
+            stored = store_upload(file)
+            if not stored.created:
+                # Identical content is already hashed and resized
+                return PreparedFile(file.filename, original_filename, stored, None, None)
+
+            phash = compute_phash(get_blob_path(stored.digest))
+            generate_blob_derivatives(stored.digest)
+            return PreparedFile(file.filename, original_filename, stored, phash, None)
+
+        except Exception as e:
+            logger.error(f"Error storing upload {file.filename}: {str(e)}")
+            return PreparedFile(file.filename, original_filename, stored, None, str(e))
+
+def add_photo_batch(room, files, description, user_id):
+    """
+    Store the files of one multipart upload and create their photos in one transaction
+    The files are validated, written, hashed and resized on at most
+    UPLOAD_WORKERS threads. Their photos are then added in order, each in its
+    own savepoint, so a failing or rejected file is rolled back alone and one
+    commit makes the rest visible. Blobs written for files that did not make
+    it into the commit are left to storage_reconciler, since a concurrent
+    upload of the same content may be using them.
+    Returns (uploads, failures) as lists of BatchUpload and BatchFailure.
+    """
+    from database_utils import begin_write
+    from duplicate_utils import reset_indexes
+
+    app = current_app._get_current_object()
+    with ThreadPoolExecutor(max_workers=max(1, min(get_upload_workers(), len(files)))) as pool:
+        prepared = list(pool.map(lambda file: _prepare_file(app, file), files))
+
+    uploads = []
+    failures = []
+    added = []
+
+    if any(item.error is None for item in prepared):
+        begin_write(db.session)
+
+    for item in prepared:
+        if item.error is not None:
+            failures.append(BatchFailure(item.filename, item.error, None))
+            continue
+
+        try:
+            with db.session.begin_nested():
+                photo, duplicate = add_photo(room, item.stored, item.original_filename, description, user_id, item.phash)
+            uploads.append(BatchUpload(item.original_filename, photo.id, duplicate.id if duplicate else None))
+            added.append(item)
+
+        except DuplicateRejected as e:
+            failures.append(BatchFailure(item.filename, str(e), e.duplicate.id))
+
+        except Exception as e:
+            logger.error(f"Error uploading photo {item.filename}: {str(e)}")
+            failures.append(BatchFailure(item.filename, str(e), None))
+
+    try:
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        # The duplicate indexes may have picked up photos that were never committed
+        reset_indexes()
+        logger.error(f"Error committing upload batch: {str(e)}")
+        failures.extend(BatchFailure(item.filename, str(e), None) for item in added)
+        uploads = []
+
+    return uploads, failures
+
+def complete_upload(upload, room):
+    """
+    Move a fully received upload into the blob store and create its photo
+    Completing an already completed session returns the same photo again.
+    Returns (photo, duplicate_or_None).
+    """
+    from models import Photo
+
+    if upload.status == 'complete':
+        return db.session.get(Photo, upload.photo_id), None
+    if upload.status != 'open':
+        raise UploadError(f'Upload is {upload.status}', 409)
+    if upload.received < upload.total_size:
+        raise UploadError(f'Upload is incomplete, expected a chunk at offset {upload.received}', 409)
+
+    tmp_path = get_upload_tmp_path(upload)
+    if not os.path.exists(tmp_path):
+        upload.received = 0
+        db.session.commit()
+        raise UploadError('Upload data was lost, start again at offset 0', 409)
+
+    # Drop anything a rejected oversized chunk left past the declared size
+    os.truncate(tmp_path, upload.total_size)
+
+    hasher = _take_hasher(upload.id, upload.total_size)
+    digest = hasher.hexdigest() if hasher is not None else hash_file(tmp_path)[0]
+    stored = store_tmp_file(tmp_path, digest, upload.total_size)
+
+    try:
+        photo, duplicate = add_photo(room, stored, upload.original_filename, upload.description, upload.user_id)
+        upload.status = 'complete'
+        upload.photo_id = photo.id
+        upload.updated_at = datetime.utcnow()
+        db.session.commit()
+        return photo, duplicate
+
+    except DuplicateRejected as e:
+        _fail_upload(upload, str(e))
+        raise
+
+    except Exception:
+        db.session.rollback()
+        raise
+
+def purge_expired_uploads(now=None):
+    """
+    Delete upload sessions past their expiry and the data they received
+    Returns the number of sessions deleted
+    """
+    from models import UploadSession
+
+    now = now or datetime.utcnow()
+    expired = UploadSession.query.filter(UploadSession.expires_at < now).all()
+
+    for upload in expired:
+        tmp_path = get_upload_tmp_path(upload)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        with _hashers_lock:
+            _hashers.pop(upload.id, None)
+        db.session.delete(upload)
+    db.session.commit()
+
+    logger.info(f"Purged {len(expired)} expired upload sessions")
+    return len(expired)
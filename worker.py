@@ -0,0 +1,59 @@
+"""
+Background worker for the Photo Sharing App
+Claims queued jobs from the database and runs them outside the web process.
+While the queue is empty it runs the maintenance tasks that are due.
+
+Usage: python worker.py [--processes N] [--poll-interval SECONDS] [--once] [--no-maintenance]
+"""
+
+import argparse
+import logging
+import signal
+import multiprocessing
+from app import create_app, configure_logging
+from job_queue import work_loop
+from maintenance import run_due_tasks
+
+# Importing these modules registers their job handlers
+import face_recognition_utils  # noqa: F401
+import batch_processing  # noqa: F401
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+def run_worker(poll_interval, once, maintenance=True):
+    """Run a single worker loop in this process"""
+    work_loop(create_app(), poll_interval=poll_interval, once=once, on_idle=run_due_tasks if maintenance else None)
+
+def main():
+    parser = argparse.ArgumentParser(description='Run background jobs for the photo sharing app')
+    parser.add_argument('--processes', type=int, default=1, help='Number of worker processes')
+    parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds to wait when the queue is empty')
+    parser.add_argument('--once', action='store_true', help='Exit when the queue is empty')
+    parser.add_argument('--no-maintenance', action='store_true', help="Don't run maintenance tasks; use 'flask run-maintenance' instead")
+    args = parser.parse_args()
+    configure_logging()
+
+    if args.processes <= 1:
+        run_worker(args.poll_interval, args.once, not args.no_maintenance)
+        return
+
+    workers = []
+
+    def stop_workers(signum, frame):
+        # Each child finishes its current job on SIGTERM
+        for process in workers:
+            process.terminate()
+
+    signal.signal(signal.SIGTERM, stop_workers)
+
+    for _ in range(args.processes):
+        process = multiprocessing.Process(target=run_worker, args=(args.poll_interval, args.once, not args.no_maintenance))
+        process.start()
+        workers.append(process)
+
+    for process in workers:
+        process.join()
+
+if __name__ == '__main__':
+    main()